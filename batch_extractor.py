@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import fitz
+
+from text_extractor import PageText
+from result_store import ResultStore
+
+def load_region_template(template_path):
+    """
+    加载区域模板文件
+
+    模板为JSON格式，例如：
+        {
+            "name": "invoice",
+            "pages": "1-3",
+            "regions": {
+                "invoice_no": [400, 60, 560, 90],
+                "total": [400, 700, 560, 730]
+            }
+        }
+
+    Args:
+        template_path (str): 模板文件路径
+
+    Returns:
+        dict: 规范化后的模板 {"name": str, "pages": str, "regions": {名称: (x0, y0, x1, y1)}}
+    """
+    with open(template_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return normalize_template(data, default_name=os.path.splitext(os.path.basename(template_path))[0])
+
+def normalize_template(data, default_name="template"):
+    """
+    校验并规范化模板字典
+
+    Args:
+        data (dict): 原始模板数据
+        default_name (str): 模板未指定名称时使用的名称
+
+    Returns:
+        dict: 规范化后的模板
+    """
+    regions = data.get("regions")
+    if not isinstance(regions, dict) or not regions:
+        raise ValueError("模板中缺少 regions 定义")
+
+    normalized = {}
+    for name, coords in regions.items():
+        if isinstance(coords, dict):
+            coords = [coords.get("x0"), coords.get("y0"), coords.get("x1"), coords.get("y1")]
+        if not isinstance(coords, (list, tuple)) or len(coords) != 4:
+            raise ValueError(f"区域坐标格式错误: {name}")
+        x0, y0, x1, y1 = (float(v) for v in coords)
+        # 保证左上角坐标小于右下角坐标
+        normalized[name] = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+    pages = str(data.get("pages", "all"))
+    return {
+        "name": data.get("name", default_name),
+        "pages": pages,
+        "regions": normalized
+    }
+
+def parse_page_selector(selector, page_count):
+    """
+    解析页面选择表达式
+
+    支持 "all"、"last"、"3"、"1-3"、"2-last" 以及逗号分隔的组合（如 "1,3,5-7"），
+    页码从1开始，超出范围的页码会被忽略。
+
+    Args:
+        selector (str): 页面选择表达式
+        page_count (int): 文档总页数
+
+    Returns:
+        list: 从0开始的页码列表（按出现顺序去重）
+    """
+    def to_page(token):
+        token = token.strip().lower()
+        if token == "last":
+            return page_count
+        return int(token)
+
+    pages = []
+    for part in str(selector).split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        if part == "all":
+            candidates = range(1, page_count + 1)
+        elif "-" in part:
+            start, end = part.split("-", 1)
+            candidates = range(to_page(start), to_page(end) + 1)
+        else:
+            candidates = [to_page(part)]
+
+        for page in candidates:
+            if 1 <= page <= page_count and page - 1 not in pages:
+                pages.append(page - 1)
+    return pages
+
+def expand_pdf_paths(patterns):
+    """
+    展开PDF路径列表，支持通配符和目录
+
+    Args:
+        patterns (list): 文件路径、目录或通配符表达式
+
+    Returns:
+        list: 去重后的PDF文件路径列表
+    """
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, "**", "*.pdf"), recursive=True))
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        else:
+            matches = [pattern]
+
+        for path in matches:
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                paths.append(path)
+    return paths
+
+def extract_document(pdf_path, template):
+    """
+    按模板提取单个PDF中所有选中页面的所有区域
+
+    文档只打开一次，所有页面和区域共用同一个 fitz.Document。
+
+    Args:
+        pdf_path (str): PDF文件路径
+        template (dict): 规范化后的模板
+
+    Returns:
+        dict: 单个文档的提取结果及吞吐量统计
+    """
+    start = time.perf_counter()
+    result = {
+        "path": pdf_path,
+        "template": template["name"],
+        "page_count": 0,
+        "pages": [],
+        "regions": [],
+        "error": None
+    }
+
+    try:
+        doc = fitz.open(pdf_path)
+        try:
+            result["page_count"] = len(doc)
+            page_numbers = parse_page_selector(template["pages"], len(doc))
+            for page_num in page_numbers:
+                # 每页只构建一次文本布局，所有区域共用
+                page_text = PageText(doc.load_page(page_num))
+                for name, coords in template["regions"].items():
+                    result["regions"].append({
+                        "page": page_num,
+                        "name": name,
+                        "rect": list(coords),
+                        "text": page_text.text_in_rect(fitz.Rect(coords))
+                    })
+            result["pages"] = page_numbers
+        finally:
+            doc.close()
+    except Exception as e:
+        result["error"] = str(e)
+
+    # 记录单个文档的吞吐量
+    elapsed = time.perf_counter() - start
+    result["elapsed"] = elapsed
+    result["pages_per_sec"] = len(result["pages"]) / elapsed if elapsed > 0 else 0.0
+    result["regions_per_sec"] = len(result["regions"]) / elapsed if elapsed > 0 else 0.0
+    return result
+
+def iter_batch(pdf_paths, template, max_workers=None):
+    """
+    使用进程池批量提取，按完成顺序逐个返回结果
+
+    同时提交的任务数限制为工作进程数的两倍，处理大量文件时内存占用保持恒定。
+
+    Args:
+        pdf_paths (iterable): PDF文件路径
+        template (dict): 规范化后的模板
+        max_workers (int): 工作进程数，默认为CPU核数
+
+    Yields:
+        dict: 单个文档的提取结果
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_workers * 2
+    paths = iter(pdf_paths)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        exhausted = False
+        while True:
+            # 补充任务直到达到提交上限
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    path = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(extract_document, path, template))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def run_batch(pdf_paths, template, max_workers=None, on_result=None):
+    """
+    批量提取并汇总吞吐量
+
+    结果不在内存中累积，每完成一个文档即交给回调处理，汇总只保留累计计数。
+
+    Args:
+        pdf_paths (iterable): PDF文件路径
+        template (dict): 规范化后的模板
+        max_workers (int): 工作进程数，默认为CPU核数
+        on_result (callable): 每完成一个文档时调用的回调函数
+
+    Returns:
+        dict: 汇总统计
+    """
+    start = time.perf_counter()
+    documents = failed = total_pages = total_regions = 0
+    for result in iter_batch(pdf_paths, template, max_workers):
+        documents += 1
+        if result["error"]:
+            failed += 1
+        total_pages += len(result["pages"])
+        total_regions += len(result["regions"])
+        if on_result:
+            on_result(result)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "documents": documents,
+        "failed": failed,
+        "pages": total_pages,
+        "regions": total_regions,
+        "elapsed": elapsed,
+        "documents_per_sec": documents / elapsed if elapsed > 0 else 0.0,
+        "pages_per_sec": total_pages / elapsed if elapsed > 0 else 0.0
+    }
+
+def result_to_records(result):
+    """
+    将单个文档的提取结果转换为结果数据库记录（每个页面区域一条）
+
+    Args:
+        result (dict): extract_document 的返回值
+
+    Returns:
+        list: ResultStore 记录列表
+    """
+    return [
+        {
+            "source": "batch",
+            "pdf_path": result["path"],
+            "page": region["page"],
+            "name": region["name"],
+            "text": region["text"],
+            "meta": {"template": result["template"], "rect": region["rect"]}
+        }
+        for region in result["regions"]
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="按区域模板批量提取PDF文本")
+    parser.add_argument("template", help="区域模板JSON文件")
+    parser.add_argument("pdfs", nargs="+", help="PDF文件、目录或通配符")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="工作进程数")
+    parser.add_argument("-o", "--output", default=None,
+                        help="结果JSONL输出路径（每个文档一行，完成即写入）")
+    parser.add_argument("--store", default=None, help="将结果追加到该SQLite结果数据库（每个文档一个事务）")
+    args = parser.parse_args()
+
+    template = load_region_template(args.template)
+    pdf_paths = expand_pdf_paths(args.pdfs)
+
+    store = ResultStore(args.store) if args.store else None
+    if args.output:
+        out = open(args.output, 'w', encoding='utf-8')
+    elif store is None:
+        out = sys.stdout
+    else:
+        out = None
+
+    def report(result):
+        if store is not None and result["regions"]:
+            store.add_many(result_to_records(result))
+        if out is not None:
+            # 逐行写入并刷新，中途退出时已完成的文档不会丢失
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+        if result["error"]:
+            print(f"提取失败: {result['path']} - {result['error']}", file=sys.stderr)
+        else:
+            print(f"{result['path']}: {len(result['pages'])} 页, {len(result['regions'])} 个区域, "
+                  f"{result['elapsed']:.3f}s ({result['pages_per_sec']:.1f} 页/秒)", file=sys.stderr)
+
+    try:
+        summary = run_batch(pdf_paths, template, args.workers, on_result=report)
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+        if store is not None:
+            store.close()
+
+    print(f"共处理 {summary['documents']} 个文档 (失败 {summary['failed']}), "
+          f"用时 {summary['elapsed']:.2f}s, {summary['documents_per_sec']:.1f} 文档/秒", file=sys.stderr)
+    if args.output:
+        print(f"结果已写入: {args.output}", file=sys.stderr)
+    if store is not None:
+        print(f"结果已写入数据库: {args.store}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
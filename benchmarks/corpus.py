@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import random
+import argparse
+
+import fitz
+
+# 语料库版本，修改生成逻辑时递增，旧语料库会被自动重新生成
+CORPUS_VERSION = 1
+
+# 默认的语料库目录
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+# 固定的随机种子和文档元数据，保证每次生成的内容一致
+SEED = 20240501
+FIXED_DATE = "D:20240101000000Z"
+
+WORDS = (
+    "invoice total amount date number customer address payment tax item quantity price "
+    "发票 金额 日期 客户 地址 数量 单价 合计 税率 备注 PDF region extract text layout"
+).split()
+
+def _random_line(rng, length):
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+def _finish(doc, path):
+    doc.set_metadata({
+        "title": os.path.splitext(os.path.basename(path))[0],
+        "producer": "pdf-extract benchmark corpus",
+        "creationDate": FIXED_DATE,
+        "modDate": FIXED_DATE
+    })
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+def make_text_heavy(path, pages=20):
+    """生成文本密集的A4文档（每页约70行小字号文本）"""
+    rng = random.Random(SEED)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=595, height=842)
+        # 每页一次性插入所有行（fontsize 7 时行距 11pt）
+        lines = [_random_line(rng, 100) for _ in range(70)]
+        page.insert_text((36, 40), "\n".join(lines), fontsize=7, lineheight=11 / 7, fontname="china-s")
+    _finish(doc, path)
+
+def make_rotated(path, pages=8):
+    """生成横向页面和带旋转属性(0/90/180/270°)页面交替的文档"""
+    rng = random.Random(SEED + 1)
+    doc = fitz.open()
+    for i in range(pages):
+        if i % 2:
+            page = doc.new_page(width=842, height=595)
+        else:
+            page = doc.new_page(width=595, height=842)
+        lines = [_random_line(rng, 60) for _ in range(int((page.rect.height - 90) // 16) + 1)]
+        page.insert_text((40, 50), "\n".join(lines), fontsize=10, lineheight=1.6, fontname="china-s")
+        page.set_rotation((i // 2 % 4) * 90)
+    _finish(doc, path)
+
+def make_image_only(path, pages=10, width=1240, height=1754):
+    """生成只有扫描图像、没有文本层的文档（约150 DPI的A4图像）"""
+    rng = random.Random(SEED + 2)
+    doc = fitz.open()
+    for _ in range(pages):
+        # 白底RGB像素缓冲区，用深色矩形块模拟文字行
+        samples = bytearray(b"\xff" * (width * height * 3))
+        y = 80
+        while y < height - 80:
+            x = 80
+            while x < width - 120:
+                block = min(rng.randint(20, 90), width - 80 - x)
+                shade = rng.randint(0, 80)
+                run = bytes((shade,)) * (block * 3)
+                for row in range(y, y + 14):
+                    start = (row * width + x) * 3
+                    samples[start:start + block * 3] = run
+                x += block + rng.randint(8, 24)
+            y += 28
+        pix = fitz.Pixmap(fitz.csRGB, width, height, bytes(samples), False)
+        page = doc.new_page(width=595, height=842)
+        page.insert_image(page.rect, pixmap=pix)
+    _finish(doc, path)
+
+def make_large(path, pages=1000):
+    """生成页数很多、每页文本较少的文档"""
+    rng = random.Random(SEED + 3)
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((36, 40), f"Page {i + 1}", fontsize=14)
+        lines = [_random_line(rng, 80) for _ in range(12)]
+        page.insert_text((36, 80), "\n".join(lines), fontsize=9, lineheight=14 / 9)
+    _finish(doc, path)
+
+def corpus_spec(large_pages=1000):
+    """
+    语料库中的文档及其生成参数
+
+    Args:
+        large_pages (int): 大文档的页数
+
+    Returns:
+        dict: 文档名 -> (生成函数, 参数字典)
+    """
+    return {
+        "text_heavy": (make_text_heavy, {"pages": 20}),
+        "rotated": (make_rotated, {"pages": 8}),
+        "image_only": (make_image_only, {"pages": 10}),
+        "large": (make_large, {"pages": large_pages})
+    }
+
+def generate_corpus(corpus_dir=DEFAULT_CORPUS_DIR, large_pages=1000, force=False):
+    """
+    生成（或复用）合成PDF语料库
+
+    目录中的 manifest.json 记录语料库版本、生成参数和 PyMuPDF 版本，三者都一致时直接复用已有文件。
+
+    Args:
+        corpus_dir (str): 语料库目录
+        large_pages (int): 大文档的页数
+        force (bool): 是否强制重新生成
+
+    Returns:
+        dict: 语料库清单 {"version", "pymupdf", "documents": {文档名: {"path", "pages", ...}}}
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest_path = os.path.join(corpus_dir, "manifest.json")
+    spec = corpus_spec(large_pages)
+    params = {name: kwargs for name, (_, kwargs) in spec.items()}
+
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if (manifest.get("version") == CORPUS_VERSION
+                and manifest.get("pymupdf") == fitz.VersionBind
+                and manifest.get("params") == params
+                and all(os.path.exists(doc["path"]) for doc in manifest["documents"].values())):
+            return manifest
+
+    documents = {}
+    for name, (make, kwargs) in spec.items():
+        path = os.path.join(corpus_dir, f"{name}.pdf")
+        print(f"生成 {path} ...", file=sys.stderr)
+        make(path, **kwargs)
+        documents[name] = {
+            "path": path,
+            "pages": kwargs["pages"],
+            "bytes": os.path.getsize(path)
+        }
+
+    manifest = {
+        "version": CORPUS_VERSION,
+        "pymupdf": fitz.VersionBind,
+        "params": params,
+        "documents": documents
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="生成基准测试用的合成PDF语料库")
+    parser.add_argument("-d", "--dir", default=DEFAULT_CORPUS_DIR, help="语料库目录")
+    parser.add_argument("--large-pages", type=int, default=1000, help="大文档的页数")
+    parser.add_argument("--force", action="store_true", help="强制重新生成")
+    args = parser.parse_args()
+
+    manifest = generate_corpus(args.dir, args.large_pages, args.force)
+    for name, doc in manifest["documents"].items():
+        print(f"{name}: {doc['path']} ({doc['pages']} 页, {doc['bytes']} 字节)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import gc
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import datetime
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import importlib.util
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import fitz
+
+import text_extractor
+from corpus import DEFAULT_CORPUS_DIR, generate_corpus
+
+# 默认的结果目录
+DEFAULT_RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# 查看器基准测试的缩放比例
+VIEWER_ZOOMS = (0.5, 1.0, 2.0, 4.0)
+
+# 每个文档用于区域提取的页面和选区（查看器像素坐标，缩放比例为1）；
+# 页码超出文档页数时（例如 --large-pages 较小）使用最后一页
+EXTRACTION_CASES = {
+    "text_heavy": (3, fitz.Rect(36, 100, 400, 300)),
+    "rotated": (2, fitz.Rect(40, 40, 360, 260)),
+    "image_only": (0, fitz.Rect(50, 50, 450, 350)),
+    "large": (500, fitz.Rect(30, 30, 400, 200))
+}
+
+def extraction_cases(corpus):
+    """
+    按语料库中各文档的实际页数确定区域提取的页面
+
+    Returns:
+        dict: 文档名 -> (页码, 选区)
+    """
+    cases = {}
+    for name, (page_num, rect) in EXTRACTION_CASES.items():
+        cases[name] = (min(page_num, corpus["documents"][name]["pages"] - 1), rect)
+    return cases
+
+def summarize(samples):
+    """
+    汇总耗时样本（秒），统一以毫秒表示
+
+    Args:
+        samples (list): 每次运行的耗时（秒）
+
+    Returns:
+        dict: n、min、median、mean、p95、max（毫秒）
+    """
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "n": len(ordered),
+        "min_ms": ordered[0] * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p95_ms": p95 * 1000,
+        "max_ms": ordered[-1] * 1000
+    }
+
+def time_call(func, repeat, setup=None):
+    """
+    多次运行函数并统计耗时
+
+    Args:
+        func (callable): 被测函数
+        repeat (int): 运行次数
+        setup (callable): 每次运行前调用（不计入耗时），例如清空缓存
+
+    Returns:
+        dict: summarize 的结果
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def clear_extraction_caches():
+    """清空文档缓存，之后的提取需要重新打开文档、重建页面文本索引"""
+    text_extractor.document_cache.invalidate()
+
+def bench_extraction(corpus, repeat, workdir):
+    """区域提取：extract_text_from_region（冷/热缓存、缩放、诊断模式）与 extract_text_with_formatting"""
+    results = {}
+
+    def new_output():
+        return text_extractor.FolderOutput(tempfile.mkdtemp(dir=workdir))
+
+    cases_by_document = extraction_cases(corpus)
+    for name, (page_num, rect) in cases_by_document.items():
+        path = corpus["documents"][name]["path"]
+        rect_2x = rect * fitz.Matrix(2, 2)
+
+        cases = {
+            "cold": (lambda: text_extractor.extract_text_from_region(path, page_num, rect, output=new_output()),
+                     clear_extraction_caches),
+            "warm": (lambda: text_extractor.extract_text_from_region(path, page_num, rect, output=new_output()),
+                     None),
+            "warm_zoom2": (lambda: text_extractor.extract_text_from_region(path, page_num, rect_2x, zoom=2.0,
+                                                                           output=new_output()), None),
+            "diagnostic": (lambda: text_extractor.extract_text_from_region(path, page_num, rect, diagnostic=True,
+                                                                           output=new_output()), None)
+        }
+        for case, (func, setup) in cases.items():
+            with redirect_stdout(io.StringIO()):
+                func()  # 预热
+                results[f"extract_text_from_region/{name}/{case}"] = time_call(func, repeat, setup)
+
+        def formatting():
+            return text_extractor.extract_text_with_formatting(path, page_num, rect, output=new_output())
+
+        with redirect_stdout(io.StringIO()):
+            formatting()
+            results[f"extract_text_with_formatting/{name}/warm"] = time_call(formatting, repeat)
+
+    # 冷缓存下各阶段的耗时和内存分配，以及提取到的文本长度（用于确认各次运行的结果一致）
+    with redirect_stdout(io.StringIO()):
+        for name, (page_num, rect) in cases_by_document.items():
+            clear_extraction_caches()
+            profiler = text_extractor.StageProfiler(trace_memory=True)
+            text = text_extractor.extract_text_from_region(corpus["documents"][name]["path"], page_num, rect,
+                                                           output=new_output(), profiler=profiler)[0]
+            profiler.close()
+            if text is None:
+                # 提取失败时计时只测到了提前返回，结果没有意义
+                raise RuntimeError(f"区域提取失败: {name} 第 {page_num + 1} 页")
+            results[f"extract_text_from_region/{name}/stages_cold"] = profiler.summary()["stages"]
+            results[f"extract_text_from_region/{name}/text_length"] = len(text or "")
+    return results
+
+def bench_viewer(corpus, repeat):
+    """查看器：PDFViewer.render_page 在不同缩放比例下完成首次绘制的耗时（同步渲染瓦片）"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+        from pdf_viewer import PDFViewer
+    except ImportError as e:
+        return {"skipped": f"PyQt5 不可用: {e}"}
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = {}
+
+    viewer = PDFViewer()
+    viewer.resize(1280, 960)
+    viewer.show()
+    app.processEvents()
+
+    def paint():
+        # 渲染当前页并绘制视口内的瓦片
+        viewer.render_page()
+        app.processEvents()
+        viewer.scroll_area.viewport().grab()
+
+    def clear_tiles():
+        viewer.tile_cache.clear()
+        viewer._display_list = None
+        viewer._display_list_page = None
+
+    try:
+        for name in ("text_heavy", "rotated", "image_only"):
+            with redirect_stdout(io.StringIO()):
+                viewer.load_pdf(corpus["documents"][name]["path"])
+            # 不使用后台线程，瓦片在绘制时同步渲染，耗时计入 render_page
+            viewer.stop_render_worker()
+            for zoom in VIEWER_ZOOMS:
+                viewer.zoom_factor = zoom
+                results[f"render_page/{name}/zoom{zoom}/cold"] = time_call(paint, repeat, clear_tiles)
+                results[f"render_page/{name}/zoom{zoom}/warm"] = time_call(paint, repeat)
+            viewer.zoom_factor = 1.0
+
+        # 大文档中逐页翻页（每页都是新页面）
+        with redirect_stdout(io.StringIO()):
+            viewer.load_pdf(corpus["documents"]["large"]["path"])
+        viewer.stop_render_worker()
+        pages = min(viewer.total_pages, 50 * repeat)
+        samples = []
+        for _ in range(pages - 1):
+            start = time.perf_counter()
+            viewer.next_page()
+            app.processEvents()
+            viewer.scroll_area.viewport().grab()
+            samples.append(time.perf_counter() - start)
+        results["render_page/large/next_page"] = summarize(samples)
+    finally:
+        viewer.stop_render_worker()
+        viewer.close()
+    return results
+
+def load_api_module(api_url):
+    """以指定的上游地址加载 llm-img2json/main.py（默认关闭响应缓存，每次请求都经过上游）"""
+    os.environ["OPENAI_API_KEY"] = os.environ.get("BENCH_OPENAI_API_KEY", "bench-key")
+    os.environ["AI_API_URL"] = api_url
+    os.environ.setdefault("RESPONSE_CACHE_SIZE", "0")
+    os.environ.setdefault("RESPONSE_CACHE_PATH", "")
+    os.environ.setdefault("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "pdf_bench_jobs.db"))
+    api_dir = os.path.join(REPO_ROOT, "llm-img2json")
+    if api_dir not in sys.path:
+        sys.path.insert(0, api_dir)
+    path = os.path.join(api_dir, "main.py")
+    spec = importlib.util.spec_from_file_location("llm_img2json_main", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_test_image(corpus):
+    """从图像文档渲染一张测试用的JPEG图片"""
+    doc = fitz.open(corpus["documents"]["image_only"]["path"])
+    try:
+        pix = doc[0].get_pixmap(dpi=100)
+        return pix.tobytes("jpeg")
+    finally:
+        doc.close()
+
+def make_large_image(width=3000, height=2000, seed=0):
+    """生成一张难以压缩的噪声JPEG，用于测量大文件上传的内存占用"""
+    samples = random.Random(seed).randbytes(width * height * 3)
+    pix = fitz.Pixmap(fitz.csRGB, width, height, samples, False)
+    return pix.tobytes("jpeg", jpg_quality=95)
+
+async def measure_request_memory(make_request):
+    """
+    测量单个请求在进程内的 Python 堆分配峰值（包括测试客户端和桩服务，不包括 Pillow 等 C 库的分配）
+
+    Returns:
+        dict: 峰值字节数及耗时
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        response = await make_request()
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_alloc_bytes": peak, "elapsed_ms": elapsed * 1000}
+
+async def _bench_api(corpus, repeat, concurrency, stub_latency):
+    from aiohttp import web
+    import httpx
+
+    # 本地桩服务：模拟 OpenAI 兼容的 chat/completions 接口
+    stub_requests = {"count": 0}
+
+    async def completions(request):
+        # 分块读取并丢弃请求体，桩服务本身不占用与请求体同样大小的内存
+        size = 0
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+        stub_requests["count"] += 1
+        stub_requests["max_body_bytes"] = max(stub_requests.get("max_body_bytes", 0), size)
+        if stub_latency:
+            await asyncio.sleep(stub_latency / 1000)
+        return web.json_response({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "model": "bench-model",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "```json\n{\"invoice_no\": \"A-001\", \"total\": 42}\n```"},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 850, "completion_tokens": 20, "total_tokens": 870}
+        })
+
+    stub = web.Application(client_max_size=1024 ** 3)
+    stub.router.add_post("/v1/chat/completions", completions)
+    runner = web.AppRunner(stub)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    results = {}
+    try:
+        api = load_api_module(f"http://127.0.0.1:{port}/v1/chat/completions")
+        image = make_test_image(corpus)
+        results["image_bytes"] = len(image)
+
+        transport = httpx.ASGITransport(app=api.app)
+        async with api.app.router.lifespan_context(api.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+                def post(endpoint, prompt="提取发票号码和金额", data=image):
+                    return client.post(endpoint, files={"file": ("region.jpg", data, "image/jpeg")},
+                                       data={"prompt": prompt})
+
+                async def timed(make_request, n):
+                    samples = []
+                    for _ in range(n):
+                        start = time.perf_counter()
+                        response = await make_request()
+                        response.raise_for_status()
+                        samples.append(time.perf_counter() - start)
+                    return summarize(samples)
+
+                results["GET /health"] = await timed(lambda: client.get("/health"), repeat)
+                for endpoint in ("/analyze", "/analyze/json"):
+                    await post(endpoint)  # 预热
+                    results[f"POST {endpoint}"] = await timed(lambda: post(endpoint), repeat)
+
+                    # 并发吞吐量
+                    total = concurrency * 4
+                    semaphore = asyncio.Semaphore(concurrency)
+
+                    async def one(i):
+                        async with semaphore:
+                            # 每个请求使用不同的提示词，避免相同请求被合并为一次上游调用
+                            response = await post(endpoint, f"提取发票号码和金额 #{i}")
+                            response.raise_for_status()
+
+                    start = time.perf_counter()
+                    await asyncio.gather(*(one(i) for i in range(total)))
+                    elapsed = time.perf_counter() - start
+                    results[f"POST {endpoint}/concurrent"] = {
+                        "requests": total,
+                        "concurrency": concurrency,
+                        "elapsed_ms": elapsed * 1000,
+                        "requests_per_sec": total / elapsed
+                    }
+
+                # 大文件上传的单请求内存：默认预处理（缩小后发送）和原样发送（完整经过 base64 编码路径）
+                large = make_large_image()
+                results["large_image_bytes"] = len(large)
+                memory = {"preprocess": await measure_request_memory(lambda: post("/analyze", "memory", large))}
+                if hasattr(api, "image_preprocessor"):
+                    default_preprocessor = api.image_preprocessor
+                    api.image_preprocessor = api.ImagePreprocessor(output_format="none")
+                    memory["passthrough"] = await measure_request_memory(lambda: post("/analyze", "memory", large))
+                    api.image_preprocessor = default_preprocessor
+                for key, value in memory.items():
+                    value["peak_per_upload_byte"] = value["peak_alloc_bytes"] / len(large)
+                    results[f"memory POST /analyze/{key}"] = value
+
+                # 响应缓存命中时的延迟
+                if hasattr(api, "ResponseCache"):
+                    api.response_cache = api.ResponseCache(max_entries=256)
+                    await post("/analyze/json")
+                    results["POST /analyze/json/cached"] = await timed(lambda: post("/analyze/json"), repeat)
+        results["stub_requests"] = stub_requests["count"]
+        results["stub_max_body_bytes"] = stub_requests.get("max_body_bytes", 0)
+        results["stub_latency_ms"] = stub_latency
+    finally:
+        await runner.cleanup()
+    return results
+
+def bench_api(corpus, repeat, concurrency=16, stub_latency=20):
+    """FastAPI 接口：对本地桩服务调用各端点的延迟与并发吞吐量"""
+    try:
+        import httpx  # noqa: F401
+        import aiohttp  # noqa: F401
+        import fastapi  # noqa: F401
+    except ImportError as e:
+        return {"skipped": f"缺少依赖: {e}"}
+    return asyncio.run(_bench_api(corpus, repeat, concurrency, stub_latency))
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def compare_results(baseline, current):
+    """
+    比较两次运行的中位数耗时
+
+    Args:
+        baseline (dict): 基准结果
+        current (dict): 本次结果
+
+    Returns:
+        list: (指标名, 基准中位数, 本次中位数, 比值)，按比值从大到小排列
+    """
+    rows = []
+    for suite, metrics in current["results"].items():
+        base_metrics = baseline.get("results", {}).get(suite, {})
+        for key, value in metrics.items():
+            base = base_metrics.get(key)
+            if isinstance(value, dict) and isinstance(base, dict) and "median_ms" in value and "median_ms" in base:
+                ratio = value["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+                rows.append((f"{suite}:{key}", base["median_ms"], value["median_ms"], ratio))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows
+
+SUITES = ("extraction", "viewer", "api")
+
+def main():
+    parser = argparse.ArgumentParser(description="运行PDF区域提取、查看器渲染和图片分析API的基准测试")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help="合成语料库目录（不存在时自动生成）")
+    parser.add_argument("--large-pages", type=int, default=1000, help="大文档的页数")
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="每项测试的运行次数")
+    parser.add_argument("-s", "--suite", choices=SUITES, action="append", help="只运行指定的测试组（可重复）")
+    parser.add_argument("--concurrency", type=int, default=16, help="API并发测试的并发数")
+    parser.add_argument("--stub-latency", type=float, default=20, help="桩服务的模拟延迟（毫秒）")
+    parser.add_argument("-o", "--output", default=None, help="结果JSON路径，默认 benchmarks/results/bench_<时间>.json")
+    parser.add_argument("--compare", default=None, help="与之前的结果JSON比较中位数耗时")
+    args = parser.parse_args()
+    if args.large_pages < 1:
+        parser.error("--large-pages 必须大于 0")
+
+    corpus = generate_corpus(args.corpus, args.large_pages)
+    suites = args.suite or list(SUITES)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pymupdf": fitz.VersionBind,
+            "repeat": args.repeat,
+            "suites": suites
+        },
+        "corpus": corpus,
+        "results": {}
+    }
+
+    workdir = tempfile.mkdtemp(prefix="pdf_bench_")
+    try:
+        for suite in suites:
+            print(f"运行 {suite} ...", file=sys.stderr)
+            start = time.perf_counter()
+            if suite == "extraction":
+                report["results"][suite] = bench_extraction(corpus, args.repeat, workdir)
+            elif suite == "viewer":
+                report["results"][suite] = bench_viewer(corpus, args.repeat)
+            else:
+                report["results"][suite] = bench_api(corpus, args.repeat, args.concurrency, args.stub_latency)
+            print(f"  {suite} 用时 {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULTS_DIR, f"bench_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}", file=sys.stderr)
+
+    for suite, metrics in report["results"].items():
+        for key, value in metrics.items():
+            if isinstance(value, dict) and "median_ms" in value:
+                print(f"{suite:10s} {key:55s} 中位数 {value['median_ms']:9.3f} ms  p95 {value['p95_ms']:9.3f} ms")
+            elif isinstance(value, dict) and "requests_per_sec" in value:
+                print(f"{suite:10s} {key:55s} {value['requests_per_sec']:9.1f} 请求/秒")
+            elif isinstance(value, dict) and "peak_alloc_bytes" in value:
+                print(f"{suite:10s} {key:55s} 峰值 {value['peak_alloc_bytes'] / 1024 ** 2:9.1f} MB  "
+                      f"（上传大小的 {value['peak_per_upload_byte']:.2f} 倍）")
+            elif key == "skipped":
+                print(f"{suite:10s} 已跳过: {value}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n与 {args.compare} 比较（比值 > 1 表示变慢）:")
+        for key, base, current, ratio in compare_results(baseline, report):
+            print(f"{ratio:6.2f}x  {key:65s} {base:9.3f} -> {current:9.3f} ms")
+
+if __name__ == "__main__":
+    main()
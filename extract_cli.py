@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import argparse
+
+def iter_stdin_paths(stream):
+    """
+    从输入流逐行读取PDF路径（忽略空行和 # 开头的注释行）
+
+    Args:
+        stream: 文本输入流
+
+    Yields:
+        str: PDF文件路径
+    """
+    for line in stream:
+        path = line.strip()
+        if path and not path.startswith("#"):
+            yield path
+
+def iter_records(result):
+    """
+    将单个文档的提取结果拆分为逐区域的输出记录
+
+    Args:
+        result (dict): batch_extractor.extract_document 的返回值
+
+    Yields:
+        dict: 每个 (pdf, 页面, 区域) 一条记录；文档失败时输出一条错误记录
+    """
+    if result["error"]:
+        yield {
+            "pdf": result["path"],
+            "template": result["template"],
+            "error": result["error"]
+        }
+        return
+
+    for region in result["regions"]:
+        yield {
+            "pdf": result["path"],
+            "template": result["template"],
+            "page": region["page"],
+            "region": region["name"],
+            "rect": region["rect"],
+            "text": region["text"]
+        }
+
+def reserve_stdout():
+    """
+    保留标准输出专用于JSONL记录
+
+    复制原标准输出的文件描述符用于写记录，再将文件描述符1重定向到标准错误，
+    使 PyMuPDF 等库（包括工作进程和C层）打印到标准输出的信息不会混入记录流。
+
+    Returns:
+        file: 用于写入记录的文本流
+    """
+    sys.stdout.flush()
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="按区域模板提取PDF文本，以JSONL格式逐条输出到标准输出"
+    )
+    parser.add_argument("template", help="区域模板JSON文件")
+    parser.add_argument("pdfs", nargs="*",
+                        help="PDF文件、目录或通配符；省略或为 - 时从标准输入逐行读取路径")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="工作进程数")
+    parser.add_argument("-q", "--quiet", action="store_true", help="不在标准错误输出每个文档的耗时")
+    args = parser.parse_args()
+
+    out = reserve_stdout()
+    # 在重定向之后导入，import fitz 时的提示信息不会写入记录流
+    from batch_extractor import load_region_template, expand_pdf_paths, iter_batch
+
+    template = load_region_template(args.template)
+
+    # 标准输入中的路径按需读取，不预先加载全部列表
+    if not args.pdfs or args.pdfs == ["-"]:
+        pdf_paths = iter_stdin_paths(sys.stdin)
+    else:
+        pdf_paths = expand_pdf_paths(args.pdfs)
+
+    documents = 0
+    failed = 0
+    try:
+        for result in iter_batch(pdf_paths, template, args.workers):
+            documents += 1
+            if result["error"]:
+                failed += 1
+            for record in iter_records(result):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            if not args.quiet:
+                if result["error"]:
+                    print(f"{result['path']}: 失败: {result['error']}", file=sys.stderr)
+                else:
+                    print(f"{result['path']}: {len(result['regions'])} 个区域, "
+                          f"{result['elapsed']:.3f}s ({result['pages_per_sec']:.1f} 页/秒)", file=sys.stderr)
+    except BrokenPipeError:
+        # 下游提前关闭管道（例如 | head）时安静退出
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, out.fileno())
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+    if not args.quiet:
+        print(f"共处理 {documents} 个文档 (失败 {failed})", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
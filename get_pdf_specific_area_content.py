@@ -5,6 +5,8 @@
 # 安装完成后，可以通过以下方式导入
 import fitz
 
+from text_extractor import open_document
+
 def get_pdf_specific_area_content(pdf_path, page_num, rect, irect):
     """
     获取 PDF 指定页面特定区域的内容并保存为图片
@@ -14,7 +16,7 @@ def get_pdf_specific_area_content(pdf_path, page_num, rect, irect):
     :return: 特定区域内的文本内容
     """
     try:
-        doc = fitz.open(pdf_path)
+        doc = open_document(pdf_path)
         page = doc.load_page(page_num)
         text = page.get_textbox(rect)
         
@@ -25,7 +27,6 @@ def get_pdf_specific_area_content(pdf_path, page_num, rect, irect):
         pix.save(image_path)
         print(f"特定区域已保存为图片: {image_path}")
 
-        doc.close()
         return text
     except Exception as e:
         print(f"读取 PDF 文件时出错: {e}")
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# 上游可直接接受的格式及其 MIME 类型
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+# 配置中的格式名称 -> Pillow 格式名称
+OUTPUT_FORMATS = {
+    "jpeg": "JPEG",
+    "jpg": "JPEG",
+    "png": "PNG",
+    "webp": "WEBP",
+}
+
+def _has_alpha(image: Image.Image) -> bool:
+    return image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    elif fmt == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def detect_format(data: bytes) -> Optional[str]:
+    """识别图片格式（只读取文件头，不解码），无法识别时返回 None"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.format
+    except Exception:
+        return None
+
+def normalize_image(data: bytes, max_edge: int = 2048, output_format: str = "auto",
+                    quality: int = 85) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    缩放并重新编码图片，减小请求体和图片token
+
+    长边超过 max_edge 时等比缩小；output_format 为 auto 时带透明通道的图片编码为 PNG，其余编码为 JPEG。
+    图片无需缩放且原始数据已经更小（并且是上游支持的格式）时保留原始数据。
+
+    Args:
+        data: 原始图片数据
+        max_edge: 长边的最大像素数，0 表示不缩放
+        output_format: auto、jpeg、png 或 webp
+        quality: JPEG/WebP 编码质量
+
+    Returns:
+        tuple: (图片数据, MIME类型, 处理信息)
+
+    Raises:
+        ValueError: 数据不是可识别的图片
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_format = image.format
+        original_size = image.size
+        if max_edge and original_format == "JPEG" and max(original_size) > max_edge:
+            # JPEG 解码时直接按 1/2、1/4、1/8 缩小，减少解码开销
+            image.draft("RGB", (max_edge, max_edge))
+        image.load()
+    except Exception as e:
+        raise ValueError(f"无法识别的图片: {e}")
+
+    # 按 EXIF 方向摆正
+    image = ImageOps.exif_transpose(image)
+
+    resized = bool(max_edge) and max(original_size) > max_edge
+    if resized:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    fmt = OUTPUT_FORMATS.get(output_format.lower())
+    if fmt is None:
+        fmt = "PNG" if _has_alpha(image) else "JPEG"
+
+    encoded = _encode(image, fmt, quality)
+    mime_type = MIME_TYPES[fmt]
+
+    if not resized and original_format in MIME_TYPES and len(data) <= len(encoded):
+        encoded, mime_type, fmt = data, MIME_TYPES[original_format], original_format
+
+    info = {
+        "original_bytes": len(data),
+        "bytes": len(encoded),
+        "original_size": list(original_size),
+        "size": list(image.size),
+        "format": fmt.lower(),
+        "resized": resized,
+    }
+    return encoded, mime_type, info
+
+class ImagePreprocessor:
+    """
+    在独立线程池中执行图片缩放和编码，不阻塞事件循环
+
+    Args:
+        max_edge: 长边的最大像素数，0 表示不缩放
+        output_format: auto、jpeg、png、webp，或 none 表示不处理（按原始数据发送）
+        quality: JPEG/WebP 编码质量
+        workers: 线程池大小
+    """
+
+    def __init__(self, max_edge: int = 2048, output_format: str = "auto", quality: int = 85,
+                 workers: Optional[int] = None):
+        self.max_edge = max_edge
+        self.output_format = output_format
+        self.quality = quality
+        self.enabled = output_format.lower() != "none"
+        self.workers = workers
+        # 首次使用时创建，shutdown 之后再次使用（例如应用重新启动）时重新创建
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def signature(self) -> str:
+        """预处理参数的标识，参与缓存键计算，参数变化后旧缓存不再命中"""
+        if not self.enabled:
+            return "raw"
+        return f"{self.output_format.lower()}:{self.max_edge}:{self.quality}"
+
+    async def process(self, data: bytes) -> Tuple[bytes, str, Dict[str, Any]]:
+        """
+        预处理图片
+
+        Returns:
+            tuple: (图片数据, MIME类型, 处理信息)
+
+        Raises:
+            ValueError: 数据不是可识别的图片
+        """
+        if not self.enabled:
+            # 按原始数据发送，但 MIME 类型按实际格式标注；无法识别时沿用 image/jpeg
+            fmt = detect_format(data)
+            mime_type = MIME_TYPES.get(fmt) or Image.MIME.get(fmt) or "image/jpeg"
+            return data, mime_type, {
+                "original_bytes": len(data),
+                "bytes": len(data),
+                "format": fmt.lower() if fmt else None,
+            }
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-preprocess")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, normalize_image, data, self.max_edge, self.output_format, self.quality
+        )
+
+    def shutdown(self):
+        """关闭线程池，不等待正在执行的任务"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+# 清理过期任务的最长间隔（秒）
+PRUNE_INTERVAL = 3600
+
+class JobStore:
+    """
+    基于单个 SQLite 文件的任务存储，保存任务参数、上传的文件和结果
+
+    文件在任务结束后删除，只保留结果；服务重启后未完成的任务可以从这里恢复。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        params TEXT NOT NULL,
+        result TEXT,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+    CREATE TABLE IF NOT EXISTS job_files (
+        job_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        filename TEXT,
+        data BLOB,
+        error TEXT,
+        PRIMARY KEY (job_id, idx)
+    );
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    def create(self, job_id: str, params: Dict[str, Any], files: List[Dict[str, Any]]) -> float:
+        """在一个事务中写入任务及其文件，返回创建时间"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, status, created_at, params) VALUES (?, ?, ?, ?)",
+                    (job_id, QUEUED, now, json.dumps(params, ensure_ascii=False))
+                )
+                self._conn.executemany(
+                    "INSERT INTO job_files (job_id, idx, filename, data, error) VALUES (?, ?, ?, ?, ?)",
+                    [(job_id, index, f.get("filename"), f.get("data"),
+                      json.dumps(f["error"], ensure_ascii=False) if f.get("error") else None)
+                     for index, f in enumerate(files)]
+                )
+        return now
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务状态和结果（不包括文件），不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, created_at, started_at, finished_at, attempts, result, error "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "created_at": row[2],
+            "started_at": row[3],
+            "finished_at": row[4],
+            "attempts": row[5],
+            "result": json.loads(row[6]) if row[6] is not None else None,
+            "error": row[7],
+        }
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务参数、已执行次数和文件，供执行任务使用"""
+        with self._lock:
+            row = self._conn.execute("SELECT params, attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            files = self._conn.execute(
+                "SELECT filename, data, error FROM job_files WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        return {
+            "params": json.loads(row[0]),
+            "attempts": row[1],
+            "files": [
+                {"filename": filename, "data": data, "error": json.loads(error) if error else None}
+                for filename, data, error in files
+            ],
+        }
+
+    def mark_running(self, job_id: str):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (RUNNING, time.time(), job_id)
+                )
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """记录任务结果并删除其文件"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                    (status, time.time(), json.dumps(result, ensure_ascii=False) if result is not None else None,
+                     error, job_id)
+                )
+                self._conn.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+
+    def pending(self) -> List[str]:
+        """未完成的任务（包括上次退出时正在执行的任务），按创建时间排列"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def prune(self, ttl: float) -> int:
+        """删除结束超过 ttl 秒的任务，返回删除的数量"""
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                    (SUCCEEDED, FAILED, time.time() - ttl)
+                )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class JobQueue:
+    """
+    异步任务队列：提交后立即返回任务ID，由固定数量的 asyncio worker 依次执行
+
+    任务持久化在 JobStore 中，启动时恢复未完成的任务（上次退出时正在执行的任务会重新执行）。
+    已执行 max_attempts 次仍未结束的任务（例如每次都导致进程退出）不再执行，直接标记为失败。
+    运行期间定期删除结束超过 ttl 秒的任务。
+
+    Args:
+        store: 任务存储
+        handler: 执行任务的协程函数 handler(params, files) -> 结果
+        workers: worker 数量
+        ttl: 结束的任务保留多久（秒），0 表示一直保留
+        max_queued: 最多排队的任务数，0 表示不限制
+        max_attempts: 每个任务最多执行的次数，0 表示不限制
+    """
+
+    def __init__(self, store: JobStore, handler: Callable[[Dict[str, Any], List[Dict[str, Any]]], Awaitable[Any]],
+                 workers: int = 2, ttl: float = 86400, max_queued: int = 0, max_attempts: int = 3):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # 等待中的查询：任务ID -> 每个查询各自的事件，任务结束时全部设置并移除
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        """清理过期任务，恢复未完成的任务并启动 worker"""
+        self._queue = asyncio.Queue()
+        if self.ttl:
+            await self.prune()
+        pending = await asyncio.to_thread(self.store.pending)
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        if pending:
+            logger.info(f"恢复了 {len(pending)} 个未完成的任务")
+        self._tasks = [asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)]
+        if self.ttl:
+            self._tasks.append(asyncio.create_task(self._pruner(), name="job-pruner"))
+
+    async def prune(self) -> int:
+        """删除结束超过 ttl 秒的任务，返回删除的数量"""
+        pruned = await asyncio.to_thread(self.store.prune, self.ttl)
+        if pruned:
+            logger.info(f"清理了 {pruned} 个过期任务")
+        return pruned
+
+    async def stop(self):
+        """停止 worker；正在执行的任务保持 running 状态，下次启动时重新执行"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, params: Dict[str, Any], files: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        提交任务
+
+        Returns:
+            dict: 任务状态
+
+        Raises:
+            OverflowError: 排队的任务数已达上限
+        """
+        if self.max_queued and self.queued >= self.max_queued:
+            raise OverflowError(f"排队的任务数已达上限 {self.max_queued}")
+        job_id = uuid.uuid4().hex
+        created_at = await asyncio.to_thread(self.store.create, job_id, params, files)
+        self._queue.put_nowait(job_id)
+        return {"job_id": job_id, "status": QUEUED, "created_at": created_at}
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """等待任务结束，最多 timeout 秒，返回当时的任务状态"""
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED or timeout <= 0:
+            return job
+
+        # 只为未结束的任务登记事件，查询返回时移除，等待的查询数不会无限增长
+        event = asyncio.Event()
+        waiters = self._waiters.setdefault(job_id, set())
+        waiters.add(event)
+        try:
+            # 登记之后再读取一次，避免在两次读取之间结束的任务被错过
+            job = await self.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return job
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            waiters.discard(event)
+            if not waiters and self._waiters.get(job_id) is waiters:
+                del self._waiters[job_id]
+        return await self.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _pruner(self):
+        while True:
+            await asyncio.sleep(min(self.ttl, PRUNE_INTERVAL))
+            try:
+                await self.prune()
+            except sqlite3.Error as e:
+                logger.error(f"清理过期任务失败: {str(e)}")
+
+    def _notify(self, job_id: str):
+        for event in self._waiters.pop(job_id, ()):
+            event.set()
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(self.store.load, job_id)
+        if job is None:
+            return
+        if self.max_attempts and job["attempts"] >= self.max_attempts:
+            # 之前每次执行都没有结束（进程在执行中退出），不再重试
+            error = f"任务已执行 {job['attempts']} 次仍未完成，不再重试"
+            logger.error(f"任务 {job_id} 已执行 {job['attempts']} 次仍未完成，标记为失败")
+            await asyncio.to_thread(self.store.finish, job_id, FAILED, None, error)
+            self._notify(job_id)
+            return
+        await asyncio.to_thread(self.store.mark_running, job_id)
+        start = time.perf_counter()
+        try:
+            result = await self.handler(job["params"], job["files"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"任务 {job_id} 执行失败: {str(e)}")
+            await asyncio.to_thread(self.store.finish, job_id, FAILED, None, str(e))
+        else:
+            await asyncio.to_thread(self.store.finish, job_id, SUCCEEDED, result)
+            logger.info(f"任务 {job_id} 完成，用时 {time.perf_counter() - start:.2f}s")
+        self._notify(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "waiting_queries": sum(len(waiters) for waiters in self._waiters.values()),
+            "jobs": self.store.counts(),
+        }
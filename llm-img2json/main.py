@@ -1,17 +1,30 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import io
 import os
+import time
+import uuid
 import base64
+import asyncio
 import logging
 from typing import List, Optional, Dict, Any
 import json
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import uvicorn
 import aiohttp
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from response_cache import ResponseCache, SingleFlight, cache_key
+from image_preprocess import ImagePreprocessor
+from upstream_scheduler import UpstreamScheduler
+from metrics import MetricsMiddleware, ServiceMetrics, current_endpoint
+from job_queue import JobQueue, JobStore
+import pdf_regions
 
 # 加载环境变量
 load_dotenv()
@@ -38,13 +51,220 @@ if not AI_API_URL:
 logger.info(f"使用模型: {MODEL_NAME}")
 logger.info(f"API地址: {AI_API_URL}")
 
+# 上游连接池配置：总连接数、每个主机的连接数、DNS缓存时间（秒）
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_CONNECTIONS_PER_HOST = int(os.getenv("UPSTREAM_MAX_CONNECTIONS_PER_HOST", "20"))
+UPSTREAM_DNS_CACHE_TTL = int(os.getenv("UPSTREAM_DNS_CACHE_TTL", "300"))
+
+# 上游超时配置（秒）：整个请求、建立连接、两次读取之间
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "120"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "60"))
+
+# 上游限流：每分钟请求数和token数上限（0 表示不限制）、每张图片的预估token数（用于token限速）
+UPSTREAM_RPM = float(os.getenv("UPSTREAM_RPM", "0"))
+UPSTREAM_TPM = float(os.getenv("UPSTREAM_TPM", "0"))
+UPSTREAM_IMAGE_TOKENS = int(os.getenv("UPSTREAM_IMAGE_TOKENS", "1105"))
+
+# 上游重试：最多重试次数、指数退避的初始和最长等待时间（秒）、上游要求等待超过多久时直接返回错误（秒）
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "30"))
+UPSTREAM_RETRY_AFTER_MAX = float(os.getenv("UPSTREAM_RETRY_AFTER_MAX", "60"))
+
+# 批量分析：单个批次的最大条目数、每个批次同时发往上游的请求数
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "64"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# 上传大小限制（字节）：单张图片、单个PDF、整个请求体（按 Content-Length 在解析表单之前检查，0 表示不限制）
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_PDF_BYTES = int(os.getenv("MAX_PDF_BYTES", str(50 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+
+# 读取上传文件的分块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# base64 编码的分块大小（3 的倍数，分块编码结果可直接拼接）
+BASE64_CHUNK_SIZE = 3 * 256 * 1024
+
+# /analyze/json 附加在提示词后的格式要求
+JSON_PROMPT_SUFFIX = " 请以有效的JSON格式返回结果。"
+
+# 每次请求允许模型生成的最大token数
+MAX_TOKENS = int(os.getenv("MAX_TOKENS", "1000"))
+
+# 响应缓存：内存层条目数（0 表示关闭）、有效期（秒）、磁盘层路径（为空表示不使用磁盘层）及容量
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# 按 (图片内容, 提示词, 模型, max_tokens) 寻址的上游响应缓存
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    disk_path=RESPONSE_CACHE_PATH or None,
+    disk_max_bytes=RESPONSE_CACHE_MAX_BYTES,
+)
+
+# 合并相同（图片内容、提示词、模型）的并发上游请求
+single_flight = SingleFlight()
+
+# 图片预处理：长边最大像素数（0 不缩放）、输出格式（auto/jpeg/png/webp/none）、编码质量、线程池大小
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2048"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "auto")
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0")) or None
+
+# 在线程池中缩放、重新编码上传的图片
+image_preprocessor = ImagePreprocessor(
+    max_edge=IMAGE_MAX_EDGE,
+    output_format=IMAGE_FORMAT,
+    quality=IMAGE_QUALITY,
+    workers=IMAGE_WORKERS,
+)
+
+# PDF区域渲染的默认DPI
+PDF_RENDER_DPI = float(os.getenv("PDF_RENDER_DPI", "150"))
+
+# PDF区域的默认处理方式（vlm/hybrid/text）及文本层质量检查阈值
+PDF_ROUTE = os.getenv("PDF_ROUTE", "vlm")
+TEXT_LAYER_CHECK = {
+    "min_chars": int(os.getenv("TEXT_LAYER_MIN_CHARS", "2")),
+    "min_valid_ratio": float(os.getenv("TEXT_LAYER_MIN_VALID_RATIO", "0.9")),
+    "min_density": float(os.getenv("TEXT_LAYER_MIN_DENSITY", "0.2")),
+}
+
+# 所有上游请求（包括批量、PDF区域和流式）共用的限速和重试调度
+upstream_scheduler = UpstreamScheduler(
+    rpm=UPSTREAM_RPM,
+    tpm=UPSTREAM_TPM,
+    max_retries=UPSTREAM_MAX_RETRIES,
+    backoff_base=UPSTREAM_BACKOFF_BASE,
+    backoff_max=UPSTREAM_BACKOFF_MAX,
+    retry_after_max=UPSTREAM_RETRY_AFTER_MAX,
+)
+
+# 异步任务：SQLite 文件路径、worker 数量、结束的任务保留时间（秒，0 表示一直保留）、
+# 最多排队的任务数（0 表示不限制）、查询时最长等待时间（秒）、每个任务最多执行的次数（0 表示不限制）
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TTL = float(os.getenv("JOB_TTL", "86400"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_WAIT_MAX = float(os.getenv("JOB_WAIT_MAX", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# 任务队列，由应用生命周期创建（恢复未完成的任务）和停止
+job_queue: Optional[JobQueue] = None
+
+# /metrics 输出的请求、上游调用和token用量指标
+service_metrics = ServiceMetrics()
+
+# 进程内共享的上游会话，由应用生命周期创建和关闭
+http_session: Optional[aiohttp.ClientSession] = None
+
+def create_http_session() -> aiohttp.ClientSession:
+    """创建带连接池、DNS缓存和超时设置的上游会话"""
+    connector = aiohttp.TCPConnector(
+        limit=UPSTREAM_MAX_CONNECTIONS,
+        limit_per_host=UPSTREAM_MAX_CONNECTIONS_PER_HOST,
+        ttl_dns_cache=UPSTREAM_DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=UPSTREAM_TIMEOUT,
+        sock_connect=UPSTREAM_CONNECT_TIMEOUT,
+        sock_read=UPSTREAM_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+def stream_timeout() -> aiohttp.ClientTimeout:
+    """
+    流式请求的超时：输出时长随生成长度增加，不限制总时长，
+    只限制两次读取之间的间隔（首个分块可能要等到模型处理完图片，因此按 UPSTREAM_TIMEOUT 计算）
+    """
+    return aiohttp.ClientTimeout(total=None, sock_connect=UPSTREAM_CONNECT_TIMEOUT, sock_read=UPSTREAM_TIMEOUT)
+
+def get_http_session() -> aiohttp.ClientSession:
+    """获取共享会话（未经生命周期启动时按需创建，例如直接调用 call_openai_api）"""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = create_http_session()
+    return http_session
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用启动时创建共享会话并启动任务队列，关闭时停止任务队列、释放连接并关闭图片预处理线程池"""
+    global http_session, job_queue
+    http_session = create_http_session()
+    logger.info(
+        f"上游连接池: 总连接数 {UPSTREAM_MAX_CONNECTIONS}, 每主机 {UPSTREAM_MAX_CONNECTIONS_PER_HOST}, "
+        f"超时 {UPSTREAM_TIMEOUT}s"
+    )
+    job_queue = JobQueue(
+        JobStore(JOB_DB_PATH), run_job,
+        workers=JOB_WORKERS, ttl=JOB_TTL, max_queued=JOB_MAX_QUEUED, max_attempts=JOB_MAX_ATTEMPTS,
+    )
+    await job_queue.start()
+    try:
+        yield
+    finally:
+        queue, job_queue = job_queue, None
+        await queue.stop()
+        queue.store.close()
+        # 被取消的任务不再等待结果，合并中的上游调用也随之取消，避免在会话关闭后继续请求
+        await single_flight.cancel_all()
+        session, http_session = http_session, None
+        if session is not None:
+            await session.close()
+        image_preprocessor.shutdown()
+
 # 创建FastAPI应用
 app = FastAPI(
     title="llm 图片分析API",
     description="上传图片和提示词，使用 vlm 模型进行分析",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+class RequestSizeLimitMiddleware:
+    """
+    请求体超过 MAX_REQUEST_BYTES 时返回 413
+
+    Content-Length 超限的请求在解析表单之前直接拒绝；没有 Content-Length（分块传输）的请求在读取过程中累计大小，
+    超限后立即停止读取。
+    """
+    
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes:
+            await self.app(scope, receive, send)
+            return
+        
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                response = JSONResponse(status_code=413, content={"detail": f"请求体超过 {self.max_bytes} 字节"})
+                await response(scope, receive, send)
+                return
+        
+        received = 0
+        
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # 表单解析时抛出的 HTTPException 原样返回给客户端
+                    raise HTTPException(status_code=413, detail=f"请求体超过 {self.max_bytes} 字节")
+            return message
+        
+        await self.app(scope, receive_limited, send)
+
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=MAX_REQUEST_BYTES)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -54,6 +274,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 最后添加的中间件位于最外层：记录全部请求的指标，包括 CORS 预检请求和被大小限制拒绝的请求
+app.add_middleware(MetricsMiddleware, registry=service_metrics, routes=app.routes)
+
 class ImageAnalysisRequest(BaseModel):
     prompt: str
     image_url: Optional[str] = None
@@ -62,14 +285,50 @@ class ImageAnalysisResponse(BaseModel):
     result: str
     model: str
     usage: Optional[Dict[str, int]] = None
+    meta: Optional[Dict[str, Any]] = Field(None, alias="_meta")
     
-async def call_openai_api(image_data: bytes, prompt: str):
-    """调用OpenAI API处理图片和提示词"""
-    # OpenAI API端点
-    url = AI_API_URL
+async def read_upload(file: UploadFile, max_bytes: int, kind: str = "图片") -> bytes:
+    """
+    读取上传文件并检查大小限制（超过时返回 413）
+    
+    表单解析后文件已暂存在磁盘上，大小已知时先检查再一次读出；大小未知时分块读取，超限后立即停止。
+    
+    Args:
+        file: 上传的文件
+        max_bytes: 大小上限（字节），0 表示不限制
+        kind: 错误信息中的文件类型
+    """
+    if file.size is not None:
+        if max_bytes and file.size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"{kind}大小超过 {max_bytes} 字节")
+        # 大小已知且未超限时一次读出，避免分块拼接时的额外副本
+        return await file.read()
     
-    # 将图片转换为base64
-    base64_image = base64.b64encode(image_data).decode("utf-8")
+    # 大小未知时分块读取，超限后立即停止
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"{kind}大小超过 {max_bytes} 字节")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def build_upstream_request(image_data: bytes, prompt: str, stream: bool = False,
+                           mime_type: str = "image/jpeg"):
+    """
+    构建上游 chat/completions 请求
+    
+    请求体直接写成 JSON 字节：图片分块 base64 编码后写入占位符所在位置，
+    不再依次生成 base64 字符串、data URL 字符串和序列化后的 JSON 等多份完整副本。
+    
+    Returns:
+        tuple: (请求头, 请求体 io.BytesIO)
+    """
+    placeholder = f"__image_{uuid.uuid4().hex}__"
     
     # 构建请求头
     headers = {
@@ -88,41 +347,215 @@ async def call_openai_api(image_data: bytes, prompt: str):
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": placeholder
                         }
                     }
                 ]
             }
         ],
-        "max_tokens": 1000
+        "max_tokens": MAX_TOKENS
     }
+    if stream:
+        # 流式输出，并在最后一个分块中返回token用量
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
     
-    max_retries = 3
-    retry_count = 0
+    head, tail = json.dumps(payload, ensure_ascii=False).encode("utf-8").split(placeholder.encode("ascii"))
+    body = io.BytesIO()
+    body.write(head)
+    body.write(f"data:{mime_type};base64,".encode("ascii"))
+    view = memoryview(image_data)
+    for offset in range(0, len(view), BASE64_CHUNK_SIZE):
+        body.write(base64.b64encode(view[offset:offset + BASE64_CHUNK_SIZE]))
+    body.write(tail)
+    return headers, body
+
+def estimate_tokens(prompt: str) -> int:
+    """预估一次请求占用的token额度（提示词 + 图片 + max_tokens），完成后按实际用量结算，失败的尝试全部归还"""
+    return len(prompt) + UPSTREAM_IMAGE_TOKENS + MAX_TOKENS
+
+async def send_upstream(headers: Dict[str, str], body: io.BytesIO, estimated_tokens: int,
+                        stream: bool = False) -> aiohttp.ClientResponse:
+    """
+    经调度器限速后发送上游请求，按状态码决定是否重试
     
-    while retry_count < max_retries:
+    429、408 和 5xx 按 Retry-After（或指数退避加抖动）等待后重试；400、401 等重试也不会成功的错误直接返回。
+    
+    Returns:
+        aiohttp.ClientResponse: 状态码为200的响应，调用方负责读取并释放
+    
+    Raises:
+        HTTPException: 上游返回不可重试的错误，或重试次数用尽
+    """
+    session = get_http_session()
+    endpoint = current_endpoint.get()
+    service_metrics.upstream_request_bytes.observe(len(body.getbuffer()), endpoint=endpoint, model=MODEL_NAME)
+    # 流式请求不受会话的总超时限制，否则较长的生成会在输出中途被切断
+    options = {"timeout": stream_timeout()} if stream else {}
+    attempt = 0
+    while True:
+        waited = await upstream_scheduler.acquire(estimated_tokens)
+        if waited:
+            service_metrics.upstream_wait.inc(waited, endpoint=endpoint, model=MODEL_NAME)
+        # 重试时从头发送同一个请求体
+        body.seek(0)
+        service_metrics.upstream_in_flight.inc(endpoint=endpoint, model=MODEL_NAME)
+        start = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"OpenAI API错误: {response.status} - {error_text}")
-                        # 如果是最后一次重试，则抛出异常
-                        if retry_count == max_retries - 1:
-                            raise HTTPException(status_code=response.status, detail=f"OpenAI API错误: {error_text}")
-                        retry_count += 1
-                        continue
-                    
-                    result = await response.json()
-                    return result
-            # 如果成功执行到这里，跳出循环
-            break
-        except aiohttp.ClientError as e:
-            logger.error(f"调用OpenAI API时发生错误 (尝试 {retry_count+1}/{max_retries}): {str(e)}")
-            # 如果是最后一次重试，则抛出异常
-            if retry_count == max_retries - 1:
+            # 复用共享会话的连接池（keep-alive），不再为每次请求重新建立连接
+            response = await session.post(AI_API_URL, headers=headers, data=body, **options)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            upstream_scheduler.release(estimated_tokens)
+            service_metrics.upstream_requests.inc(endpoint=endpoint, model=MODEL_NAME, status="error")
+            logger.error(f"调用OpenAI API时发生错误 (第 {attempt + 1} 次尝试): {str(e)}")
+            delay = upstream_scheduler.retry_delay(attempt)
+            if delay is None:
                 raise HTTPException(status_code=500, detail=f"调用OpenAI API时发生错误: {str(e)}")
-            retry_count += 1
+            retry_label = "network"
+        else:
+            service_metrics.upstream_requests.inc(endpoint=endpoint, model=MODEL_NAME, status=response.status)
+            service_metrics.upstream_duration.observe(
+                time.perf_counter() - start, endpoint=endpoint, model=MODEL_NAME, stream=str(stream).lower())
+            upstream_scheduler.observe(response.headers)
+            if response.status == 200:
+                return response
+            # 失败的尝试不计入token用量，每次重试都重新取出预估额度
+            upstream_scheduler.release(estimated_tokens)
+            try:
+                error_text = await response.text()
+            finally:
+                response.release()
+            logger.error(f"OpenAI API错误: {response.status} - {error_text}")
+            delay = upstream_scheduler.retry_delay(attempt, response.status, response.headers, error_text)
+            if delay is None:
+                raise HTTPException(status_code=response.status, detail=f"OpenAI API错误: {error_text}")
+            retry_label = str(response.status)
+        finally:
+            service_metrics.upstream_in_flight.dec(endpoint=endpoint, model=MODEL_NAME)
+        
+        service_metrics.upstream_retries.inc(endpoint=endpoint, model=MODEL_NAME, status=retry_label)
+        attempt += 1
+        logger.warning(f"{delay:.2f} 秒后第 {attempt} 次重试")
+        await asyncio.sleep(delay)
+
+async def call_openai_api(image_data: bytes, prompt: str, mime_type: str = "image/jpeg"):
+    """调用OpenAI API处理图片和提示词"""
+    headers, body = build_upstream_request(image_data, prompt, mime_type=mime_type)
+    estimated = estimate_tokens(prompt)
+    response = await send_upstream(headers, body, estimated)
+    try:
+        result = await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"读取OpenAI API响应时发生错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"读取OpenAI API响应时发生错误: {str(e)}")
+    finally:
+        response.release()
+    upstream_scheduler.settle(estimated, result.get("usage"))
+    service_metrics.observe_usage(MODEL_NAME, result.get("usage"))
+    return result
+
+def analysis_cache_key(image_data: bytes, prompt: str) -> str:
+    """按原始图片内容、提示词、模型、max_tokens 和预处理设置计算缓存键（命中时无需预处理图片）"""
+    return cache_key(image_data, prompt, MODEL_NAME, MAX_TOKENS, image_preprocessor.signature)
+
+async def prepare_image(image_data: bytes):
+    """
+    预处理上传的图片
+    
+    Returns:
+        tuple: (图片数据, MIME类型, 处理信息)
+    """
+    try:
+        return await image_preprocessor.process(image_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"请上传有效的图片文件: {e}")
+
+async def analyze_with_cache(image_data: bytes, prompt: str, mime_type: Optional[str] = None):
+    """
+    带响应缓存的上游调用（未命中时先预处理图片）
+
+    Args:
+        image_data: 图片数据
+        prompt: 提示词
+        mime_type: 指定时表示图片已是最终格式（例如服务端渲染的PDF区域），跳过预处理
+
+    Returns:
+        tuple: (上游响应, 缓存信息 {"cache": "hit"/"miss"/"coalesced", "cache_tier": "memory"/"disk", "image": 预处理信息})
+            相同请求正在进行时不再单独调用上游，等待并共享其结果（cache 为 coalesced）
+    """
+    key = analysis_cache_key(image_data, prompt)
+    if response_cache.enabled:
+        cached, tier = await response_cache.get(key)
+        if cached is not None:
+            service_metrics.cache.inc(endpoint=current_endpoint.get(), result="hit")
+            return cached, {"cache": "hit", "cache_tier": tier}
+    
+    async def fetch():
+        if mime_type:
+            prepared, prepared_mime, image_info = image_data, mime_type, {"bytes": len(image_data)}
+        else:
+            prepared, prepared_mime, image_info = await prepare_image(image_data)
+        api_response = await call_openai_api(prepared, prompt, prepared_mime)
+        # 在合并窗口结束前写入缓存，之后到达的相同请求直接命中缓存
+        if response_cache.enabled:
+            await response_cache.set(key, api_response)
+        return api_response, image_info
+    
+    (api_response, image_info), shared = await single_flight.do(key, fetch)
+    result = "coalesced" if shared else "miss"
+    service_metrics.cache.inc(endpoint=current_endpoint.get(), result=result)
+    return api_response, {"cache": result, "image": image_info}
+
+def build_text_response(api_response: Dict[str, Any], cache_info: Dict[str, Any]) -> Dict[str, Any]:
+    """构建 /analyze 格式的文本结果"""
+    return {
+        "result": api_response["choices"][0]["message"]["content"],
+        "model": api_response.get("model", MODEL_NAME),
+        "usage": api_response.get("usage"),
+        "_meta": cache_info
+    }
+
+def build_text_layer_response(text: str, text_quality: Dict[str, Any], json_mode: bool) -> Dict[str, Any]:
+    """构建直接由PDF文本层给出的结果，格式与模型结果一致"""
+    meta = {"path": "text_layer", "text_quality": text_quality}
+    if json_mode:
+        return {"text": text, "_meta": {"model": None, "usage": None, **meta}}
+    return {"result": text, "model": None, "usage": None, "_meta": meta}
+
+def build_json_response(api_response: Dict[str, Any], cache_info: Dict[str, Any]) -> Dict[str, Any]:
+    """构建 /analyze/json 格式的结果：解析模型输出中的JSON，失败时返回原始文本"""
+    meta = {
+        "model": api_response.get("model", MODEL_NAME),
+        "usage": api_response.get("usage"),
+        **cache_info
+    }
+    
+    # 提取JSON部分（如果输出包含其他文本）
+    result_text = api_response["choices"][0]["message"]["content"]
+    json_text = result_text
+    # 如果文本中包含```json和```，提取它们之间的内容
+    if "```json" in result_text and "```" in result_text.split("```json", 1)[1]:
+        json_text = result_text.split("```json", 1)[1].split("```", 1)[0].strip()
+    # 如果没有json标记但有代码块
+    elif "```" in result_text and "```" in result_text.split("```", 1)[1]:
+        json_text = result_text.split("```", 1)[1].split("```", 1)[0].strip()
+    
+    try:
+        result_json = json.loads(json_text)
+    except json.JSONDecodeError:
+        # 如果解析JSON失败，返回原始文本
+        logger.warning(f"无法解析返回的JSON: {result_text}")
+        return {
+            "error": "无法解析返回的JSON",
+            "raw_result": result_text,
+            "_meta": meta
+        }
+    
+    # 添加模型和使用情况信息
+    return {
+        **result_json,
+        "_meta": meta
+    }
 
 @app.post("/analyze", response_model=ImageAnalysisResponse)
 async def analyze_image(
@@ -141,16 +574,14 @@ async def analyze_image(
     
     try:
         # 读取图片数据
-        image_data = await file.read()
+        image_data = await read_upload(file, MAX_UPLOAD_BYTES)
         
         # 调用OpenAI API
-        api_response = await call_openai_api(image_data, prompt)
+        api_response, cache_info = await analyze_with_cache(image_data, prompt)
         
-        return {
-            "result": api_response["choices"][0]["message"]["content"],
-            "model": api_response.get("model", MODEL_NAME),
-            "usage": api_response.get("usage")
-        }
+        return build_text_response(api_response, cache_info)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"处理请求时发生错误: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理请求时发生错误: {str(e)}")
@@ -172,53 +603,436 @@ async def analyze_image_json(
     
     try:
         # 读取图片数据
-        image_data = await file.read()
+        image_data = await read_upload(file, MAX_UPLOAD_BYTES)
         
         # 调用OpenAI API
-        api_response = await call_openai_api(image_data, prompt + " 请以有效的JSON格式返回结果。")
+        api_response, cache_info = await analyze_with_cache(image_data, prompt + JSON_PROMPT_SUFFIX)
         
-        # 尝试解析JSON
-        try:
-            # 提取JSON部分（如果输出包含其他文本）
-            result_text = api_response["choices"][0]["message"]["content"]
-            json_text = result_text
-            # 如果文本中包含```json和```，提取它们之间的内容
-            if "```json" in result_text and "```" in result_text.split("```json", 1)[1]:
-                json_text = result_text.split("```json", 1)[1].split("```", 1)[0].strip()
-            # 如果没有json标记但有代码块
-            elif "```" in result_text and "```" in result_text.split("```", 1)[1]:
-                json_text = result_text.split("```", 1)[1].split("```", 1)[0].strip()
-                
-            result_json = json.loads(json_text)
-            
-            # 添加模型和使用情况信息
-            response = {
-                **result_json,
-                "_meta": {
-                    "model": api_response.get("model", MODEL_NAME),
-                    "usage": api_response.get("usage")
-                }
-            }
-            return response
-        except json.JSONDecodeError:
-            # 如果解析JSON失败，返回原始文本
-            logger.warning(f"无法解析返回的JSON: {result_text}")
-            return {
-                "error": "无法解析返回的JSON", 
-                "raw_result": result_text,
-                "_meta": {
-                    "model": api_response.get("model", MODEL_NAME),
-                    "usage": api_response.get("usage")
-                }
-            }
+        return build_json_response(api_response, cache_info)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"处理请求时发生错误: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理请求时发生错误: {str(e)}")
 
+async def read_batch(files: List[UploadFile], prompts: List[str]):
+    """
+    按批量分析的规则配对图片和提示词，并读取每个文件
+    
+    提示词只有一个时用于所有图片，与图片数量相同时一一对应，只有一张图片时每个提示词各分析一次。
+    无效或超过大小限制的文件记录错误，只有对应条目失败。
+    
+    Returns:
+        tuple: (文件列表 [{"filename", "data", "error": [状态码, 错误信息]}], 条目列表 [(文件序号, 提示词)])
+    """
+    if len(prompts) == 1:
+        pairs = [(index, prompts[0]) for index in range(len(files))]
+    elif len(files) == 1:
+        pairs = [(0, prompt) for prompt in prompts]
+    elif len(files) == len(prompts):
+        pairs = list(enumerate(prompts))
+    else:
+        raise HTTPException(status_code=400, detail="提示词数量必须为1、与图片数量相同，或只上传一张图片")
+    
+    if len(pairs) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单个批次最多 {BATCH_MAX_ITEMS} 条")
+    
+    # 每个文件只读取一次（同一张图片对应多个提示词时共用）
+    inputs = []
+    for file in files:
+        entry = {"filename": file.filename, "data": None, "error": None}
+        if file.content_type and file.content_type.startswith("image/"):
+            try:
+                entry["data"] = await read_upload(file, MAX_UPLOAD_BYTES)
+            except HTTPException as e:
+                entry["error"] = [e.status_code, e.detail]
+        else:
+            entry["error"] = [400, "请上传有效的图片文件"]
+        inputs.append(entry)
+    return inputs, pairs
+
+async def run_batch(inputs: List[Dict[str, Any]], pairs: List[Any], json_mode: bool) -> Dict[str, Any]:
+    """
+    并发分析批量条目（每个批次最多 BATCH_CONCURRENCY 个请求同时发往上游），按顺序返回结果
+    
+    Args:
+        inputs: read_batch 返回的文件列表
+        pairs: read_batch 返回的条目列表
+        json_mode: 为 true 时按 /analyze/json 的格式解析每条结果
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    start = time.perf_counter()
+    
+    async def run_item(index: int, file_index: int, prompt: str) -> Dict[str, Any]:
+        entry = inputs[file_index]
+        item = {"index": index, "filename": entry["filename"]}
+        if entry["error"]:
+            status_code, error = entry["error"]
+            return {**item, "status": "error", "status_code": status_code, "error": error}
+        try:
+            async with semaphore:
+                if json_mode:
+                    api_response, cache_info = await analyze_with_cache(entry["data"], prompt + JSON_PROMPT_SUFFIX)
+                    data = build_json_response(api_response, cache_info)
+                else:
+                    api_response, cache_info = await analyze_with_cache(entry["data"], prompt)
+                    data = build_text_response(api_response, cache_info)
+            return {**item, "status": "ok", "data": data}
+        except HTTPException as e:
+            logger.error(f"批量分析第 {index} 条失败: {e.detail}")
+            return {**item, "status": "error", "status_code": e.status_code, "error": str(e.detail)}
+        except Exception as e:
+            logger.error(f"批量分析第 {index} 条失败: {str(e)}")
+            return {**item, "status": "error", "status_code": 500, "error": str(e)}
+    
+    results = await asyncio.gather(*(
+        run_item(i, file_index, prompt) for i, (file_index, prompt) in enumerate(pairs)
+    ))
+    failed = sum(1 for item in results if item["status"] != "ok")
+    return {
+        "results": results,
+        "_meta": {
+            "model": MODEL_NAME,
+            "count": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "concurrency": BATCH_CONCURRENCY,
+            "elapsed": time.perf_counter() - start
+        }
+    }
+
+@app.post("/analyze/batch", response_model=Dict[str, Any])
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    prompts: List[str] = Form(...),
+    json_mode: bool = Form(False),
+):
+    """
+    批量分析多张图片（或对同一张图片使用多个提示词），并发调用上游，按顺序返回结果
+    
+    - **files**: 图片文件，可重复
+    - **prompts**: 提示词，可重复；只有一个时用于所有图片，与图片数量相同时一一对应，
+      只有一张图片时每个提示词各分析一次
+    - **json_mode**: 为 true 时按 /analyze/json 的格式解析每条结果
+    
+    单条失败不影响其他条目，失败条目的 status 为 error 并附带错误信息。
+    """
+    inputs, pairs = await read_batch(files, prompts)
+    return await run_batch(inputs, pairs, json_mode)
+
+async def run_job(params: Dict[str, Any], files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """执行 /jobs 提交的批量分析任务"""
+    current_endpoint.set("/jobs")
+    return await run_batch(files, [tuple(pair) for pair in params["pairs"]], params["json_mode"])
+
+def get_job_queue() -> JobQueue:
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="任务队列未启动")
+    return job_queue
+
+@app.post("/jobs", status_code=202, response_model=Dict[str, Any])
+async def submit_job(
+    files: List[UploadFile] = File(...),
+    prompts: List[str] = Form(...),
+    json_mode: bool = Form(False),
+):
+    """
+    提交异步批量分析任务，立即返回任务ID，不必保持连接等待上游完成
+    
+    参数与 /analyze/batch 相同。任务和上传的图片保存在 JOB_DB_PATH 中，服务重启后未完成的任务会继续执行。
+    用 GET /jobs/{job_id} 查询状态和结果。
+    """
+    queue = get_job_queue()
+    inputs, pairs = await read_batch(files, prompts)
+    try:
+        job = await queue.submit({"pairs": pairs, "json_mode": json_mode}, inputs)
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {**job, "status_url": f"/jobs/{job['job_id']}"}
+
+@app.get("/jobs/{job_id}", response_model=Dict[str, Any])
+async def get_job(job_id: str, wait: float = 0):
+    """
+    查询任务状态和结果
+    
+    - **wait**: 任务未结束时最多等待的秒数（不超过 JOB_WAIT_MAX），0 表示立即返回
+    
+    status 为 queued、running、succeeded 或 failed；succeeded 时 result 与 /analyze/batch 的返回格式相同。
+    """
+    queue = get_job_queue()
+    job = await queue.wait(job_id, max(0.0, min(wait, JOB_WAIT_MAX)))
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job
+
+@app.post("/analyze/pdf", response_model=Dict[str, Any])
+async def analyze_pdf_regions(
+    file: UploadFile = File(...),
+    regions: str = Form(...),
+    prompt: Optional[str] = Form(None),
+    dpi: float = Form(PDF_RENDER_DPI),
+    json_mode: bool = Form(False),
+    route: str = Form(PDF_ROUTE),
+):
+    """
+    上传一次PDF，在服务端渲染多个区域并并发分析，按顺序返回每个区域的结果
+    
+    - **file**: PDF文件
+    - **regions**: JSON数组，每项为 {"page": 页码（从0开始）, "rect": [x0, y0, x1, y1], "prompt": 提示词（可选）}，
+      rect 为显示页面上以左上角为原点的PDF点坐标
+    - **prompt**: 区域未指定提示词时使用的提示词
+    - **dpi**: 渲染DPI（区域长边不超过 IMAGE_MAX_EDGE）
+    - **json_mode**: 为 true 时按 /analyze/json 的格式解析每条结果
+    - **route**: vlm 全部交给模型；hybrid 先提取区域文本层，通过质量检查（字符数、有效字符比例、密度）时
+      直接返回文本，否则交给模型；text 只返回文本层。每条结果的 path 字段为 text_layer 或 vlm
+    """
+    if pdf_regions.fitz is None:
+        raise HTTPException(status_code=501, detail="服务端未安装 PyMuPDF，无法渲染PDF")
+    if not 10 <= dpi <= 1200:
+        raise HTTPException(status_code=400, detail="dpi 必须在 10 到 1200 之间")
+    if route not in pdf_regions.ROUTES:
+        raise HTTPException(status_code=400, detail=f"route 必须是 {'、'.join(pdf_regions.ROUTES)} 之一")
+    
+    try:
+        region_list = pdf_regions.parse_regions(regions, prompt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(region_list) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单个请求最多 {BATCH_MAX_ITEMS} 个区域")
+    
+    start = time.perf_counter()
+    pdf_data = await read_upload(file, MAX_PDF_BYTES, "PDF")
+    try:
+        rendered = await pdf_regions.render_regions_async(
+            pdf_data, region_list, dpi,
+            max_edge=IMAGE_MAX_EDGE,
+            image_format="png" if IMAGE_FORMAT.lower() == "png" else "jpeg",
+            quality=IMAGE_QUALITY,
+            route=route,
+            text_check=TEXT_LAYER_CHECK,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    render_elapsed = time.perf_counter() - start
+    
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def run_region(index: int, region: Dict[str, Any], prepared) -> Dict[str, Any]:
+        item = {"index": index, "page": region["page"], "rect": region["rect"]}
+        if isinstance(prepared, Exception):
+            return {**item, "status": "error", "status_code": 400, "error": str(prepared)}
+        item["path"] = prepared["path"]
+        if prepared["path"] == "text_layer":
+            data = build_text_layer_response(prepared["text"], prepared["text_quality"], json_mode)
+            return {**item, "status": "ok", "data": data}
+        
+        image_data, mime_type, render_info = prepared["image"]
+        region_prompt = region["prompt"] + JSON_PROMPT_SUFFIX if json_mode else region["prompt"]
+        try:
+            async with semaphore:
+                api_response, cache_info = await analyze_with_cache(image_data, region_prompt, mime_type)
+            cache_info["image"] = render_info
+            cache_info["path"] = "vlm"
+            if "text_quality" in prepared:
+                # hybrid 方式下记录文本层未通过检查的原因
+                cache_info["text_quality"] = prepared["text_quality"]
+            if json_mode:
+                data = build_json_response(api_response, cache_info)
+            else:
+                data = build_text_response(api_response, cache_info)
+            return {**item, "status": "ok", "data": data}
+        except HTTPException as e:
+            logger.error(f"第 {index} 个区域分析失败: {e.detail}")
+            return {**item, "status": "error", "status_code": e.status_code, "error": str(e.detail)}
+        except Exception as e:
+            logger.error(f"第 {index} 个区域分析失败: {str(e)}")
+            return {**item, "status": "error", "status_code": 500, "error": str(e)}
+    
+    results = await asyncio.gather(*(
+        run_region(i, region, prepared) for i, (region, prepared) in enumerate(zip(region_list, rendered))
+    ))
+    failed = sum(1 for item in results if item["status"] != "ok")
+    paths = {"text_layer": 0, "vlm": 0}
+    for item in results:
+        if "path" in item:
+            paths[item["path"]] += 1
+    return {
+        "results": results,
+        "_meta": {
+            "model": MODEL_NAME,
+            "count": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "route": route,
+            "paths": paths,
+            "pdf_bytes": len(pdf_data),
+            "render_ms": render_elapsed * 1000,
+            "elapsed": time.perf_counter() - start
+        }
+    }
+
+def sse_event(event: str, data: Any) -> str:
+    """格式化一条 server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def open_upstream_stream(image_data: bytes, prompt: str, mime_type: str = "image/jpeg") -> aiohttp.ClientResponse:
+    """
+    发起流式上游请求
+    
+    在返回流式响应之前调用：限速和重试都在流开始之前完成，连接失败或上游返回错误时抛出 HTTPException，
+    客户端仍能收到正确的状态码。
+    """
+    headers, body = build_upstream_request(image_data, prompt, stream=True, mime_type=mime_type)
+    return await send_upstream(headers, body, estimate_tokens(prompt), stream=True)
+
+async def iter_upstream_chunks(response: aiohttp.ClientResponse):
+    """逐个解析上游 SSE 流中的 JSON 数据块，遇到 [DONE] 结束"""
+    async for raw_line in response.content:
+        line = raw_line.decode("utf-8").strip()
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            logger.warning(f"无法解析上游数据块: {data}")
+
+class UpstreamStreamingResponse(StreamingResponse):
+    """
+    转发上游流的 StreamingResponse，无论响应如何结束都释放上游连接
+
+    客户端在开始迭代之前断开、发送被取消或生成器抛出任意异常时，生成器自身的 finally 可能不会执行，
+    因此在响应结束时关闭生成器并释放连接（重复释放没有影响）。
+    """
+    
+    def __init__(self, content, upstream: Optional[aiohttp.ClientResponse], **kwargs):
+        super().__init__(content, **kwargs)
+        self.upstream = upstream
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+            finally:
+                if self.upstream is not None:
+                    self.upstream.release()
+
+@app.post("/analyze/stream")
+async def analyze_image_stream(
+    file: UploadFile = File(...),
+    prompt: str = Form(...),
+    json_mode: bool = Form(False),
+):
+    """
+    上传图片和提示词，以 server-sent events 流式返回模型输出
+    
+    - **file**: 要分析的图片文件
+    - **prompt**: 分析提示词
+    - **json_mode**: 为 true 时要求模型返回JSON，并在结束前发送解析后的 result 事件
+    
+    事件依次为：若干 token 事件（{"content": 文本片段}）、json_mode 下的 result 事件，
+    最后是 _meta 事件（模型、token用量、缓存命中情况、首个token耗时和总耗时）；出错时发送 error 事件。
+    """
+    # 验证文件类型
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="请上传有效的图片文件")
+    
+    image_data = await read_upload(file, MAX_UPLOAD_BYTES)
+    if json_mode:
+        prompt += JSON_PROMPT_SUFFIX
+    start = time.perf_counter()
+    
+    # 缓存命中时直接返回完整结果，未命中时先建立上游流
+    key = analysis_cache_key(image_data, prompt) if response_cache.enabled else None
+    cached, tier = (await response_cache.get(key)) if key else (None, None)
+    upstream = None
+    image_info = None
+    if cached is None:
+        prepared, mime_type, image_info = await prepare_image(image_data)
+        upstream = await open_upstream_stream(prepared, prompt, mime_type)
+    
+    async def events():
+        first_token = None
+        if cached is not None:
+            api_response = cached
+            cache_info = {"cache": "hit", "cache_tier": tier}
+            service_metrics.cache.inc(endpoint=current_endpoint.get(), result="hit")
+            first_token = time.perf_counter() - start
+            yield sse_event("token", {"content": cached["choices"][0]["message"]["content"]})
+        else:
+            parts = []
+            model = MODEL_NAME
+            usage = None
+            try:
+                async for chunk in iter_upstream_chunks(upstream):
+                    model = chunk.get("model") or model
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    for choice in chunk.get("choices") or []:
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            if first_token is None:
+                                first_token = time.perf_counter() - start
+                            parts.append(content)
+                            yield sse_event("token", {"content": content})
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"读取上游流时发生错误: {str(e)}")
+                yield sse_event("error", {"error": f"读取上游流时发生错误: {str(e)}"})
+                return
+            finally:
+                upstream.release()
+                upstream_scheduler.settle(estimate_tokens(prompt), usage)
+                service_metrics.observe_usage(MODEL_NAME, usage)
+            
+            # 组装为与非流式接口相同的响应格式，写入缓存供后续请求复用
+            api_response = {
+                "model": model,
+                "choices": [{"message": {"role": "assistant", "content": "".join(parts)}}],
+                "usage": usage
+            }
+            cache_info = {"cache": "miss", "image": image_info}
+            service_metrics.cache.inc(endpoint=current_endpoint.get(), result="miss")
+            if key:
+                await response_cache.set(key, api_response)
+        
+        if json_mode:
+            result = build_json_response(api_response, cache_info)
+            result.pop("_meta")
+            yield sse_event("result", result)
+        
+        yield sse_event("_meta", {
+            "model": api_response.get("model", MODEL_NAME),
+            "usage": api_response.get("usage"),
+            **cache_info,
+            "first_token_ms": first_token * 1000 if first_token is not None else None,
+            "elapsed_ms": (time.perf_counter() - start) * 1000
+        })
+    
+    return UpstreamStreamingResponse(
+        events(),
+        upstream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式的指标：请求数、端到端和上游耗时、进行中的请求数、重试次数、请求体大小和token用量"""
+    return Response(content=service_metrics.render(), media_type=service_metrics.content_type)
+
 @app.get("/health")
 async def health_check():
     """健康检查端点"""
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "upstream": upstream_scheduler.stats(),
+        "single_flight": single_flight.stats(),
+        "jobs": job_queue.stats() if job_queue is not None else None
+    }
 
 if __name__ == "__main__":
     # 创建目录结构
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import threading
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.routing import Match
+
+# 当前请求的端点（路由路径），供上游调用和token统计打标签
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="none")
+
+# 延迟直方图的默认分桶（秒），覆盖缓存命中到长时间生成
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# 数据大小直方图的默认分桶（字节），1 KB 到 64 MB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 的标签必须为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Gauge(Counter):
+    """可增可减的当前值，例如进行中的请求数"""
+
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """按分桶累计观测值的直方图，同时记录总和与次数"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+class Registry:
+    """指标集合，按 Prometheus 文本格式（0.0.4）输出"""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    """
+    记录每个 HTTP 请求的次数、耗时（流式响应到最后一个分块为止）、进行中的请求数和请求体大小
+
+    端点标签使用路由路径模板（例如 /jobs/{job_id}），路径匹配但方法不同的请求（例如 CORS 预检）也按该路由计数，
+    未匹配任何路由的请求归为 other，避免标签数量随任意路径增长。
+
+    Args:
+        app: 下一层 ASGI 应用
+        registry: 记录指标的 ServiceMetrics
+        routes: 应用的路由列表（请求时读取，此时所有路由都已注册）
+    """
+
+    def __init__(self, app, registry: "ServiceMetrics", routes: Sequence):
+        self.app = app
+        self.metrics = registry
+        self.routes = routes
+
+    def _endpoint(self, scope) -> str:
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            # 路径匹配但方法不同（例如 CORS 预检的 OPTIONS 请求）时仍按该路由计数
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        return partial or "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        method = scope["method"]
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit():
+                self.metrics.request_bytes.observe(int(value), endpoint=endpoint)
+                break
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        token = current_endpoint.set(endpoint)
+        self.metrics.requests_in_flight.inc(endpoint=endpoint)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics.requests_in_flight.dec(endpoint=endpoint)
+            self.metrics.request_duration.observe(time.perf_counter() - start, endpoint=endpoint)
+            self.metrics.requests.inc(endpoint=endpoint, method=method, status=status["code"])
+            current_endpoint.reset(token)
+
+class ServiceMetrics(Registry):
+    """llm-img2json 的全部指标"""
+
+    def __init__(self, prefix: str = "img2json"):
+        super().__init__()
+        self.requests = self.counter(
+            f"{prefix}_http_requests_total", "HTTP请求数", ("endpoint", "method", "status"))
+        self.request_duration = self.histogram(
+            f"{prefix}_http_request_duration_seconds", "HTTP请求端到端耗时（秒）", ("endpoint",))
+        self.requests_in_flight = self.gauge(
+            f"{prefix}_http_requests_in_flight", "进行中的HTTP请求数", ("endpoint",))
+        self.request_bytes = self.histogram(
+            f"{prefix}_http_request_bytes", "HTTP请求体大小（字节）", ("endpoint",), SIZE_BUCKETS)
+
+        self.upstream_requests = self.counter(
+            f"{prefix}_upstream_requests_total", "上游请求数（每次尝试计一次，网络错误的状态为 error）",
+            ("endpoint", "model", "status"))
+        self.upstream_duration = self.histogram(
+            f"{prefix}_upstream_request_duration_seconds",
+            "每次上游请求到收到响应头的耗时（秒），非流式请求的响应头在生成完成后才返回", ("endpoint", "model", "stream"))
+        self.upstream_in_flight = self.gauge(
+            f"{prefix}_upstream_requests_in_flight", "等待上游响应的请求数（流式请求到响应头为止）", ("endpoint", "model"))
+        self.upstream_retries = self.counter(
+            f"{prefix}_upstream_retries_total", "上游重试次数（按触发重试的状态码，网络错误为 network）",
+            ("endpoint", "model", "status"))
+        self.upstream_wait = self.counter(
+            f"{prefix}_upstream_rate_limit_wait_seconds_total", "因限速或 429 暂停而等待的总时间（秒）", ("endpoint", "model"))
+        self.upstream_request_bytes = self.histogram(
+            f"{prefix}_upstream_request_bytes", "发往上游的请求体大小（字节）", ("endpoint", "model"), SIZE_BUCKETS)
+        self.tokens = self.counter(
+            f"{prefix}_tokens_total", "上游返回的token用量", ("endpoint", "model", "type"))
+        self.cache = self.counter(
+            f"{prefix}_cache_requests_total", "响应缓存查询结果（hit、miss、coalesced）", ("endpoint", "result"))
+
+    def observe_usage(self, model: str, usage: Optional[Dict[str, int]]):
+        """累计一次上游响应的token用量"""
+        if not usage:
+            return
+        endpoint = current_endpoint.get()
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind) is not None:
+                self.tokens.inc(usage[kind], endpoint=endpoint, model=model, type=kind.split("_")[0])
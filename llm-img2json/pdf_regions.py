@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import asyncio
+import logging
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+# MuPDF 不支持多个线程同时调用，所有渲染和文本提取都需持有此锁
+render_lock = threading.RLock()
+
+# 区域处理方式：vlm 全部交给模型；text 只使用文本层；hybrid 文本层合格时使用文本层，否则交给模型
+ROUTES = ("vlm", "hybrid", "text")
+
+def parse_regions(raw: str, default_prompt: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    解析区域列表
+
+    格式为JSON数组，每项为 {"page": 页码（从0开始）, "rect": [x0, y0, x1, y1], "prompt": 提示词（可选）}，
+    rect 为显示页面（已应用旋转）上以左上角为原点的PDF点坐标，与查看器缩放比例为1时的坐标一致。
+
+    Args:
+        raw: JSON字符串
+        default_prompt: 区域未指定提示词时使用的提示词
+
+    Returns:
+        list: 规范化后的区域列表
+
+    Raises:
+        ValueError: 格式错误
+    """
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"regions 不是有效的JSON: {e}")
+    if not isinstance(data, list) or not data:
+        raise ValueError("regions 必须是非空数组")
+
+    regions = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            raise ValueError(f"第 {index} 个区域格式错误")
+        rect = item.get("rect")
+        if not isinstance(rect, (list, tuple)) or len(rect) != 4:
+            raise ValueError(f"第 {index} 个区域的 rect 必须为 [x0, y0, x1, y1]")
+        prompt = item.get("prompt") or default_prompt
+        if not prompt:
+            raise ValueError(f"第 {index} 个区域缺少 prompt")
+        try:
+            page = int(item.get("page", 0))
+        except (TypeError, ValueError):
+            raise ValueError(f"第 {index} 个区域的 page 必须为整数")
+        try:
+            rect = [float(v) for v in rect]
+        except (TypeError, ValueError):
+            raise ValueError(f"第 {index} 个区域的 rect 必须为4个数字")
+        regions.append({
+            "page": page,
+            "rect": rect,
+            "prompt": prompt,
+        })
+    return regions
+
+def assess_text_layer(text: str, area: float, min_chars: int = 2, min_valid_ratio: float = 0.9,
+                      min_density: float = 0.2) -> Tuple[bool, Dict[str, Any]]:
+    """
+    检查区域文本层是否可以直接使用
+
+    Args:
+        text: 文本层提取的区域文本
+        area: 区域面积（平方PDF点）
+        min_chars: 最少非空白字符数
+        min_valid_ratio: 有效字符（非私用区、非替换字符、非控制字符）的最低比例，
+            字体编码损坏时提取结果通常是私用区字符或乱码
+        min_density: 每 1000 平方点的最少字符数，过低说明区域内容主要是图像
+
+    Returns:
+        tuple: (是否合格, 检查指标)
+    """
+    chars = [c for c in text if not c.isspace()]
+    valid = sum(1 for c in chars if c != "\ufffd" and unicodedata.category(c) not in ("Co", "Cn", "Cc", "Cs"))
+    valid_ratio = valid / len(chars) if chars else 0.0
+    density = len(chars) / (area / 1000) if area > 0 else 0.0
+
+    metrics = {
+        "chars": len(chars),
+        "valid_ratio": round(valid_ratio, 3),
+        "density": round(density, 3),
+    }
+    if len(chars) < min_chars:
+        metrics["reason"] = "文本过少"
+    elif valid_ratio < min_valid_ratio:
+        metrics["reason"] = "无效字符过多"
+    elif density < min_density:
+        metrics["reason"] = "文本密度过低"
+    return "reason" not in metrics, metrics
+
+def _page_chars(page) -> List[Tuple[float, float, int, str]]:
+    """
+    提取整页字符的中心点、行号和字符，每页只提取一次
+
+    与 PDF 区域选择器的 PageText 规则相同：字符中心点落在区域内即属于该区域。
+    """
+    flags = fitz.TEXTFLAGS_RAWDICT & ~fitz.TEXT_PRESERVE_IMAGES
+    chars = []
+    line_index = 0
+    for block in page.get_text("rawdict", flags=flags)["blocks"]:
+        if block["type"] != 0:  # 只处理文本块
+            continue
+        for line in block["lines"]:
+            for span in line["spans"]:
+                for char in span["chars"]:
+                    x0, y0, x1, y1 = char["bbox"]
+                    chars.append(((x0 + x1) / 2, (y0 + y1) / 2, line_index, char["c"]))
+            line_index += 1
+    return chars
+
+def _text_in_rect(chars: List[Tuple[float, float, int, str]], rect) -> str:
+    """中心点落在矩形（文本坐标）内的字符按行拼接"""
+    lines = {}
+    for cx, cy, line_index, c in chars:
+        if rect.x0 <= cx <= rect.x1 and rect.y0 <= cy <= rect.y1:
+            lines.setdefault(line_index, []).append(c)
+    line_texts = ("".join(lines[line_index]).strip() for line_index in sorted(lines))
+    return "\n".join(text for text in line_texts if text)
+
+def _region_text(page, clip, page_chars: Dict[int, Any]) -> str:
+    # 同一页面的多个区域共用一次字符提取
+    chars = page_chars.get(page.number)
+    if chars is None:
+        chars = page_chars[page.number] = _page_chars(page)
+    # clip 为显示页面（已旋转）坐标，文本坐标未旋转
+    text_rect = clip * page.derotation_matrix
+    text_rect.normalize()
+    return _text_in_rect(chars, text_rect)
+
+def render_regions(pdf_data: bytes, regions: List[Dict[str, Any]], dpi: float, max_edge: int = 0,
+                   image_format: str = "jpeg", quality: int = 85, route: str = "vlm",
+                   text_check: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """
+    打开一次PDF，按处理方式提取区域文本层和（或）按目标DPI渲染区域
+
+    区域长边超过 max_edge 时降低渲染比例，渲染结果直接编码为最终发送的格式，不再经过图片预处理。
+    hybrid 方式下只渲染文本层检查不合格的区域。
+
+    Args:
+        route: vlm、hybrid 或 text（见 ROUTES）
+        text_check: 传给 assess_text_layer 的阈值参数
+
+    Returns:
+        list: 与 regions 顺序一致，每项为
+            {"path": "text_layer", "text": 文本, "text_quality": 检查指标} 或
+            {"path": "vlm", "image": (图片数据, MIME类型, 渲染信息), "text_quality": 检查指标（hybrid）}，
+            该区域无法处理时为 ValueError
+
+    Raises:
+        ValueError: 数据不是有效的PDF
+    """
+    with render_lock:
+        try:
+            doc = fitz.open(stream=pdf_data, filetype="pdf")
+        except Exception as e:
+            raise ValueError(f"无法打开PDF: {e}")
+
+        try:
+            results = []
+            page_chars = {}
+            for region in regions:
+                page_num = region["page"]
+                if not 0 <= page_num < len(doc):
+                    results.append(ValueError(f"页码超出范围: {page_num}（共 {len(doc)} 页）"))
+                    continue
+
+                page = doc.load_page(page_num)
+                clip = fitz.Rect(region["rect"]).normalize() & page.rect
+                if clip.is_empty:
+                    results.append(ValueError("区域不在页面范围内"))
+                    continue
+
+                result = {}
+                if route != "vlm":
+                    text = _region_text(page, clip, page_chars)
+                    usable, metrics = assess_text_layer(text, clip.width * clip.height, **(text_check or {}))
+                    result["text_quality"] = metrics
+                    if usable or route == "text":
+                        result.update({"path": "text_layer", "text": text})
+                        results.append(result)
+                        continue
+
+                scale = dpi / 72
+                if max_edge:
+                    scale = min(scale, max_edge / max(clip.width, clip.height))
+                pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=clip, alpha=False)
+                if image_format == "png":
+                    data, mime_type = pix.tobytes("png"), "image/png"
+                else:
+                    data, mime_type = pix.tobytes("jpeg", jpg_quality=quality), "image/jpeg"
+
+                result.update({"path": "vlm", "image": (data, mime_type, {
+                    "bytes": len(data),
+                    "size": [pix.width, pix.height],
+                    "dpi": round(scale * 72, 2),
+                    "format": mime_type.split("/")[1],
+                })})
+                results.append(result)
+            return results
+        finally:
+            doc.close()
+
+async def render_regions_async(pdf_data: bytes, regions: List[Dict[str, Any]], dpi: float, max_edge: int = 0,
+                               image_format: str = "jpeg", quality: int = 85, route: str = "vlm",
+                               text_check: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """在线程中处理区域，不阻塞事件循环"""
+    return await asyncio.to_thread(
+        render_regions, pdf_data, regions, dpi, max_edge, image_format, quality, route, text_check
+    )
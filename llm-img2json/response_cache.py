@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def cache_key(image_data: bytes, prompt: str, model: str, max_tokens: int, variant: str = "") -> str:
+    """
+    计算请求的内容寻址缓存键
+
+    Args:
+        image_data: 上传的原始图片数据
+        prompt: 提示词
+        model: 模型名称
+        max_tokens: 最大生成token数
+        variant: 其他影响结果的参数（例如图片预处理设置）
+
+    Returns:
+        str: SHA-256 十六进制摘要
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_data).digest())
+    digest.update(json.dumps([prompt, model, max_tokens, variant], ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+class DiskCache:
+    """
+    基于单个 SQLite 文件的磁盘缓存层，按 TTL 过期，超过容量时淘汰最久未访问的条目
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        size INTEGER NOT NULL,
+        value TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at);
+    """
+
+    def __init__(self, path: str, ttl: float, max_bytes: int):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """返回 (写入时间, 响应)，不存在或已过期时返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl and now - row[0] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, value: Dict[str, Any]):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, created_at, accessed_at, size, value) VALUES (?, ?, ?, ?, ?)",
+                (key, now, now, size, data)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        # 先删除过期条目，再按最近访问时间淘汰直到总大小不超过上限
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"path": self.path, "size": count, "bytes": total, "max_bytes": self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ResponseCache:
+    """
+    上游响应的两级缓存：内存 LRU + 可选的磁盘层（SQLite）
+
+    只缓存成功的响应。内存未命中而磁盘命中时，结果会回填到内存层。
+
+    Args:
+        max_entries: 内存层最多保留的条目数，0 表示不使用内存层
+        ttl: 条目有效期（秒），0 表示不过期
+        disk_path: 磁盘层的数据库路径，None 表示不使用磁盘层
+        disk_max_bytes: 磁盘层的容量上限（字节）
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400,
+                 disk_path: Optional[str] = None, disk_max_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.disk = DiskCache(disk_path, ttl, disk_max_bytes) if disk_path else None
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.disk is not None
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        created_at, value = entry
+        if self.ttl and time.time() - created_at > self.ttl:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: Dict[str, Any], created_at: Optional[float] = None):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (created_at or time.time(), value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        查询缓存
+
+        Returns:
+            tuple: (缓存的响应, 命中的层 "memory"/"disk")，未命中时为 (None, None)
+        """
+        value = self._memory_get(key)
+        if value is not None:
+            self.hits["memory"] += 1
+            return value, "memory"
+
+        if self.disk is not None:
+            try:
+                # 磁盘读写放到线程池中，避免阻塞事件循环
+                entry = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"读取磁盘缓存失败: {e}")
+                entry = None
+            if entry is not None:
+                created_at, value = entry
+                # 回填内存层时保留原写入时间，过期时间不会被延长
+                self._memory_set(key, value, created_at)
+                self.hits["disk"] += 1
+                return value, "disk"
+
+        self.misses += 1
+        return None, None
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        """写入缓存（内存层和磁盘层）"""
+        self._memory_set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value)
+            except sqlite3.Error as e:
+                logger.warning(f"写入磁盘缓存失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "memory_size": len(self._memory),
+            "memory_max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": dict(self.hits),
+            "misses": self.misses
+        }
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+class SingleFlight:
+    """
+    合并相同键的并发请求：同一时刻只执行一次，其余请求等待并共享同一结果（或异常）
+
+    实际的调用在独立任务中执行，发起请求的客户端断开（任务被取消）不会影响其他等待者。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Task"] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行或加入相同键的调用
+
+        Args:
+            key: 请求键
+            factory: 没有进行中的调用时用于发起调用的协程函数
+
+        Returns:
+            tuple: (结果, 是否加入了其他请求发起的调用)
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key: str, task: "asyncio.Task"):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有等待者都已取消时也要取出异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    async def cancel_all(self):
+        """取消所有进行中的调用（服务关闭时使用，等待者会收到 CancelledError）"""
+        tasks = list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._inflight), "coalesced": self.coalesced}
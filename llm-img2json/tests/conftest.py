@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import asyncio
+import threading
+
+import pytest
+from aiohttp import web
+
+# 服务模块位于 llm-img2json 目录下（目录名不是合法的包名），直接加入导入路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class StubUpstream:
+    """
+    在后台线程中运行的上游 chat/completions 模拟服务
+
+    handler 为 async handler(request, payload) -> web.StreamResponse，payload 是解析后的请求体；
+    requests 按到达顺序记录全部请求体。
+    """
+
+    def __init__(self):
+        self.handler = None
+        self.requests = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._runner = None
+        self.url = self._call(self._start())
+
+    def _call(self, coro, timeout=10):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    async def _start(self) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/v1/chat/completions"
+
+    async def _handle(self, request):
+        payload = await request.json()
+        self.requests.append(payload)
+        return await self.handler(request, payload)
+
+    @staticmethod
+    def completion(content, usage=None):
+        """非流式上游响应"""
+        return {
+            "model": "stub",
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": usage or {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+
+    @staticmethod
+    def prompt_of(payload) -> str:
+        """上游请求中的提示词"""
+        return payload["messages"][0]["content"][0]["text"]
+
+    def close(self):
+        self._call(self._runner.cleanup())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+@pytest.fixture
+def upstream():
+    stub = StubUpstream()
+    yield stub
+    stub.close()
+
+@pytest.fixture
+def api(upstream, tmp_path, monkeypatch):
+    """
+    指向模拟上游的服务（运行应用生命周期），返回 (TestClient, main 模块)
+
+    每个测试使用独立的响应缓存、调度器和任务数据库，避免测试之间互相影响。
+    """
+    from starlette.testclient import TestClient
+
+    monkeypatch.setenv("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY") or "test-key")
+    import main
+    from response_cache import ResponseCache
+    from upstream_scheduler import UpstreamScheduler
+
+    monkeypatch.setattr(main, "AI_API_URL", upstream.url)
+    monkeypatch.setattr(main, "JOB_DB_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(main, "response_cache", ResponseCache(max_entries=0))
+    monkeypatch.setattr(main, "upstream_scheduler", UpstreamScheduler(max_retries=2, backoff_base=0.01))
+    with TestClient(main.app) as client:
+        yield client, main
+
+@pytest.fixture
+def png():
+    """生成测试用PNG图片，seed 不同时内容不同"""
+    import io
+    from PIL import Image
+
+    def make(seed=0, size=(8, 8)):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, (seed % 256, 0, 0)).save(buffer, format="PNG")
+        return buffer.getvalue()
+    return make
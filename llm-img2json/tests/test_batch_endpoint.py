@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+from aiohttp import web
+
+def _echo(upstream, delay=0.0):
+    """按提示词返回 {"prompt": 提示词}；提示词包含 bad 时返回 400"""
+    async def handler(request, payload):
+        prompt = upstream.prompt_of(payload)
+        await asyncio.sleep(delay(prompt) if callable(delay) else delay)
+        if "bad" in prompt:
+            return web.json_response({"error": {"message": "invalid"}}, status=400)
+        return web.json_response(upstream.completion(json.dumps({"prompt": prompt})))
+    return handler
+
+def test_batch_reports_item_errors_without_failing(api, upstream, png):
+    client, main = api
+    upstream.handler = _echo(upstream)
+    files = [("files", ("a.png", png(1), "image/png")), ("files", ("notes.txt", b"text", "text/plain")),
+             ("files", ("c.png", png(3), "image/png"))]
+    response = client.post("/analyze/batch", files=files, data={"prompts": ["ok", "ok", "bad"]})
+    assert response.status_code == 200
+    body = response.json()
+    results = body["results"]
+    assert [(r["index"], r["filename"], r["status"]) for r in results] == [
+        (0, "a.png", "ok"), (1, "notes.txt", "error"), (2, "c.png", "error")]
+    assert results[0]["data"]["result"] == json.dumps({"prompt": "ok"})
+    assert results[1]["status_code"] == 400
+    assert results[2]["status_code"] == 400
+    assert "invalid" in results[2]["error"]
+    assert body["_meta"]["succeeded"] == 1
+    assert body["_meta"]["failed"] == 2
+    # 无效文件不发往上游
+    assert len(upstream.requests) == 2
+
+def test_batch_results_follow_input_order(api, upstream, png):
+    client, main = api
+    # 越靠前的条目越晚完成
+    upstream.handler = _echo(upstream, delay=lambda prompt: (5 - int(prompt[1])) * 0.02)
+    prompts = [f"p{i}" for i in range(5)]
+    response = client.post("/analyze/batch", files=[("files", ("a.png", png(), "image/png"))],
+                           data={"prompts": prompts, "json_mode": "true"})
+    results = response.json()["results"]
+    assert [r["index"] for r in results] == list(range(5))
+    assert [r["data"]["prompt"] for r in results] == [p + main.JSON_PROMPT_SUFFIX for p in prompts]
+
+def test_batch_limits_upstream_concurrency(api, upstream, png, monkeypatch):
+    client, main = api
+    monkeypatch.setattr(main, "BATCH_CONCURRENCY", 2)
+    state = {"active": 0, "peak": 0}
+    echo = _echo(upstream)
+
+    async def handler(request, payload):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(0.05)
+            return await echo(request, payload)
+        finally:
+            state["active"] -= 1
+
+    upstream.handler = handler
+    files = [("files", (f"{i}.png", png(i), "image/png")) for i in range(6)]
+    response = client.post("/analyze/batch", files=files, data={"prompts": ["p"]})
+    body = response.json()
+    assert body["_meta"]["succeeded"] == 6
+    assert body["_meta"]["concurrency"] == 2
+    assert state["peak"] == 2
+
+def test_batch_rejects_mismatched_prompts(api, png):
+    client, main = api
+    files = [("files", (f"{i}.png", png(i), "image/png")) for i in range(2)]
+    response = client.post("/analyze/batch", files=files, data={"prompts": ["a", "b", "c"]})
+    assert response.status_code == 400
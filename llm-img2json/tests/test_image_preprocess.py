@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import io
+
+from PIL import Image
+
+from image_preprocess import ImagePreprocessor, detect_format, normalize_image
+
+def _image_bytes(fmt, size=(64, 48), mode="RGB"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 10, 10, 128) if mode == "RGBA" else (200, 10, 10)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+def test_large_image_is_resized_to_max_edge():
+    data, mime_type, info = normalize_image(_image_bytes("PNG", (400, 200)), max_edge=100)
+    assert mime_type == "image/jpeg"
+    assert info["resized"] is True
+    assert info["original_size"] == [400, 200]
+    assert info["size"] == [100, 50]
+    assert Image.open(io.BytesIO(data)).size == (100, 50)
+
+def test_alpha_image_is_encoded_as_png():
+    data, mime_type, info = normalize_image(_image_bytes("PNG", (400, 200), "RGBA"), max_edge=100)
+    assert mime_type == "image/png"
+    assert Image.open(io.BytesIO(data)).mode == "RGBA"
+
+def test_small_original_is_kept():
+    # 噪声图片重新编码为 PNG 比原始 JPEG 大得多
+    buffer = io.BytesIO()
+    Image.effect_noise((64, 48), 64).convert("RGB").save(buffer, format="JPEG", quality=50)
+    original = buffer.getvalue()
+    data, mime_type, info = normalize_image(original, max_edge=2048, output_format="png")
+    assert data == original
+    assert mime_type == "image/jpeg"
+    assert info["format"] == "jpeg"
+    assert info["resized"] is False
+
+def test_invalid_image_raises_value_error():
+    try:
+        normalize_image(b"not an image")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("应抛出 ValueError")
+
+def test_detect_format():
+    assert detect_format(_image_bytes("PNG")) == "PNG"
+    assert detect_format(_image_bytes("BMP")) == "BMP"
+    assert detect_format(b"not an image") is None
+
+def test_passthrough_labels_actual_format():
+    preprocessor = ImagePreprocessor(output_format="none")
+    assert preprocessor.signature == "raw"
+
+    async def scenario():
+        for fmt, expected in (("PNG", "image/png"), ("BMP", "image/bmp")):
+            data = _image_bytes(fmt)
+            result, mime_type, info = await preprocessor.process(data)
+            assert result == data
+            assert mime_type == expected
+            assert info["format"] == fmt.lower()
+        _, mime_type, info = await preprocessor.process(b"unknown")
+        assert mime_type == "image/jpeg"
+        assert info["format"] is None
+
+    asyncio.run(scenario())
+    # 不处理图片时不创建线程池
+    assert preprocessor._executor is None
+
+def test_executor_is_recreated_after_shutdown():
+    preprocessor = ImagePreprocessor(max_edge=32)
+    data = _image_bytes("PNG")
+
+    async def scenario():
+        return (await preprocessor.process(data))[2]["size"]
+
+    assert asyncio.run(scenario()) == [32, 24]
+    preprocessor.shutdown()
+    assert preprocessor._executor is None
+    assert asyncio.run(scenario()) == [32, 24]
+    preprocessor.shutdown()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+
+import pytest
+
+import job_queue
+from job_queue import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobStore
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+async def _echo(params, files):
+    return {"params": params, "files": [f["filename"] for f in files]}
+
+def test_store_round_trip(db_path):
+    store = JobStore(db_path)
+    try:
+        store.create("a", {"prompt": "提示"}, [
+            {"filename": "x.png", "data": b"\x89PNG"},
+            {"filename": "bad.txt", "error": {"error": "不支持"}},
+        ])
+        assert store.get("a")["status"] == QUEUED
+        job = store.load("a")
+        assert job["params"] == {"prompt": "提示"}
+        assert job["attempts"] == 0
+        assert job["files"] == [
+            {"filename": "x.png", "data": b"\x89PNG", "error": None},
+            {"filename": "bad.txt", "data": None, "error": {"error": "不支持"}},
+        ]
+
+        store.mark_running("a")
+        assert store.get("a")["status"] == RUNNING
+        assert store.load("a")["attempts"] == 1
+
+        store.finish("a", SUCCEEDED, {"ok": True})
+        job = store.get("a")
+        assert job["status"] == SUCCEEDED
+        assert job["result"] == {"ok": True}
+        # 结束后只保留结果，文件被删除
+        assert store.load("a")["files"] == []
+        assert store.get("missing") is None
+        assert store.load("missing") is None
+    finally:
+        store.close()
+
+def test_store_prune_and_pending(db_path, monkeypatch):
+    store = JobStore(db_path)
+    try:
+        for job_id in ("old", "new", "running", "queued"):
+            store.create(job_id, {}, [])
+        now = time.time()
+        monkeypatch.setattr(job_queue.time, "time", lambda: now - 100)
+        store.finish("old", FAILED, error="x")
+        monkeypatch.setattr(job_queue.time, "time", lambda: now)
+        store.finish("new", SUCCEEDED, {})
+        store.mark_running("running")
+
+        assert store.prune(50) == 1
+        assert store.get("old") is None
+        assert store.get("new") is not None
+        # 未结束的任务不会被清理
+        assert store.pending() == ["running", "queued"]
+        assert store.counts() == {SUCCEEDED: 1, RUNNING: 1, QUEUED: 1}
+    finally:
+        store.close()
+
+def test_queue_runs_jobs_and_wait_returns_result(db_path):
+    async def scenario():
+        store = JobStore(db_path)
+        queue = JobQueue(store, _echo, workers=1, ttl=0)
+        await queue.start()
+        try:
+            job = await queue.submit({"n": 1}, [{"filename": "a.png", "data": b"1"}])
+            done = await queue.wait(job["job_id"], timeout=5)
+            assert done["status"] == SUCCEEDED
+            assert done["attempts"] == 1
+            assert done["result"] == {"params": {"n": 1}, "files": ["a.png"]}
+            assert await queue.wait("missing", timeout=1) is None
+        finally:
+            await queue.stop()
+            store.close()
+
+    asyncio.run(scenario())
+
+def test_failed_handler_marks_job_failed(db_path):
+    async def failing(params, files):
+        raise RuntimeError("上游错误")
+
+    async def scenario():
+        store = JobStore(db_path)
+        queue = JobQueue(store, failing, workers=1, ttl=0)
+        await queue.start()
+        try:
+            job = await queue.submit({}, [])
+            done = await queue.wait(job["job_id"], timeout=5)
+            assert done["status"] == FAILED
+            assert done["error"] == "上游错误"
+        finally:
+            await queue.stop()
+            store.close()
+
+    asyncio.run(scenario())
+
+def test_wait_timeout_does_not_leak_waiters(db_path):
+    async def scenario():
+        release = asyncio.Event()
+
+        async def blocked(params, files):
+            await release.wait()
+            return {}
+
+        store = JobStore(db_path)
+        queue = JobQueue(store, blocked, workers=1, ttl=0)
+        await queue.start()
+        try:
+            job = await queue.submit({}, [])
+            for _ in range(3):
+                assert (await queue.wait(job["job_id"], timeout=0.01))["status"] in (QUEUED, RUNNING)
+            assert queue._waiters == {}
+            assert queue.stats()["waiting_queries"] == 0
+
+            waiter = asyncio.ensure_future(queue.wait(job["job_id"], timeout=5))
+            await asyncio.sleep(0.05)
+            assert queue.stats()["waiting_queries"] == 1
+            release.set()
+            assert (await waiter)["status"] == SUCCEEDED
+            assert queue._waiters == {}
+        finally:
+            await queue.stop()
+            store.close()
+
+    asyncio.run(scenario())
+
+def test_submit_rejects_when_queue_is_full(db_path):
+    async def scenario():
+        store = JobStore(db_path)
+        # workers=0 时任务只排队，不会被取走执行
+        queue = JobQueue(store, _echo, workers=0, ttl=0, max_queued=1)
+        await queue.start()
+        try:
+            await queue.submit({}, [])
+            with pytest.raises(OverflowError):
+                await queue.submit({}, [])
+        finally:
+            await queue.stop()
+            store.close()
+
+    asyncio.run(scenario())
+
+def test_unfinished_jobs_are_recovered_on_start(db_path):
+    store = JobStore(db_path)
+    store.create("interrupted", {"n": 1}, [{"filename": "a.png", "data": b"1"}])
+    store.mark_running("interrupted")
+    store.create("queued", {"n": 2}, [])
+    store.close()
+
+    async def scenario():
+        store = JobStore(db_path)
+        queue = JobQueue(store, _echo, workers=1, ttl=0)
+        await queue.start()
+        try:
+            interrupted = await queue.wait("interrupted", timeout=5)
+            assert interrupted["status"] == SUCCEEDED
+            assert interrupted["attempts"] == 2
+            assert interrupted["result"]["files"] == ["a.png"]
+            assert (await queue.wait("queued", timeout=5))["status"] == SUCCEEDED
+        finally:
+            await queue.stop()
+            store.close()
+
+    asyncio.run(scenario())
+
+def test_jobs_over_max_attempts_are_failed(db_path):
+    calls = []
+
+    async def handler(params, files):
+        calls.append(params)
+        return {}
+
+    store = JobStore(db_path)
+    store.create("crashy", {}, [])
+    for _ in range(3):
+        store.mark_running("crashy")
+    store.close()
+
+    async def scenario():
+        store = JobStore(db_path)
+        queue = JobQueue(store, handler, workers=1, ttl=0, max_attempts=3)
+        await queue.start()
+        try:
+            job = await queue.wait("crashy", timeout=5)
+            assert job["status"] == FAILED
+            assert "3 次" in job["error"]
+        finally:
+            await queue.stop()
+            store.close()
+
+    asyncio.run(scenario())
+    assert calls == []
+
+def test_finished_jobs_are_pruned_periodically(db_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "PRUNE_INTERVAL", 0.02)
+
+    async def scenario():
+        store = JobStore(db_path)
+        queue = JobQueue(store, _echo, workers=1, ttl=0.05)
+        await queue.start()
+        try:
+            job = await queue.submit({}, [])
+            assert (await queue.wait(job["job_id"], timeout=5))["status"] == SUCCEEDED
+            for _ in range(100):
+                await asyncio.sleep(0.02)
+                if await queue.get(job["job_id"]) is None:
+                    break
+            assert await queue.get(job["job_id"]) is None
+        finally:
+            await queue.stop()
+            store.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from metrics import MetricsMiddleware, Registry, ServiceMetrics, current_endpoint
+
+def test_counter_and_gauge_render():
+    registry = Registry()
+    counter = registry.counter("requests_total", "请求数", ("endpoint",))
+    gauge = registry.gauge("in_flight", "进行中")
+    counter.inc(endpoint="/b")
+    counter.inc(2, endpoint='/a"\n')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert registry.render() == (
+        "# HELP requests_total 请求数\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{endpoint="/a\\"\\n"} 2\n'
+        'requests_total{endpoint="/b"} 1\n'
+        "# HELP in_flight 进行中\n"
+        "# TYPE in_flight gauge\n"
+        "in_flight 1\n"
+    )
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("duration", "耗时", buckets=(1, 0.1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'duration_bucket{le="0.1"} 2',
+        'duration_bucket{le="1"} 3',
+        'duration_bucket{le="+Inf"} 4',
+        "duration_sum 3.65",
+        "duration_count 4",
+    ]
+
+def test_labels_must_match_declaration():
+    counter = Registry().counter("c", "c", ("endpoint",))
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc(endpoint="/", extra="x")
+
+def test_observe_usage_uses_current_endpoint():
+    metrics = ServiceMetrics(prefix="t")
+    token = current_endpoint.set("/analyze")
+    try:
+        metrics.observe_usage("m", {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15})
+        metrics.observe_usage("m", None)
+    finally:
+        current_endpoint.reset(token)
+    text = metrics.render()
+    assert 't_tokens_total{endpoint="/analyze",model="m",type="prompt"} 10' in text
+    assert 't_tokens_total{endpoint="/analyze",model="m",type="completion"} 5' in text
+
+def test_middleware_labels_requests_by_route_template():
+    metrics = ServiceMetrics(prefix="t")
+
+    async def job(request):
+        return PlainTextResponse(current_endpoint.get())
+
+    routes = [Route("/jobs/{job_id}", job)]
+    # 与 main.py 相同，指标中间件在 CORS 之外，预检请求也会被记录
+    app = Starlette(routes=routes, middleware=[
+        Middleware(MetricsMiddleware, registry=metrics, routes=routes),
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"]),
+    ])
+    client = TestClient(app)
+
+    assert client.get("/jobs/1").text == "/jobs/{job_id}"
+    client.get("/jobs/2")
+    client.get("/missing")
+    client.options("/jobs/3", headers={"Origin": "http://example.com", "Access-Control-Request-Method": "GET"})
+
+    text = metrics.render()
+    assert 't_http_requests_total{endpoint="/jobs/{job_id}",method="GET",status="200"} 2' in text
+    assert 't_http_requests_total{endpoint="/jobs/{job_id}",method="OPTIONS",status="200"} 1' in text
+    assert 't_http_requests_total{endpoint="other",method="GET",status="404"} 1' in text
+    assert 't_http_requests_in_flight{endpoint="/jobs/{job_id}"} 0' in text
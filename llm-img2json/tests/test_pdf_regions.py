@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+import fitz
+import pytest
+
+from pdf_regions import assess_text_layer, parse_regions, render_regions
+
+def _pdf(rotation=0):
+    """一页 200x100 的PDF，左上角写 "Hello World"，下方空白"""
+    doc = fitz.open()
+    page = doc.new_page(width=200, height=100)
+    page.insert_text((10, 30), "Hello World", fontsize=12)
+    page.set_rotation(rotation)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def test_parse_regions_normalizes_items():
+    regions = parse_regions(json.dumps([
+        {"page": "1", "rect": [0, 0, 100, 50]},
+        {"rect": [1, 2, 3, 4], "prompt": "表格"},
+    ]), default_prompt="默认")
+    assert regions == [
+        {"page": 1, "rect": [0.0, 0.0, 100.0, 50.0], "prompt": "默认"},
+        {"page": 0, "rect": [1.0, 2.0, 3.0, 4.0], "prompt": "表格"},
+    ]
+
+@pytest.mark.parametrize("raw, message", [
+    ("not json", "不是有效的JSON"),
+    ("[]", "非空数组"),
+    ('{"page": 0}', "非空数组"),
+    ("[1]", "第 0 个区域格式错误"),
+    ('[{"rect": [0, 0, 1]}]', r"rect 必须为 \[x0, y0, x1, y1\]"),
+    ('[{"rect": [0, 0, 1, 1]}]', "缺少 prompt"),
+    ('[{"rect": [0, 0, 1, 1], "prompt": "p"}, {"page": null, "rect": [0, 0, 1, 1], "prompt": "p"}]',
+     "第 1 个区域的 page 必须为整数"),
+    ('[{"page": [1], "rect": [0, 0, 1, 1], "prompt": "p"}]', "page 必须为整数"),
+    ('[{"page": "x", "rect": [0, 0, 1, 1], "prompt": "p"}]', "page 必须为整数"),
+    ('[{"rect": [0, null, 1, 1], "prompt": "p"}]', "rect 必须为4个数字"),
+    ('[{"rect": [0, "a", 1, 1], "prompt": "p"}]', "rect 必须为4个数字"),
+])
+def test_parse_regions_rejects_invalid_input(raw, message):
+    with pytest.raises(ValueError, match=message):
+        parse_regions(raw)
+
+def test_assess_text_layer():
+    usable, metrics = assess_text_layer("Hello World", 1000)
+    assert usable
+    assert metrics == {"chars": 10, "valid_ratio": 1.0, "density": 10.0}
+    assert assess_text_layer("a", 1000)[1]["reason"] == "文本过少"
+    assert assess_text_layer("\ue000\ue001ab", 1000)[1]["reason"] == "无效字符过多"
+    assert assess_text_layer("ab", 100000)[1]["reason"] == "文本密度过低"
+
+def _regions(*rects):
+    return [{"page": 0, "rect": list(rect), "prompt": "p"} for rect in rects]
+
+def test_render_regions_routes():
+    data = _pdf()
+    regions = _regions((0, 0, 120, 40), (0, 60, 200, 100))
+
+    text, blank = render_regions(data, regions, dpi=72, route="hybrid")
+    assert text["path"] == "text_layer"
+    assert text["text"] == "Hello World"
+    assert blank["path"] == "vlm"
+    assert blank["text_quality"]["reason"] == "文本过少"
+    image, mime_type, info = blank["image"]
+    assert mime_type == "image/jpeg"
+    assert info["size"] == [200, 40]
+
+    assert all(r["path"] == "vlm" and "text_quality" not in r for r in render_regions(data, regions, dpi=72))
+    assert [r["path"] for r in render_regions(data, regions, dpi=72, route="text")] == ["text_layer"] * 2
+
+def test_render_regions_limits_edge_and_reports_bad_regions():
+    regions = _regions((0, 0, 200, 100), (300, 300, 400, 400)) + [{"page": 3, "rect": [0, 0, 1, 1], "prompt": "p"}]
+    full, outside, missing = render_regions(_pdf(), regions, dpi=144, max_edge=100, image_format="png")
+    assert full["image"][1] == "image/png"
+    assert full["image"][2]["size"] == [100, 50]
+    assert full["image"][2]["dpi"] == 36
+    assert isinstance(outside, ValueError)
+    assert isinstance(missing, ValueError)
+
+def test_render_regions_uses_displayed_coordinates_on_rotated_pages():
+    # 旋转 90 度后显示页面为 100x200，文本位于右上角
+    data = _pdf(rotation=90)
+    text, blank = render_regions(data, _regions((60, 0, 100, 120), (0, 0, 40, 200)), dpi=72, route="text")
+    assert text["text"] == "Hello World"
+    assert blank["text"] == ""
+    vlm, = render_regions(data, _regions((60, 0, 100, 120)), dpi=72)
+    assert vlm["image"][2]["size"] == [40, 120]
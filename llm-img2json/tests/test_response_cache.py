@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+import response_cache
+from response_cache import DiskCache, ResponseCache, SingleFlight, cache_key
+
+def test_cache_key_depends_on_every_input():
+    base = cache_key(b"img", "prompt", "model", 100, "auto")
+    assert base == cache_key(b"img", "prompt", "model", 100, "auto")
+    assert len({
+        base,
+        cache_key(b"img2", "prompt", "model", 100, "auto"),
+        cache_key(b"img", "prompt2", "model", 100, "auto"),
+        cache_key(b"img", "prompt", "model2", 100, "auto"),
+        cache_key(b"img", "prompt", "model", 200, "auto"),
+        cache_key(b"img", "prompt", "model", 100, "raw"),
+    }) == 6
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+
+    async def scenario():
+        await cache.set("a", {"v": 1})
+        await cache.set("b", {"v": 2})
+        assert (await cache.get("a")) == ({"v": 1}, "memory")
+        await cache.set("c", {"v": 3})
+        assert (await cache.get("b")) == (None, None)
+        assert (await cache.get("a"))[0] == {"v": 1}
+
+    asyncio.run(scenario())
+    assert cache.stats()["hits"]["memory"] == 2
+    assert cache.stats()["misses"] == 1
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(max_entries=4, ttl=10)
+
+    async def scenario():
+        await cache.set("a", {"v": 1})
+        now[0] += 5
+        assert (await cache.get("a"))[0] == {"v": 1}
+        now[0] += 6
+        assert (await cache.get("a"))[0] is None
+
+    asyncio.run(scenario())
+
+def test_disk_tier_survives_restart_and_backfills_memory(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def scenario():
+        first = ResponseCache(max_entries=4, disk_path=path)
+        await first.set("a", {"v": 1})
+        first.close()
+
+        second = ResponseCache(max_entries=4, disk_path=path)
+        try:
+            assert (await second.get("a")) == ({"v": 1}, "disk")
+            assert (await second.get("a")) == ({"v": 1}, "memory")
+        finally:
+            second.close()
+
+    asyncio.run(scenario())
+
+def test_disk_cache_evicts_by_size(tmp_path):
+    value = {"text": "x" * 100}
+    cache = DiskCache(str(tmp_path / "cache.db"), ttl=0, max_bytes=250)
+    try:
+        cache.set("a", value)
+        cache.set("b", value)
+        cache.get("a")  # a 最近访问过，应淘汰 b
+        cache.set("c", value)
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+        assert cache.stats()["bytes"] <= 250
+        # 单个条目超过容量时不写入
+        cache.set("big", {"text": "x" * 1000})
+        assert cache.get("big") is None
+    finally:
+        cache.close()
+
+@pytest.mark.parametrize("max_entries, disk, enabled", [(0, False, False), (1, False, True), (0, True, True)])
+def test_enabled(tmp_path, max_entries, disk, enabled):
+    cache = ResponseCache(max_entries=max_entries, disk_path=str(tmp_path / "c.db") if disk else None)
+    assert cache.enabled is enabled
+    cache.close()
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"v": 1}
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("k", factory) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [value for value, _ in results] == [{"v": 1}] * 5
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    assert flight.stats() == {"in_flight": 0, "coalesced": 4}
+
+def test_single_flight_shares_exceptions_and_allows_retry():
+    flight = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream")
+
+    async def scenario():
+        results = await asyncio.gather(flight.do("k", failing), flight.do("k", failing), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        # 调用结束后不再合并，下一次请求重新执行
+        with pytest.raises(RuntimeError):
+            await flight.do("k", failing)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+def test_single_flight_cancelled_caller_does_not_affect_others():
+    flight = SingleFlight()
+    release = None
+
+    async def factory():
+        await release.wait()
+        return "done"
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(flight.do("k", factory))
+        second = asyncio.ensure_future(flight.do("k", factory))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert (await second) == ("done", True)
+        assert first.cancelled()
+
+    asyncio.run(scenario())
+
+def test_single_flight_cancel_all():
+    flight = SingleFlight()
+
+    async def scenario():
+        waiter = asyncio.ensure_future(flight.do("k", lambda: asyncio.sleep(60)))
+        await asyncio.sleep(0)
+        assert flight.stats()["in_flight"] == 1
+        await flight.cancel_all()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import asyncio
+import threading
+
+import httpx
+import pytest
+from aiohttp import web
+
+def _sse(chunk) -> bytes:
+    return f"data: {json.dumps(chunk) if not isinstance(chunk, str) else chunk}\n\n".encode()
+
+def _token(content):
+    return {"model": "stub", "choices": [{"delta": {"content": content}}]}
+
+def _streaming(chunks, delay=0.0, abort=False):
+    """依次发送 SSE 数据块的上游；abort 为 true 时发送完后直接断开连接，不发送 [DONE]"""
+    async def handler(request, payload):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for chunk in chunks:
+            await response.write(_sse(chunk))
+            await asyncio.sleep(delay)
+        if abort:
+            request.transport.close()
+            return response
+        await response.write(_sse("[DONE]"))
+        return response
+    return handler
+
+def _events(text):
+    """解析 SSE 响应为 [(事件, 数据), ...]"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+def _post(client, png, **data):
+    return client.post("/analyze/stream", files={"file": ("a.png", png(), "image/png")},
+                       data={"prompt": "p", **data})
+
+USAGE = {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+
+def test_stream_relays_tokens_then_meta(api, upstream, png):
+    client, main = api
+    upstream.handler = _streaming([_token("Hel"), _token("lo"), {"model": "stub", "choices": [], "usage": USAGE}])
+    response = _post(client, png)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    assert [name for name, _ in events] == ["token", "token", "_meta"]
+    assert [data["content"] for _, data in events[:2]] == ["Hel", "lo"]
+    meta = events[-1][1]
+    assert meta["usage"] == USAGE
+    assert meta["cache"] == "miss"
+    assert meta["first_token_ms"] is not None
+    # 上游请求为流式并要求返回用量
+    assert upstream.requests[0]["stream"] is True
+    assert upstream.requests[0]["stream_options"] == {"include_usage": True}
+
+def test_stream_json_mode_sends_parsed_result_before_meta(api, upstream, png):
+    client, main = api
+    upstream.handler = _streaming([_token('```json\n{"a": '), _token("1}\n```")])
+    events = _events(_post(client, png, json_mode="true").text)
+    assert [name for name, _ in events] == ["token", "token", "result", "_meta"]
+    assert events[2][1] == {"a": 1}
+
+def test_stream_upstream_error_before_stream_returns_status(api, upstream, png):
+    client, main = api
+
+    async def handler(request, payload):
+        return web.json_response({"error": {"message": "bad image"}}, status=400)
+
+    upstream.handler = handler
+    response = _post(client, png)
+    assert response.status_code == 400
+    assert "bad image" in response.json()["detail"]
+
+def test_stream_upstream_failure_mid_stream_sends_error_event(api, upstream, png):
+    client, main = api
+    upstream.handler = _streaming([_token("partial")], abort=True)
+    events = _events(_post(client, png).text)
+    assert [name for name, _ in events] == ["token", "error"]
+    assert events[0][1]["content"] == "partial"
+
+def test_stream_long_generation_is_not_cut_by_total_timeout(api, upstream, png, monkeypatch):
+    client, main = api
+    # 会话的总超时 0.3 秒，生成持续约 0.6 秒，但两次输出的间隔都不超过超时
+    monkeypatch.setattr(main, "UPSTREAM_TIMEOUT", 0.3)
+
+    async def reopen_session():
+        await main.http_session.close()
+        main.http_session = main.create_http_session()
+
+    client.portal.call(reopen_session)
+    upstream.handler = _streaming([_token(str(i)) for i in range(6)], delay=0.1)
+    events = _events(_post(client, png).text)
+    assert [name for name, _ in events] == ["token"] * 6 + ["_meta"]
+
+@pytest.mark.parametrize("disconnect_on", ["http.response.start", "http.response.body"])
+def test_stream_releases_upstream_when_client_disconnects(api, upstream, png, disconnect_on):
+    client, main = api
+    closed = threading.Event()
+
+    async def endless(request, payload):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            while True:
+                await response.write(_sse(_token("x")))
+                await asyncio.sleep(0.02)
+        finally:
+            # 服务端释放连接后写入失败（或处理被取消）
+            closed.set()
+
+    upstream.handler = endless
+    request = httpx.Request("POST", "http://testserver/analyze/stream",
+                            files={"file": ("a.png", png(), "image/png")}, data={"prompt": "p"})
+    body = request.read()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/analyze/stream", "raw_path": b"/analyze/stream",
+        "query_string": b"", "root_path": "", "client": ("testclient", 50000), "server": ("testserver", 80),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in request.headers.items()],
+    }
+
+    async def disconnect_early():
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+            # 客户端在响应开始时（生成器尚未开始迭代）或收到第一个 token 后断开
+            if message["type"] == disconnect_on:
+                raise OSError("client disconnected")
+
+        try:
+            await main.app(scope, receive, send)
+        except Exception:
+            pass
+        return sent
+
+    sent = client.portal.call(disconnect_early)
+    assert sent[0]["status"] == 200
+    assert sent[-1]["type"] == disconnect_on
+    assert closed.wait(5), "上游连接没有释放"
+    in_flight = f'img2json_upstream_requests_in_flight{{endpoint="/analyze/stream",model="{main.MODEL_NAME}"}} 0'
+    assert in_flight in main.service_metrics.render()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import base64
+import asyncio
+
+import pytest
+from aiohttp import web
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+from starlette.testclient import TestClient
+
+def _limited_client(main, max_bytes):
+    """在服务外层再套一层较小的请求体限制（服务自身的限制在导入时已确定）"""
+    return TestClient(main.RequestSizeLimitMiddleware(main.app, max_bytes=max_bytes))
+
+def _ok(upstream):
+    async def handler(request, payload):
+        return web.json_response(upstream.completion("ok"))
+    return handler
+
+def test_content_length_over_limit_is_rejected_before_parsing(api, upstream):
+    client, main = api
+    upstream.handler = _ok(upstream)
+    limited = _limited_client(main, 1024)
+    response = limited.post("/analyze", files={"file": ("a.png", b"x" * 4096, "image/png")}, data={"prompt": "p"})
+    assert response.status_code == 413
+    assert "1024" in response.json()["detail"]
+    assert upstream.requests == []
+
+def test_chunked_body_over_limit_is_rejected_while_reading(api, upstream):
+    client, main = api
+    upstream.handler = _ok(upstream)
+    limited = _limited_client(main, 1024)
+    request = client.build_request("POST", "/analyze", files={"file": ("a.png", b"x" * 4096, "image/png")},
+                                   data={"prompt": "p"})
+    body, content_type = request.read(), request.headers["content-type"]
+
+    def chunks():
+        for offset in range(0, len(body), 512):
+            yield body[offset:offset + 512]
+
+    # 生成器请求体按分块传输发送，没有 Content-Length
+    response = limited.post("/analyze", content=chunks(), headers={"Content-Type": content_type})
+    assert response.status_code == 413
+    assert upstream.requests == []
+
+def test_body_within_limit_is_parsed(api, png):
+    client, main = api
+    request = client.build_request("POST", "/analyze", files={"file": ("a.png", png(), "image/png")})
+    body, content_type = request.read(), request.headers["content-type"]
+    # 表单被完整读取并校验（缺少 prompt），而不是被大小限制拒绝
+    response = _limited_client(main, 64 * 1024).post("/analyze", content=iter([body]),
+                                                     headers={"Content-Type": content_type})
+    assert response.status_code == 422
+
+def test_upload_over_file_limit_returns_413(api, upstream, png, monkeypatch):
+    client, main = api
+    upstream.handler = _ok(upstream)
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 1024)
+    response = client.post("/analyze", files={"file": ("a.png", b"x" * 2048, "image/png")}, data={"prompt": "p"})
+    assert response.status_code == 413
+    assert "1024" in response.json()["detail"]
+    response = client.post("/analyze", files={"file": ("a.png", png(), "image/png")}, data={"prompt": "p"})
+    assert response.status_code == 200
+    assert upstream.requests
+
+@pytest.mark.parametrize("size", [None, 5000])
+def test_read_upload_limits_known_and_unknown_sizes(size, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 1000)
+    data = bytes(range(256)) * 20
+
+    def upload():
+        return UploadFile(io.BytesIO(data), size=len(data) if size else None, filename="a.png")
+
+    assert asyncio.run(main.read_upload(upload(), 0)) == data
+    assert asyncio.run(main.read_upload(upload(), len(data))) == data
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.read_upload(upload(), len(data) - 1, kind="PDF"))
+    assert error.value.status_code == 413
+    assert "PDF" in error.value.detail
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("length", [0, 1, 100, 3 * 256 * 1024 + 1, 2 * 3 * 256 * 1024 + 2])
+def test_build_upstream_request_matches_one_shot_encoding(stream, length):
+    import main
+    image = bytes(i * 7 % 256 for i in range(length))
+    headers, body = main.build_upstream_request(image, "提示 \"词\"", stream=stream, mime_type="image/png")
+    expected = {
+        "model": main.MODEL_NAME,
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "提示 \"词\""},
+            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64.b64encode(image).decode()}"}},
+        ]}],
+        "max_tokens": main.MAX_TOKENS,
+    }
+    if stream:
+        expected["stream"] = True
+        expected["stream_options"] = {"include_usage": True}
+    assert body.getvalue() == json.dumps(expected, ensure_ascii=False).encode("utf-8")
+    assert headers["Content-Type"] == "application/json"
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+from aiohttp import web
+
+import upstream_scheduler
+from upstream_scheduler import TokenBucket, UpstreamScheduler, parse_duration, parse_retry_after
+
+@pytest.mark.parametrize("value, expected", [
+    ("20ms", 0.02),
+    ("1.5s", 1.5),
+    ("6m0s", 360),
+    ("1h2m3s", 3723),
+    ("7", 7),
+    ("-3", 0),
+    ("", None),
+    (None, None),
+    ("soon", None),
+    ("5s later", None),
+])
+def test_parse_duration(value, expected):
+    if expected is None:
+        assert parse_duration(value) is None
+    else:
+        assert parse_duration(value) == pytest.approx(expected)
+
+def test_parse_retry_after_order():
+    assert parse_retry_after({"retry-after-ms": "1500", "Retry-After": "9"}) == 1.5
+    assert parse_retry_after({"Retry-After": "9"}) == 9
+    assert parse_retry_after({"Retry-After": formatdate(time.time() + 30, usegmt=True)}) == pytest.approx(30, abs=2)
+    assert parse_retry_after({"x-ratelimit-reset-requests": "2s", "x-ratelimit-reset-tokens": "500ms"}) == 2
+    assert parse_retry_after({"Retry-After": "garbage"}) is None
+    assert parse_retry_after({}) is None
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    # 抖动取上限，便于断言具体的等待时间
+    monkeypatch.setattr(upstream_scheduler.random, "uniform", lambda a, b: b)
+
+@pytest.mark.parametrize("status", [400, 401, 403, 404, 422])
+def test_client_errors_are_not_retried(status):
+    assert UpstreamScheduler().retry_delay(0, status) is None
+
+def test_quota_exhaustion_is_not_retried():
+    scheduler = UpstreamScheduler()
+    assert scheduler.retry_delay(0, 429, {}, '{"error": {"code": "insufficient_quota"}}') is None
+    assert scheduler.throttled == 0
+
+def test_server_errors_and_network_errors_back_off(no_jitter):
+    scheduler = UpstreamScheduler(max_retries=2, backoff_base=0.5, backoff_max=30)
+    assert scheduler.retry_delay(0, 503) == 0.5
+    assert scheduler.retry_delay(1, None) == 1.0
+    assert scheduler.retry_delay(2, 503) is None
+    assert scheduler.retries == {"503": 1, "network": 1}
+    # 单次退避不超过 backoff_max
+    assert UpstreamScheduler(max_retries=10, backoff_max=3).retry_delay(8, 500) == 3
+
+def test_rate_limit_follows_retry_after_and_pauses_all_requests(no_jitter):
+    scheduler = UpstreamScheduler(backoff_base=0.5, retry_after_max=60)
+    delay = scheduler.retry_delay(0, 429, {"Retry-After": "10"})
+    assert delay == 10.5
+    assert scheduler.throttled == 1
+    assert scheduler.paused_until - time.monotonic() == pytest.approx(10.5, abs=0.5)
+    # 上游要求的等待时间过长时直接返回错误
+    assert scheduler.retry_delay(0, 429, {"Retry-After": "120"}) is None
+
+def test_observe_pauses_when_quota_is_used_up():
+    scheduler = UpstreamScheduler(retry_after_max=5)
+    scheduler.observe({"x-ratelimit-remaining-requests": "3", "x-ratelimit-reset-requests": "1s"})
+    assert scheduler.paused_until == 0
+    scheduler.observe({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "1m"})
+    assert scheduler.paused_until - time.monotonic() == pytest.approx(5, abs=0.5)
+
+def test_token_bucket_waits_for_refill(monkeypatch):
+    now = [100.0]
+    slept = []
+
+    async def fake_sleep(delay):
+        slept.append(delay)
+        now[0] += delay
+
+    monkeypatch.setattr(upstream_scheduler.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(upstream_scheduler.asyncio, "sleep", fake_sleep)
+    bucket = TokenBucket(60)
+
+    async def scenario():
+        assert (await bucket.acquire(60)) == 0
+        assert (await bucket.acquire(2)) == pytest.approx(2)
+        # 超过容量的请求按容量计算
+        assert (await bucket.acquire(1000)) == pytest.approx(60)
+        bucket.refund(30)
+        assert bucket.tokens == 30
+
+    asyncio.run(scenario())
+    assert TokenBucket(0).enabled is False
+    assert asyncio.run(TokenBucket(0).acquire(100)) == 0.0
+
+def test_settle_refunds_overestimated_tokens():
+    scheduler = UpstreamScheduler(tpm=1000)
+
+    async def scenario():
+        await scheduler.acquire(estimated_tokens=800)
+        scheduler.settle(800, {"total_tokens": 300})
+
+    asyncio.run(scenario())
+    assert scheduler.tokens.tokens == pytest.approx(700, abs=1)
+
+def test_settle_charges_underestimated_tokens():
+    scheduler = UpstreamScheduler(tpm=1000)
+
+    async def scenario():
+        await scheduler.acquire(estimated_tokens=800)
+        scheduler.settle(800, {"total_tokens": 1100})
+
+    asyncio.run(scenario())
+    # 超出的部分记为欠额，之后的请求等到补足后再发送
+    assert scheduler.tokens.tokens == pytest.approx(-100, abs=1)
+
+def test_settle_without_usage_keeps_the_estimate():
+    scheduler = UpstreamScheduler(tpm=1000)
+
+    async def scenario():
+        await scheduler.acquire(estimated_tokens=800)
+        scheduler.settle(800, None)
+
+    asyncio.run(scenario())
+    assert scheduler.tokens.tokens == pytest.approx(200, abs=1)
+
+def test_failed_attempts_return_their_estimate(api, upstream, png, monkeypatch):
+    client, main = api
+    scheduler = UpstreamScheduler(tpm=100000, max_retries=3, backoff_base=0.01)
+    monkeypatch.setattr(main, "upstream_scheduler", scheduler)
+    usage = {"prompt_tokens": 900, "completion_tokens": 100, "total_tokens": 1000}
+    statuses = [503, 500, 200]
+
+    async def handler(request, payload):
+        status = statuses.pop(0)
+        if status != 200:
+            return web.json_response({"error": {"message": "busy"}}, status=status)
+        return web.json_response(upstream.completion("ok", usage))
+
+    upstream.handler = handler
+    response = client.post("/analyze", files={"file": ("a.png", png(), "image/png")}, data={"prompt": "p"})
+    assert response.status_code == 200
+    assert len(upstream.requests) == 3
+    # 三次尝试只计入成功那次的实际用量
+    assert scheduler.tokens.tokens == pytest.approx(100000 - 1000, abs=50)
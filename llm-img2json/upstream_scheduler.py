@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# 可以重试的上游状态码：超时、限流和服务端临时错误；其余 4xx（参数错误、鉴权失败等）重试也不会成功
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# 429 中表示额度用尽（而非临时限流）的错误码，重试不会成功
+QUOTA_ERRORS = ("insufficient_quota", "billing_hard_limit_reached")
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    解析 x-ratelimit-reset-* 等头部中的时长，例如 "20ms"、"1.5s"、"6m0s"，纯数字按秒处理
+
+    Returns:
+        float: 秒数，无法解析时返回 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        return None
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    从上游响应头中读取建议的等待时间
+
+    依次检查 retry-after-ms、Retry-After（秒数或HTTP日期）、x-ratelimit-reset-requests/tokens。
+
+    Returns:
+        float: 秒数，没有相关头部时返回 None
+    """
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+
+    value = headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    resets = [parse_duration(headers.get(name))
+              for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+class TokenBucket:
+    """
+    令牌桶：按每分钟速率连续补充，容量为一分钟的额度
+
+    Args:
+        per_minute: 每分钟的额度，0 表示不限制
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        # 按到达顺序排队，避免大请求一直被小请求插队
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> float:
+        """
+        取出额度，不足时等待补充
+
+        Returns:
+            float: 等待的秒数
+        """
+        if not self.enabled:
+            return 0.0
+        # 单次请求超过桶容量时按容量计算，否则永远无法满足
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def refund(self, amount: float):
+        """归还预估多扣的额度"""
+        if self.enabled and amount > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def charge(self, amount: float):
+        """补扣实际用量超出预估的部分；余额可以为负，之后的请求等到补足后再发送"""
+        if self.enabled and amount > 0:
+            self._refill()
+            self.tokens -= amount
+
+class UpstreamScheduler:
+    """
+    上游请求调度：按每分钟请求数和token数限速，根据状态码决定是否重试，并按上游提示退避
+
+    收到 429 时所有请求一起暂停到上游给出的恢复时间，不会各自立即重试形成重试风暴。
+
+    Args:
+        rpm: 每分钟请求数上限，0 表示不限制
+        tpm: 每分钟token数上限，0 表示不限制
+        max_retries: 首次请求之后的最多重试次数
+        backoff_base: 指数退避的初始等待时间（秒）
+        backoff_max: 单次退避的最长等待时间（秒）
+        retry_after_max: 上游要求等待的时间超过此值时不再重试，直接返回错误（秒）
+    """
+
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_retries: int = 2, backoff_base: float = 0.5,
+                 backoff_max: float = 30, retry_after_max: float = 60):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.paused_until = 0.0
+        self.retries: Dict[str, int] = {}
+        self.throttled = 0
+        self.waited = 0.0
+
+    async def acquire(self, estimated_tokens: float = 0) -> float:
+        """
+        发送请求前调用：等待全局暂停结束，再从请求数和token数令牌桶中取出额度
+
+        Returns:
+            float: 本次等待的秒数
+        """
+        waited = 0.0
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+            waited += delay
+        waited += await self.requests.acquire(1)
+        if estimated_tokens:
+            waited += await self.tokens.acquire(estimated_tokens)
+        self.waited += waited
+        return waited
+
+    def settle(self, estimated_tokens: float, usage: Optional[Dict[str, Any]]):
+        """请求完成后按实际用量结算token额度：预估多扣的归还，不足的补扣；没有用量信息时按预估计算"""
+        if usage and usage.get("total_tokens") is not None:
+            difference = estimated_tokens - usage["total_tokens"]
+            if difference >= 0:
+                self.tokens.refund(difference)
+            else:
+                self.tokens.charge(-difference)
+
+    def release(self, estimated_tokens: float):
+        """失败的尝试（上游返回错误或网络错误，没有产生用量）归还全部预估额度，重试时重新取出"""
+        self.tokens.refund(estimated_tokens)
+
+    def pause(self, seconds: float):
+        """暂停所有请求，直到指定时间之后"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def observe(self, headers: Mapping[str, str]):
+        """根据上游返回的剩余额度调整：额度已用完时暂停到重置时间，不必等到 429"""
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.strip() == "0":
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.pause(min(reset, self.retry_after_max))
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次重试（从0开始）的等待时间：带完全抖动的指数退避"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def retry_delay(self, attempt: int, status: Optional[int] = None,
+                    headers: Optional[Mapping[str, str]] = None, body: str = "") -> Optional[float]:
+        """
+        判断失败的请求是否重试
+
+        Args:
+            attempt: 已经重试的次数
+            status: 上游状态码，网络错误或超时为 None
+            headers: 上游响应头
+            body: 上游错误内容
+
+        Returns:
+            float: 重试前的等待时间（秒），不应重试时返回 None
+        """
+        if status is not None:
+            if status not in RETRYABLE_STATUS:
+                return None
+            if status == 429 and any(code in body for code in QUOTA_ERRORS):
+                return None
+        if attempt >= self.max_retries:
+            return None
+
+        delay = self.backoff(attempt)
+        retry_after = parse_retry_after(headers) if headers is not None else None
+        if retry_after is not None:
+            if retry_after > self.retry_after_max:
+                return None
+            # 按上游要求的时间等待，再加少量抖动，避免所有请求在同一时刻恢复
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        if status == 429:
+            self.throttled += 1
+            self.pause(delay)
+
+        label = str(status) if status is not None else "network"
+        self.retries[label] = self.retries.get(label, 0) + 1
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rpm": self.requests.capacity,
+            "tpm": self.tokens.capacity,
+            "retries": dict(self.retries),
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited, 3),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 3),
+        }
@@ -4,24 +4,126 @@
 import sys
 import os
 import shutil
+import threading
+from collections import deque
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QFileDialog, 
                             QVBoxLayout, QHBoxLayout, QWidget, QPushButton, 
                             QLabel, QTextEdit, QSplitter, QMessageBox, QAction, QToolBar,
-                            QLineEdit, QSpinBox)
-from PyQt5.QtCore import Qt, QSize, QEvent
-from PyQt5.QtGui import QIcon, QKeySequence
+                            QLineEdit, QSpinBox, QProgressBar)
+from PyQt5.QtCore import Qt, QSize, QEvent, QTimer, QThread, pyqtSignal
+from PyQt5.QtGui import QIcon, QKeySequence, QPixmap
+import fitz
 
 from pdf_viewer import PDFViewer
-from text_extractor import extract_text_from_region
+from text_extractor import extract_text_from_region, get_region_preview, ExtractionCancelled
+
+class ExtractionWorker(QThread):
+    """
+    后台提取线程
+
+    按提交顺序依次处理区域提取任务，通过信号报告进度、结果和错误，
+    支持取消正在执行的任务。
+    """
+    job_started = pyqtSignal(int)             # 任务号
+    job_progress = pyqtSignal(int, int, str)  # 任务号, 百分比, 阶段说明
+    job_finished = pyqtSignal(int, object)    # 任务号, (文本, 图像路径, 输出文件夹)
+    job_failed = pyqtSignal(int, str)         # 任务号, 错误信息
+    job_cancelled = pyqtSignal(int)           # 任务号
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._jobs = deque()  # (任务号, 提取参数)
+        self._condition = threading.Condition()
+        self._running = True
+        self._next_job_id = 1
+        self._current_job_id = None
+        self._cancel_event = threading.Event()
+    
+    def submit(self, **kwargs):
+        """
+        提交提取任务
+        
+        Args:
+            **kwargs: 传给 extract_text_from_region 的参数
+            
+        Returns:
+            int: 任务号
+        """
+        with self._condition:
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            self._jobs.append((job_id, kwargs))
+            self._condition.notify()
+        return job_id
+    
+    def pending_count(self):
+        """排队中（尚未开始）的任务数量"""
+        with self._condition:
+            return len(self._jobs)
+    
+    def cancel_current(self):
+        """取消正在执行的任务"""
+        self._cancel_event.set()
+    
+    def stop(self):
+        """清空队列、取消当前任务并等待线程退出"""
+        with self._condition:
+            self._running = False
+            self._jobs.clear()
+            self._cancel_event.set()
+            self._condition.notify()
+        self.wait()
+    
+    def run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._jobs:
+                    self._condition.wait()
+                if not self._running:
+                    break
+                job_id, kwargs = self._jobs.popleft()
+                self._current_job_id = job_id
+                self._cancel_event.clear()
+            
+            self.job_started.emit(job_id)
+            try:
+                # extract_text_from_region 只在调用 MuPDF 时持有 mupdf_lock，
+                # 写文件期间界面线程仍可渲染预览和页面
+                result = extract_text_from_region(
+                    progress=lambda percent, message: self.job_progress.emit(job_id, percent, message),
+                    cancel_event=self._cancel_event,
+                    **kwargs
+                )
+                if result[0] is None:
+                    self.job_failed.emit(job_id, "从选定区域提取文本失败")
+                else:
+                    self.job_finished.emit(job_id, result)
+            except ExtractionCancelled:
+                self.job_cancelled.emit(job_id)
+            except Exception as e:
+                self.job_failed.emit(job_id, str(e))
+            finally:
+                self._current_job_id = None
 
 class PDFSelectorApp(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.init_ui()
         self.current_pdf_path = None
         self.extracted_image_path = None
         self.current_extract_folder = None
         
+        # 后台提取线程
+        self.extraction_worker = ExtractionWorker(self)
+        
+        # 结果表格的按需预览状态
+        self.preview_pdf_path = None
+        self.preview_page_num = 0
+        self.preview_rows = []
+        self.loaded_preview_rows = set()
+        
+        self.init_ui()
+        self.extraction_worker.start()
+        
     def init_ui(self):
         # 设置窗口基本属性
         self.setWindowTitle("PDF 区域选择与文本提取工具")
@@ -135,6 +237,22 @@ class PDFSelectorApp(QMainWindow):
         
         lower_right_layout.addLayout(button_layout)
         
+        # 提取进度、队列状态及取消按钮
+        progress_layout = QHBoxLayout()
+        self.extract_progress = QProgressBar()
+        self.extract_progress.setRange(0, 100)
+        self.extract_progress.setValue(0)
+        self.extract_progress.setFormat("%p% 空闲")
+        self.queue_label = QLabel("队列: 0")
+        self.cancel_extract_button = QPushButton("取消提取")
+        self.cancel_extract_button.setEnabled(False)
+        
+        progress_layout.addWidget(self.extract_progress)
+        progress_layout.addWidget(self.queue_label)
+        progress_layout.addWidget(self.cancel_extract_button)
+        
+        lower_right_layout.addLayout(progress_layout)
+        
         # 添加到右侧分割器
         right_panel.addWidget(upper_right_panel)
         right_panel.addWidget(lower_right_panel)
@@ -194,8 +312,15 @@ class PDFSelectorApp(QMainWindow):
         zoom_out_action.setShortcut(Qt.Key_Minus)  # 设置为减号键
         zoom_out_action.triggered.connect(self.zoom_out)
         
+        # 诊断模式：额外尝试所有旧版坐标变换
+        self.diagnostic_action = QAction("坐标诊断模式", self)
+        self.diagnostic_action.setCheckable(True)
+        self.diagnostic_action.setToolTip("提取时额外尝试原始/翻转/旋转等所有坐标变换")
+        
         view_menu.addAction(zoom_in_action)
         view_menu.addAction(zoom_out_action)
+        view_menu.addSeparator()
+        view_menu.addAction(self.diagnostic_action)
         
         # 帮助菜单
         help_menu = menubar.addMenu("帮助")
@@ -240,6 +365,17 @@ class PDFSelectorApp(QMainWindow):
         self.save_text_button.clicked.connect(self.save_text)
         self.save_image_button.clicked.connect(self.save_image)
         self.open_folder_button.clicked.connect(self.open_output_folder)
+        self.cancel_extract_button.clicked.connect(self.extraction_worker.cancel_current)
+        
+        # 后台提取信号
+        self.extraction_worker.job_started.connect(self.on_extraction_started)
+        self.extraction_worker.job_progress.connect(self.on_extraction_progress)
+        self.extraction_worker.job_finished.connect(self.on_extraction_finished)
+        self.extraction_worker.job_failed.connect(self.on_extraction_failed)
+        self.extraction_worker.job_cancelled.connect(self.on_extraction_cancelled)
+        
+        # 结果表格滚动时加载新出现行的预览图
+        self.results_table.verticalScrollBar().valueChanged.connect(self.load_visible_previews)
         
         # PDF查看器信号
         self.pdf_viewer.page_changed.connect(self.update_page_label)
@@ -280,7 +416,7 @@ class PDFSelectorApp(QMainWindow):
                 self.page_spinbox.setValue(1)  # 默认跳转到第1页
     
     def extract_text(self):
-        """从选定区域提取文本"""
+        """将选定区域的提取任务加入后台队列（可连续提交多个区域）"""
         if not self.current_pdf_path or not self.pdf_viewer.has_selection():
             QMessageBox.warning(self, "警告", "请先打开PDF文件并选择区域")
             return
@@ -288,25 +424,69 @@ class PDFSelectorApp(QMainWindow):
         rect = self.pdf_viewer.get_selection_rect()
         page_num = self.pdf_viewer.current_page
         
-        text, image_path, output_folder = extract_text_from_region(self.current_pdf_path, page_num, rect)
-        if text:
-            self.text_edit.setText(text)
-            self.extracted_image_path = image_path
-            # 获取输出文件夹路径
-            self.current_extract_folder = output_folder
-            self.update_extraction_ui_state(True)
-            
-            # 显示所有转换结果
-            self.display_transform_results(output_folder)
-            
-            # 显示成功提示
-            QMessageBox.information(
-                self, 
-                "提取成功", 
-                f"文本和图像已保存到文件夹:\n{self.current_extract_folder}"
-            )
-        else:
-            QMessageBox.warning(self, "提取失败", "从选定区域提取文本失败")
+        job_id = self.extraction_worker.submit(
+            pdf_path=self.current_pdf_path,
+            page_num=page_num,
+            rect=rect,
+            zoom=self.pdf_viewer.zoom_factor,
+            diagnostic=self.diagnostic_action.isChecked()
+        )
+        self.update_queue_label()
+        self.statusBar().showMessage(f"提取任务 #{job_id} 已加入队列 (第 {page_num + 1} 页)")
+    
+    def update_queue_label(self):
+        """更新排队任务数量"""
+        self.queue_label.setText(f"队列: {self.extraction_worker.pending_count()}")
+    
+    def on_extraction_started(self, job_id):
+        """后台任务开始执行"""
+        self.update_queue_label()
+        self.cancel_extract_button.setEnabled(True)
+        self.extract_progress.setValue(0)
+        self.extract_progress.setFormat(f"#{job_id} %p%")
+    
+    def on_extraction_progress(self, job_id, percent, message):
+        """后台任务进度更新"""
+        self.extract_progress.setValue(percent)
+        self.extract_progress.setFormat(f"#{job_id} %p% {message}")
+    
+    def on_extraction_finished(self, job_id, result):
+        """后台任务完成，显示结果"""
+        text, image_path, output_folder = result
+        self.on_extraction_done()
+        
+        if not text:
+            self.statusBar().showMessage(f"提取任务 #{job_id} 未提取到文本")
+            return
+        
+        self.text_edit.setText(text)
+        self.extracted_image_path = image_path
+        # 获取输出文件夹路径
+        self.current_extract_folder = output_folder
+        self.update_extraction_ui_state(True)
+        
+        # 显示所有转换结果
+        self.display_transform_results(output_folder)
+        
+        # 在状态栏提示，不打断连续提交
+        self.statusBar().showMessage(f"提取任务 #{job_id} 完成，结果已保存到: {output_folder}")
+    
+    def on_extraction_failed(self, job_id, message):
+        """后台任务失败"""
+        self.on_extraction_done()
+        self.statusBar().showMessage(f"提取任务 #{job_id} 失败: {message}")
+    
+    def on_extraction_cancelled(self, job_id):
+        """后台任务被取消"""
+        self.on_extraction_done()
+        self.statusBar().showMessage(f"提取任务 #{job_id} 已取消")
+    
+    def on_extraction_done(self):
+        """任务结束后重置进度显示"""
+        self.cancel_extract_button.setEnabled(False)
+        self.extract_progress.setValue(0)
+        self.extract_progress.setFormat("%p% 空闲")
+        self.update_queue_label()
     
     def update_extraction_ui_state(self, has_extraction):
         """更新与提取相关的UI状态"""
@@ -412,6 +592,12 @@ class PDFSelectorApp(QMainWindow):
                 return True
         return super().eventFilter(obj, event)
     
+    def closeEvent(self, event):
+        """关闭窗口时停止后台提取和渲染线程"""
+        self.extraction_worker.stop()
+        self.pdf_viewer.stop_render_worker()
+        super().closeEvent(event)
+    
     def show_about(self):
         """显示关于对话框"""
         QMessageBox.about(
@@ -427,7 +613,6 @@ class PDFSelectorApp(QMainWindow):
         import json
         import os
         from PyQt5.QtWidgets import QTableWidgetItem
-        from PyQt5.QtGui import QPixmap
         from PyQt5.QtCore import Qt
         
         # 查找JSON调试文件
@@ -446,6 +631,10 @@ class PDFSelectorApp(QMainWindow):
         
         # 清空表格
         self.results_table.setRowCount(0)
+        self.preview_pdf_path = debug_info.get("pdf_info", {}).get("path")
+        self.preview_page_num = debug_info.get("pdf_info", {}).get("page", 0)
+        self.preview_rows = []
+        self.loaded_preview_rows = set()
         
         # 填充表格
         transforms = debug_info.get("transforms", [])
@@ -458,22 +647,8 @@ class PDFSelectorApp(QMainWindow):
                 name_item.setToolTip(transform.get("description"))
             self.results_table.setItem(i, 0, name_item)
             
-            # 预览图像
-            image_path = transform.get("image_path")
-            if image_path and os.path.exists(image_path):
-                pixmap = QPixmap(image_path)
-                if not pixmap.isNull():
-                    # 缩放图像到合适大小
-                    pixmap = pixmap.scaledToHeight(150, Qt.SmoothTransformation)
-                    
-                    # 创建标签显示图像
-                    from PyQt5.QtWidgets import QLabel
-                    image_label = QLabel()
-                    image_label.setPixmap(pixmap)
-                    image_label.setAlignment(Qt.AlignCenter)
-                    image_label.setScaledContents(False)
-                    
-                    self.results_table.setCellWidget(i, 1, image_label)
+            # 预览图像 - 只记录区域，行可见时再按需渲染
+            self.preview_rows.append(transform.get("preview_rect"))
             
             # 提取文本
             text = transform.get("text", "")
@@ -492,6 +667,59 @@ class PDFSelectorApp(QMainWindow):
                 item = self.results_table.item(recommended_index, col)
                 if item:
                     item.setBackground(QBrush(QColor(200, 255, 200)))  # 淡绿色背景
+        
+        # 表格布局完成后加载可见行的预览图
+        QTimer.singleShot(0, self.load_visible_previews)
+    
+    def load_visible_previews(self):
+        """为当前可见的结果行按需渲染预览图"""
+        row_count = self.results_table.rowCount()
+        if not row_count or not self.preview_pdf_path:
+            return
+        
+        # 计算可见行范围
+        viewport_height = self.results_table.viewport().height()
+        first_row = self.results_table.rowAt(0)
+        last_row = self.results_table.rowAt(viewport_height - 1)
+        if first_row < 0:
+            first_row = 0
+        if last_row < 0:
+            last_row = row_count - 1
+        
+        for row in range(first_row, min(last_row, len(self.preview_rows) - 1) + 1):
+            if row in self.loaded_preview_rows:
+                continue
+            self.loaded_preview_rows.add(row)
+            
+            rect = self.preview_rows[row]
+            if not rect:
+                continue
+            try:
+                data = get_region_preview(
+                    self.preview_pdf_path,
+                    self.preview_page_num,
+                    fitz.Rect(rect["x0"], rect["y0"], rect["x1"], rect["y1"])
+                )
+            except Exception as e:
+                print(f"生成预览图失败: {e}")
+                continue
+            if not data:
+                continue
+            
+            pixmap = QPixmap()
+            if not pixmap.loadFromData(data, "PNG"):
+                continue
+            
+            # 缩放图像到合适大小
+            pixmap = pixmap.scaledToHeight(150, Qt.SmoothTransformation)
+            
+            # 创建标签显示图像
+            image_label = QLabel()
+            image_label.setPixmap(pixmap)
+            image_label.setAlignment(Qt.AlignCenter)
+            image_label.setScaledContents(False)
+            
+            self.results_table.setCellWidget(row, 1, image_label)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
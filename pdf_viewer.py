@@ -3,11 +3,196 @@
 
 import fitz
 from PyQt5.QtWidgets import QWidget, QLabel, QVBoxLayout, QScrollArea
-from PyQt5.QtGui import QPixmap, QPainter, QPen, QImage
-from PyQt5.QtCore import Qt, QRect, pyqtSignal, QPoint
+from PyQt5.QtGui import QPainter, QPen, QImage
+from PyQt5.QtCore import Qt, QRect, QSize, pyqtSignal, QPoint, QThread
+from collections import OrderedDict, deque
+import threading
 import numpy as np
 import os
 
+from text_extractor import mupdf_lock
+
+# 瓦片边长（像素）
+TILE_SIZE = 512
+
+# 瓦片缓存容量上限（字节）
+TILE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# 预取当前页前后各多少页
+PREFETCH_PAGES = 2
+
+def render_tile_image(display_list, zoom, col, row):
+    """
+    从页面显示列表渲染单个瓦片
+    
+    Args:
+        display_list (fitz.DisplayList): 页面显示列表
+        zoom (float): 缩放比例
+        col (int): 瓦片列号
+        row (int): 瓦片行号
+        
+    Returns:
+        QImage: 瓦片图像，超出页面范围时返回 None
+    """
+    clip = fitz.Rect(
+        col * TILE_SIZE / zoom,
+        row * TILE_SIZE / zoom,
+        (col + 1) * TILE_SIZE / zoom,
+        (row + 1) * TILE_SIZE / zoom
+    ) & display_list.rect
+    if clip.is_empty:
+        return None
+    
+    pix = display_list.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+    img = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
+    # 转换为绘制最快的格式（同时复制数据，不再依赖 pixmap 的内存）
+    return img.convertToFormat(QImage.Format_RGB32)
+
+class TileCache:
+    """
+    渲染瓦片的 LRU 缓存
+
+    以 (页码, 缩放比例, 列, 行) 为键保存 QImage，按总字节数限制容量，
+    滚动或来回缩放时可直接复用已渲染的瓦片。
+    """
+
+    def __init__(self, max_bytes=TILE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._tiles = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        image = self._tiles.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._tiles.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        old = self._tiles.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.byteCount()
+        self._tiles[key] = image
+        self.total_bytes += image.byteCount()
+        while self.total_bytes > self.max_bytes and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self.total_bytes -= evicted.byteCount()
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._tiles
+
+    def clear(self):
+        self._tiles.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            "tiles": len(self._tiles),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+class RenderWorker(QThread):
+    """
+    后台渲染线程
+
+    使用独立打开的文档句柄渲染瓦片，渲染完成后通过信号交给界面线程放入缓存。
+    紧急任务（当前可见的瓦片）插入队首，预取任务追加到队尾；
+    翻页或缩放时提升任务代数，丢弃所有过期任务。
+    """
+    tile_ready = pyqtSignal(object, object)  # 瓦片键, QImage（渲染失败时为 None）
+    
+    # 最多保留的页面显示列表数量
+    DISPLAY_LIST_CACHE_SIZE = PREFETCH_PAGES * 2 + 1
+    
+    def __init__(self, pdf_path, page_rects=None, parent=None):
+        super().__init__(parent)
+        self.pdf_path = pdf_path
+        # 与界面线程共享的页面尺寸表，预取过的页面翻页时无需再访问 MuPDF
+        self.page_rects = page_rects if page_rects is not None else {}
+        self._jobs = deque()  # (代数, 瓦片键, 缩放比例)
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._running = True
+        self._display_lists = OrderedDict()
+    
+    def submit(self, key, zoom, urgent=False):
+        """提交渲染任务"""
+        with self._condition:
+            job = (self._generation, key, zoom)
+            if urgent:
+                self._jobs.appendleft(job)
+            else:
+                self._jobs.append(job)
+            self._condition.notify()
+    
+    def cancel_pending(self):
+        """丢弃所有尚未开始的任务"""
+        with self._condition:
+            self._generation += 1
+            self._jobs.clear()
+    
+    def stop(self):
+        """停止线程并等待退出"""
+        with self._condition:
+            self._running = False
+            self._jobs.clear()
+            self._condition.notify()
+        self.wait()
+    
+    def _get_display_list(self, doc, page_num):
+        display_list = self._display_lists.get(page_num)
+        if display_list is None:
+            display_list = doc.load_page(page_num).get_displaylist()
+            self._display_lists[page_num] = display_list
+            self.page_rects[page_num] = fitz.Rect(display_list.rect)
+            while len(self._display_lists) > self.DISPLAY_LIST_CACHE_SIZE:
+                self._display_lists.popitem(last=False)
+        else:
+            self._display_lists.move_to_end(page_num)
+        return display_list
+    
+    def run(self):
+        try:
+            with mupdf_lock:
+                doc = fitz.open(self.pdf_path)
+        except Exception as e:
+            print(f"渲染线程打开PDF时出错: {e}")
+            return
+        
+        try:
+            while True:
+                with self._condition:
+                    while self._running and not self._jobs:
+                        self._condition.wait()
+                    if not self._running:
+                        break
+                    generation, key, zoom = self._jobs.popleft()
+                    if generation != self._generation:
+                        continue
+                
+                page_num, _, col, row = key
+                try:
+                    with mupdf_lock:
+                        image = render_tile_image(self._get_display_list(doc, page_num), zoom, col, row)
+                except Exception as e:
+                    print(f"渲染瓦片时出错 {key}: {e}")
+                    image = None
+                self.tile_ready.emit(key, image)
+        finally:
+            with mupdf_lock:
+                self._display_lists.clear()
+                doc.close()
+
 class PDFViewer(QWidget):
     # 自定义信号
     page_changed = pyqtSignal(int, int)  # 当前页码, 总页数
@@ -23,6 +208,16 @@ class PDFViewer(QWidget):
         self.total_pages = 0
         self.zoom_factor = 1.0
         
+        # 瓦片渲染
+        self.tile_cache = TileCache()
+        self._display_list = None
+        self._display_list_page = None
+        
+        # 后台渲染线程、已提交的瓦片及已知的页面尺寸
+        self.render_worker = None
+        self._pending_tiles = set()
+        self._page_rects = {}
+        
         # 选择区域
         self.selection_start = None
         self.selection_end = None
@@ -44,6 +239,7 @@ class PDFViewer(QWidget):
         self.image_label = PDFLabel(self)
         self.image_label.setAlignment(Qt.AlignCenter)
         self.image_label.selection_changed.connect(self.update_selection)
+        self.image_label.tile_provider = self.get_tile
         
         self.scroll_area.setWidget(self.image_label)
         self.layout.addWidget(self.scroll_area)
@@ -51,7 +247,13 @@ class PDFViewer(QWidget):
     def load_pdf(self, pdf_path):
         """加载PDF文件"""
         try:
-            self.doc = fitz.open(pdf_path)
+            with mupdf_lock:
+                self.doc = fitz.open(pdf_path)
+            self.tile_cache.clear()
+            self._page_rects = {}
+            self._display_list = None
+            self._display_list_page = None
+            self.start_render_worker(pdf_path)
             self.total_pages = len(self.doc)
             self.current_page = 0
             self.render_page()
@@ -63,27 +265,146 @@ class PDFViewer(QWidget):
             return False
     
     def render_page(self):
-        """渲染当前页面"""
+        """渲染当前页面（按瓦片绘制，只渲染视口内可见的瓦片）"""
         if not self.doc:
             return
         
         # 清除选择
         self.clear_selection()
         
-        page = self.doc.load_page(self.current_page)
+        page_rect = self.get_page_rect(self.current_page)
         
-        # 设置缩放因子
+        # 计算缩放后的页面像素尺寸，与整页渲染的尺寸一致
         zoom_matrix = fitz.Matrix(self.zoom_factor, self.zoom_factor)
-        pix = page.get_pixmap(matrix=zoom_matrix)
+        page_irect = (page_rect * zoom_matrix).irect
         
-        # 创建QImage
-        img_format = QImage.Format_RGBA8888 if pix.alpha else QImage.Format_RGB888
-        img = QImage(pix.samples, pix.width, pix.height, pix.stride, img_format)
+        # 设置画布大小，瓦片在绘制时按需渲染
+        self.image_label.set_page_size(QSize(page_irect.width, page_irect.height))
+        self.image_label.update()
         
-        # 转换为QPixmap并显示
-        pixmap = QPixmap.fromImage(img)
-        self.image_label.setPixmap(pixmap)
-        self.image_label.adjustSize()
+        # 后台优先渲染当前页，再预取相邻页面
+        self.schedule_prefetch()
+    
+    def get_page_rect(self, page_num):
+        """获取页面尺寸（优先使用后台线程已记录的尺寸，避免等待 MuPDF 锁）"""
+        page_rect = self._page_rects.get(page_num)
+        if page_rect is None:
+            with mupdf_lock:
+                page_rect = fitz.Rect(self.doc.load_page(page_num).rect)
+            self._page_rects[page_num] = page_rect
+        return page_rect
+    
+    def start_render_worker(self, pdf_path):
+        """为当前文档启动后台渲染线程（使用独立的文档句柄）"""
+        self.stop_render_worker()
+        self.render_worker = RenderWorker(pdf_path, self._page_rects, self)
+        self.render_worker.tile_ready.connect(self.on_tile_ready)
+        self.render_worker.start()
+    
+    def stop_render_worker(self):
+        """停止后台渲染线程"""
+        if self.render_worker is not None:
+            self.render_worker.tile_ready.disconnect(self.on_tile_ready)
+            self.render_worker.stop()
+            self.render_worker = None
+        self._pending_tiles.clear()
+    
+    def _zoom_key(self):
+        return round(self.zoom_factor, 4)
+    
+    def request_tile(self, key, urgent=False):
+        """向后台线程提交瓦片渲染任务（已缓存或已提交的瓦片不重复提交）"""
+        if self.render_worker is None or key in self._pending_tiles or key in self.tile_cache:
+            return
+        self._pending_tiles.add(key)
+        self.render_worker.submit(key, self.zoom_factor, urgent)
+    
+    def visible_tiles(self):
+        """计算当前视口覆盖的瓦片 (列, 行) 列表"""
+        page_size = self.image_label.page_size
+        if not page_size:
+            return []
+        
+        viewport = self.scroll_area.viewport().size()
+        offset = self.image_label.page_offset()
+        visible = QRect(
+            self.scroll_area.horizontalScrollBar().value() - offset.x(),
+            self.scroll_area.verticalScrollBar().value() - offset.y(),
+            viewport.width(),
+            viewport.height()
+        ).intersected(QRect(QPoint(0, 0), page_size))
+        if visible.isEmpty():
+            return []
+        
+        return [
+            (col, row)
+            for row in range(visible.top() // TILE_SIZE, visible.bottom() // TILE_SIZE + 1)
+            for col in range(visible.left() // TILE_SIZE, visible.right() // TILE_SIZE + 1)
+        ]
+    
+    def schedule_prefetch(self):
+        """丢弃过期任务，先渲染当前页的可见瓦片，再预取相邻页面的同一区域"""
+        if self.render_worker is None:
+            return
+        
+        self.render_worker.cancel_pending()
+        self._pending_tiles.clear()
+        
+        tiles = self.visible_tiles()
+        zoom_key = self._zoom_key()
+        pages = [self.current_page]
+        for distance in range(1, PREFETCH_PAGES + 1):
+            pages.extend([self.current_page + distance, self.current_page - distance])
+        
+        for page_num in pages:
+            if not 0 <= page_num < self.total_pages:
+                continue
+            for col, row in tiles:
+                self.request_tile((page_num, zoom_key, col, row))
+    
+    def on_tile_ready(self, key, image):
+        """后台线程渲染完成的瓦片放入缓存，属于当前视图时重绘对应区域"""
+        self._pending_tiles.discard(key)
+        if image is None:
+            return
+        self.tile_cache.put(key, image)
+        
+        page_num, zoom_key, col, row = key
+        if page_num == self.current_page and zoom_key == self._zoom_key() and self.image_label.has_page():
+            offset = self.image_label.page_offset()
+            self.image_label.update(QRect(offset.x() + col * TILE_SIZE, offset.y() + row * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+    
+    def _get_display_list(self, page_num):
+        """获取页面的显示列表，同一页面的瓦片共用，避免重复解析页面内容"""
+        if self._display_list_page != page_num:
+            self._display_list = self.doc.load_page(page_num).get_displaylist()
+            self._display_list_page = page_num
+        return self._display_list
+    
+    def get_tile(self, col, row):
+        """
+        获取当前页面、当前缩放比例下的瓦片
+        
+        优先从缓存读取；未命中时交给后台线程渲染并返回 None（先显示空白，渲染完成后重绘），
+        没有后台线程时在当前线程同步渲染。
+        """
+        if not self.doc:
+            return None
+        
+        key = (self.current_page, self._zoom_key(), col, row)
+        img = self.tile_cache.get(key)
+        if img is not None:
+            return img
+        
+        if self.render_worker is not None:
+            self.request_tile(key, urgent=True)
+            return None
+        
+        with mupdf_lock:
+            img = render_tile_image(self._get_display_list(self.current_page), self.zoom_factor, col, row)
+        if img is not None:
+            self.tile_cache.put(key, img)
+        return img
     
     def prev_page(self):
         """显示上一页"""
@@ -165,24 +486,20 @@ class PDFViewer(QWidget):
             return None
         
         # 转换为文档坐标系
-        page = self.doc.load_page(self.current_page)
-        page_rect = page.rect
+        page_rect = self.get_page_rect(self.current_page)
         
         # 获取缩放后的图像尺寸
-        pixmap = self.image_label.pixmap()
-        if not pixmap:
+        page_size = self.image_label.page_size
+        if not page_size:
             return None
         
-        img_width = pixmap.width()
-        img_height = pixmap.height()
+        img_width = page_size.width()
+        img_height = page_size.height()
         
         # 获取图像在标签中的实际位置（考虑居中对齐）
-        label_width = self.image_label.width()
-        label_height = self.image_label.height()
-        
-        # 计算图像偏移
-        x_offset = (label_width - img_width) / 2 if label_width > img_width else 0
-        y_offset = (label_height - img_height) / 2 if label_height > img_height else 0
+        offset = self.image_label.page_offset()
+        x_offset = offset.x()
+        y_offset = offset.y()
         
         # 考虑偏移量调整选区坐标
         adj_left = max(0, ui_rect.left() - x_offset)
@@ -208,7 +525,7 @@ class PDFViewer(QWidget):
 
 
 class PDFLabel(QLabel):
-    """可选择区域的PDF标签"""
+    """可选择区域的PDF标签（按瓦片绘制页面）"""
     selection_changed = pyqtSignal(QRect)
     
     def __init__(self, parent=None):
@@ -217,10 +534,30 @@ class PDFLabel(QLabel):
         self.selection_end = None
         self.selecting = False
         self.selection_rect = None
+        
+        # 页面画布尺寸及瓦片提供函数 tile_provider(列, 行) -> QImage
+        self.page_size = None
+        self.tile_provider = None
+    
+    def set_page_size(self, size):
+        """设置缩放后的页面像素尺寸"""
+        self.page_size = size
+        self.setMinimumSize(size)
+        self.adjustSize()
+    
+    def has_page(self):
+        """检查是否已设置页面"""
+        return self.page_size is not None and not self.page_size.isEmpty()
+    
+    def page_offset(self):
+        """页面在标签中的偏移（页面小于标签时居中显示）"""
+        x_offset = max(0, (self.width() - self.page_size.width()) // 2)
+        y_offset = max(0, (self.height() - self.page_size.height()) // 2)
+        return QPoint(x_offset, y_offset)
     
     def mousePressEvent(self, event):
         """鼠标按下事件，开始选择"""
-        if event.button() == Qt.LeftButton and self.pixmap():
+        if event.button() == Qt.LeftButton and self.has_page():
             self.selection_start = event.pos()
             self.selection_end = event.pos()
             self.selecting = True
@@ -229,31 +566,48 @@ class PDFLabel(QLabel):
     
     def mouseMoveEvent(self, event):
         """鼠标移动事件，更新选择区域"""
-        if self.selecting and self.pixmap():
+        if self.selecting and self.has_page():
             self.selection_end = event.pos()
             self.selection_rect = QRect(self.selection_start, self.selection_end).normalized()
             self.update()
     
     def mouseReleaseEvent(self, event):
         """鼠标释放事件，完成选择"""
-        if self.selecting and event.button() == Qt.LeftButton and self.pixmap():
+        if self.selecting and event.button() == Qt.LeftButton and self.has_page():
             self.selecting = False
             self.selection_end = event.pos()
             self.selection_rect = QRect(self.selection_start, self.selection_end).normalized()
             
             # 确保选择区域在图像范围内
-            pixmap_rect = self.pixmap().rect()
-            self.selection_rect = self.selection_rect.intersected(pixmap_rect)
+            page_rect = QRect(self.page_offset(), self.page_size)
+            self.selection_rect = self.selection_rect.intersected(page_rect)
             
             self.selection_changed.emit(self.selection_rect)
             self.update()
     
     def paintEvent(self, event):
-        """绘制事件，显示选择区域"""
+        """绘制事件，只绘制与可见区域相交的瓦片，并显示选择区域"""
         super().paintEvent(event)
         
-        if self.selection_rect and self.pixmap():
-            painter = QPainter(self)
+        if not self.has_page():
+            return
+        
+        painter = QPainter(self)
+        
+        # 在滚动区域中，event.rect() 即为视口内需要重绘的部分
+        if self.tile_provider:
+            offset = self.page_offset()
+            exposed = event.rect().translated(-offset).intersected(QRect(QPoint(0, 0), self.page_size))
+            if not exposed.isEmpty():
+                # 尚未渲染完成的瓦片先显示为白色
+                painter.fillRect(exposed.translated(offset), Qt.white)
+                for row in range(exposed.top() // TILE_SIZE, exposed.bottom() // TILE_SIZE + 1):
+                    for col in range(exposed.left() // TILE_SIZE, exposed.right() // TILE_SIZE + 1):
+                        tile = self.tile_provider(col, row)
+                        if tile is not None:
+                            painter.drawImage(offset.x() + col * TILE_SIZE, offset.y() + row * TILE_SIZE, tile)
+        
+        if self.selection_rect:
             pen = QPen(Qt.red, 2, Qt.SolidLine)
             painter.setPen(pen)
             painter.drawRect(self.selection_rect)
@@ -272,4 +626,4 @@ class PDFLabel(QLabel):
     
     def get_selection_rect(self):
         """获取选择区域"""
-        return self.selection_rect 
\ No newline at end of file
+        return self.selection_rect 
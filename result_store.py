@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import datetime
+import threading
+from contextlib import contextmanager
+
+# 默认的结果数据库文件
+DEFAULT_STORE_PATH = "pdf_extract_results.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    source TEXT NOT NULL,
+    pdf_path TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    name TEXT,
+    text TEXT,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_extractions_pdf ON extractions (pdf_path, page);
+CREATE TABLE IF NOT EXISTS files (
+    extraction_id INTEGER NOT NULL REFERENCES extractions (id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (extraction_id, filename)
+);
+"""
+
+class ResultStore:
+    """
+    单文件 SQLite 结果库
+
+    每次提取保存为 extractions 表中的一行，相关的图像、文本、索引等文件以 BLOB 形式
+    保存在 files 表中，不再为每次提取创建文件夹。批量写入可放在 transaction() 中一次提交。
+    需要原有文件夹布局时可通过 export_folder 导出。
+    """
+
+    def __init__(self, db_path=DEFAULT_STORE_PATH):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        批量写入事务，退出时统一提交（可嵌套，只有最外层提交）
+        """
+        with self._lock:
+            self._transaction_depth += 1
+            try:
+                yield self
+            except Exception:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._conn.rollback()
+                raise
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._conn.commit()
+
+    def _insert(self, record):
+        created_at = record.get("created_at") or datetime.datetime.now().isoformat(timespec="seconds")
+        cursor = self._conn.execute(
+            "INSERT INTO extractions (created_at, source, pdf_path, page, name, text, meta) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                created_at,
+                record.get("source", "region"),
+                record["pdf_path"],
+                record["page"],
+                record.get("name"),
+                record.get("text"),
+                json.dumps(record.get("meta"), ensure_ascii=False) if record.get("meta") is not None else None
+            )
+        )
+        extraction_id = cursor.lastrowid
+
+        files = record.get("files") or {}
+        if files:
+            self._conn.executemany(
+                "INSERT INTO files (extraction_id, filename, data) VALUES (?, ?, ?)",
+                [
+                    (extraction_id, filename, data.encode("utf-8") if isinstance(data, str) else data)
+                    for filename, data in files.items()
+                ]
+            )
+        return extraction_id
+
+    def add(self, record):
+        """
+        保存一条提取结果
+
+        Args:
+            record (dict): 包含 pdf_path、page，可选 source、name、text、meta（可JSON序列化）、
+                files（文件名 -> bytes/str）
+
+        Returns:
+            int: 记录ID
+        """
+        with self.transaction():
+            return self._insert(record)
+
+    def add_many(self, records):
+        """
+        在一个事务中批量保存多条提取结果
+
+        Args:
+            records (iterable): 记录列表，格式同 add
+
+        Returns:
+            list: 记录ID列表
+        """
+        with self.transaction():
+            return [self._insert(record) for record in records]
+
+    def get(self, extraction_id):
+        """
+        读取一条提取结果（不含文件内容）
+
+        Args:
+            extraction_id (int): 记录ID
+
+        Returns:
+            dict: 记录内容，包含文件名列表；不存在时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, created_at, source, pdf_path, page, name, text, meta FROM extractions WHERE id = ?",
+                (extraction_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            filenames = [r[0] for r in self._conn.execute(
+                "SELECT filename FROM files WHERE extraction_id = ? ORDER BY filename", (extraction_id,)
+            )]
+        return self._row_to_record(row, filenames)
+
+    @staticmethod
+    def _row_to_record(row, filenames=None):
+        record = {
+            "id": row[0],
+            "created_at": row[1],
+            "source": row[2],
+            "pdf_path": row[3],
+            "page": row[4],
+            "name": row[5],
+            "text": row[6],
+            "meta": json.loads(row[7]) if row[7] else None
+        }
+        if filenames is not None:
+            record["files"] = filenames
+        return record
+
+    def get_file(self, extraction_id, filename):
+        """
+        读取提取结果中的文件内容
+
+        Args:
+            extraction_id (int): 记录ID
+            filename (str): 文件名
+
+        Returns:
+            bytes: 文件内容，不存在时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM files WHERE extraction_id = ? AND filename = ?",
+                (extraction_id, filename)
+            ).fetchone()
+        return row[0] if row else None
+
+    def list(self, pdf_path=None, limit=100):
+        """
+        列出最近的提取结果
+
+        Args:
+            pdf_path (str): 只列出该PDF的结果
+            limit (int): 最多返回的条数
+
+        Returns:
+            list: 记录列表（不含文件名）
+        """
+        query = "SELECT id, created_at, source, pdf_path, page, name, text, meta FROM extractions"
+        params = []
+        if pdf_path:
+            query += " WHERE pdf_path = ?"
+            params.append(pdf_path)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def export_folder(self, extraction_id, folder=None):
+        """
+        将一条提取结果导出为原有的文件夹布局
+
+        Args:
+            extraction_id (int): 记录ID
+            folder (str): 目标文件夹，默认按记录时间命名 pdf_extract_YYYYmmdd_HHMMSS_<ID>
+
+        Returns:
+            str: 导出的文件夹路径，记录不存在时返回 None
+        """
+        record = self.get(extraction_id)
+        if record is None:
+            return None
+
+        if folder is None:
+            timestamp = datetime.datetime.fromisoformat(record["created_at"]).strftime("%Y%m%d_%H%M%S")
+            folder = f"pdf_extract_{timestamp}_{extraction_id}"
+        os.makedirs(folder, exist_ok=True)
+
+        for filename in record["files"]:
+            with open(os.path.join(folder, filename), 'wb') as f:
+                f.write(self.get_file(extraction_id, filename))
+        return folder
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class StoreOutput:
+    """
+    将单次提取的文件收集在内存中，完成时作为一条记录写入 ResultStore
+
+    与 text_extractor.FolderOutput 接口相同，可作为 extract_text_from_region 的 output 参数。
+    """
+
+    def __init__(self, store, source="region"):
+        self.store = store
+        self.source = source
+        self.files = {}
+
+    def write(self, filename, data):
+        self.files[filename] = data
+        # 返回导出为文件夹时的相对路径
+        return filename
+
+    def finish(self, pdf_path, page_num, text, meta=None):
+        return self.store.add({
+            "source": self.source,
+            "pdf_path": pdf_path,
+            "page": page_num,
+            "text": text,
+            "meta": meta,
+            "files": self.files
+        })
+
+    def discard(self):
+        self.files = {}
+
+def main():
+    parser = argparse.ArgumentParser(description="查看和导出提取结果数据库")
+    parser.add_argument("--db", default=DEFAULT_STORE_PATH, help="结果数据库路径")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="列出最近的提取结果")
+    list_parser.add_argument("--pdf", default=None, help="只列出该PDF的结果")
+    list_parser.add_argument("-n", "--limit", type=int, default=20, help="最多列出的条数")
+
+    export_parser = subparsers.add_parser("export", help="导出为文件夹布局")
+    export_parser.add_argument("ids", type=int, nargs="+", help="记录ID")
+    export_parser.add_argument("-o", "--output", default=None, help="目标文件夹（只导出一条时有效）")
+
+    args = parser.parse_args()
+    store = ResultStore(args.db)
+    try:
+        if args.command == "list":
+            for record in store.list(args.pdf, args.limit):
+                text = (record["text"] or "").replace("\n", " ")
+                name = f" [{record['name']}]" if record["name"] else ""
+                print(f"{record['id']}\t{record['created_at']}\t{record['pdf_path']} 第{record['page'] + 1}页{name}\t{text[:60]}")
+        else:
+            for extraction_id in args.ids:
+                folder = args.output if len(args.ids) == 1 else None
+                exported = store.export_folder(extraction_id, folder)
+                if exported:
+                    print(f"已导出: {exported}")
+                else:
+                    print(f"记录不存在: {extraction_id}", file=sys.stderr)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
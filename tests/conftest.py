@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # noqa: E402
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """
+    生成测试用PDF
+
+    pages 为每页的文本行列表 [(x, y, 文本), ...]，rotation 为各页的 /Rotate 值。
+    """
+    def make(name="doc.pdf", pages=(((72, 100, "Hello"),),), rotation=0, width=612, height=792):
+        doc = fitz.open()
+        for lines in pages:
+            page = doc.new_page(width=width, height=height)
+            for x, y, text in lines:
+                page.insert_text((x, y), text, fontsize=12)
+            if rotation:
+                page.set_rotation(rotation)
+        path = str(tmp_path / name)
+        doc.save(path)
+        doc.close()
+        return path
+    return make
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import batch_extractor
+from batch_extractor import normalize_template, parse_page_selector, extract_document, run_batch
+
+def test_normalize_template_orders_corners_and_accepts_dicts():
+    template = normalize_template({
+        "regions": {
+            "a": [100, 50, 10, 5],
+            "b": {"x0": 1, "y0": 2, "x1": 3, "y1": 4},
+        }
+    }, default_name="tpl")
+    assert template["name"] == "tpl"
+    assert template["pages"] == "all"
+    assert template["regions"]["a"] == (10, 5, 100, 50)
+    assert template["regions"]["b"] == (1, 2, 3, 4)
+
+@pytest.mark.parametrize("data", [{}, {"regions": {}}, {"regions": {"a": [1, 2, 3]}}])
+def test_normalize_template_rejects_bad_regions(data):
+    with pytest.raises(ValueError):
+        normalize_template(data)
+
+@pytest.mark.parametrize("selector, expected", [
+    ("all", [0, 1, 2, 3, 4]),
+    ("last", [4]),
+    ("2", [1]),
+    ("1-3", [0, 1, 2]),
+    ("2-last", [1, 2, 3, 4]),
+    ("1,3,5-7", [0, 2, 4]),
+    ("3,1-3", [2, 0, 1]),
+    ("9", []),
+])
+def test_parse_page_selector(selector, expected):
+    assert parse_page_selector(selector, 5) == expected
+
+def test_extract_document_reads_each_region_on_selected_pages(make_pdf):
+    path = make_pdf(pages=[[(72, 100, "Invoice 1"), (72, 300, "Total 10")],
+                           [(72, 100, "Invoice 2"), (72, 300, "Total 20")]])
+    template = normalize_template({
+        "pages": "all",
+        "regions": {"no": [60, 80, 300, 110], "total": [60, 280, 300, 310]},
+    })
+    result = extract_document(path, template)
+    assert result["error"] is None
+    assert result["pages"] == [0, 1]
+    assert [(r["page"], r["name"], r["text"]) for r in result["regions"]] == [
+        (0, "no", "Invoice 1"), (0, "total", "Total 10"),
+        (1, "no", "Invoice 2"), (1, "total", "Total 20"),
+    ]
+
+def test_extract_document_reports_errors(tmp_path):
+    template = normalize_template({"regions": {"a": [0, 0, 10, 10]}})
+    result = extract_document(str(tmp_path / "missing.pdf"), template)
+    assert result["error"]
+    assert result["regions"] == []
+
+def test_run_batch_streams_results_and_keeps_totals(make_pdf, tmp_path, monkeypatch):
+    paths = [make_pdf(f"d{i}.pdf") for i in range(3)] + [str(tmp_path / "missing.pdf")]
+    template = normalize_template({"regions": {"a": [60, 80, 300, 110]}})
+
+    # 在当前进程中执行，避免测试依赖进程池
+    monkeypatch.setattr(batch_extractor, "iter_batch",
+                        lambda pdf_paths, template, max_workers=None: (extract_document(p, template) for p in pdf_paths))
+    seen = []
+    summary = run_batch(paths, template, on_result=seen.append)
+    assert len(seen) == 4
+    assert summary["documents"] == 4
+    assert summary["failed"] == 1
+    assert summary["pages"] == 3
+    assert summary["regions"] == 3
+
+def test_iter_batch_returns_every_document(make_pdf):
+    paths = [make_pdf(f"d{i}.pdf", pages=[[(72, 100, f"Doc {i}")]]) for i in range(5)]
+    template = normalize_template({"regions": {"a": [60, 80, 300, 110]}})
+    results = list(batch_extractor.iter_batch(paths, template, max_workers=2))
+    assert sorted(r["regions"][0]["text"] for r in results) == [f"Doc {i}" for i in range(5)]
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import subprocess
+
+from extract_cli import iter_stdin_paths, iter_records
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_iter_stdin_paths_skips_blank_and_comment_lines():
+    stream = io.StringIO("a.pdf\n\n  # skipped\n b.pdf \n")
+    assert list(iter_stdin_paths(stream)) == ["a.pdf", "b.pdf"]
+
+def test_iter_records_emits_one_record_per_region_or_an_error():
+    result = {
+        "path": "a.pdf",
+        "template": "t",
+        "error": None,
+        "regions": [
+            {"page": 0, "name": "x", "rect": [0, 0, 1, 1], "text": "1"},
+            {"page": 1, "name": "x", "rect": [0, 0, 1, 1], "text": "2"},
+        ],
+    }
+    assert [r["text"] for r in iter_records(result)] == ["1", "2"]
+    failed = dict(result, error="boom", regions=[])
+    assert list(iter_records(failed)) == [{"pdf": "a.pdf", "template": "t", "error": "boom"}]
+
+def test_cli_writes_only_jsonl_to_stdout(make_pdf, tmp_path):
+    paths = [make_pdf(f"d{i}.pdf", pages=[[(72, 100, f"Doc {i}")]]) for i in range(2)]
+    template = tmp_path / "template.json"
+    template.write_text(json.dumps({"regions": {"a": [60, 80, 300, 110]}}), encoding="utf-8")
+    proc = subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "extract_cli.py"), str(template), "-w", "1", "-q"],
+        input="\n".join(paths), capture_output=True, text=True, timeout=120,
+    )
+    assert proc.returncode == 0
+    records = [json.loads(line) for line in proc.stdout.splitlines()]
+    assert sorted(r["text"] for r in records) == ["Doc 0", "Doc 1"]
+
+def test_cli_reports_failed_documents(make_pdf, tmp_path):
+    good = make_pdf(pages=[[(72, 100, "Doc")]])
+    missing = str(tmp_path / "missing.pdf")
+    template = tmp_path / "template.json"
+    template.write_text(json.dumps({"regions": {"a": [60, 80, 300, 110]}}), encoding="utf-8")
+    proc = subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "extract_cli.py"), str(template), good, missing, "-w", "1"],
+        capture_output=True, text=True, timeout=120,
+    )
+    assert proc.returncode == 1
+    records = {r["pdf"]: r for r in map(json.loads, proc.stdout.splitlines())}
+    assert records[good]["text"] == "Doc"
+    assert records[missing]["error"]
+    assert f"{missing}: 失败: {records[missing]['error']}" in proc.stderr.splitlines()
+    assert f"{good}: 1 个区域" in proc.stderr
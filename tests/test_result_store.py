@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import fitz
+import pytest
+
+import text_extractor
+from result_store import ResultStore, StoreOutput
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path / "results.db"))
+    yield store
+    store.close()
+
+def test_add_and_read_back(store):
+    extraction_id = store.add({
+        "pdf_path": "a.pdf",
+        "page": 2,
+        "name": "total",
+        "text": "42",
+        "meta": {"rect": [1, 2, 3, 4]},
+        "files": {"a.txt": "42", "a.png": b"\x89PNG"},
+    })
+    record = store.get(extraction_id)
+    assert record["pdf_path"] == "a.pdf"
+    assert record["page"] == 2
+    assert record["meta"] == {"rect": [1, 2, 3, 4]}
+    assert record["files"] == ["a.png", "a.txt"]
+    assert store.get_file(extraction_id, "a.txt") == b"42"
+    assert store.get_file(extraction_id, "a.png") == b"\x89PNG"
+    assert store.get(extraction_id + 1) is None
+
+def test_add_many_and_list_by_pdf(store):
+    ids = store.add_many([{"pdf_path": f"{i % 2}.pdf", "page": i, "text": str(i)} for i in range(5)])
+    assert len(ids) == 5
+    assert [r["page"] for r in store.list("0.pdf")] == [4, 2, 0]
+    assert len(store.list(limit=2)) == 2
+
+def test_transaction_rolls_back_on_error(store):
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.add({"pdf_path": "a.pdf", "page": 0})
+            raise RuntimeError("boom")
+    assert store.list() == []
+
+def test_export_folder_restores_the_files(store, tmp_path):
+    extraction_id = store.add({"pdf_path": "a.pdf", "page": 0, "files": {"index.md": "# 结果"}})
+    folder = store.export_folder(extraction_id, str(tmp_path / "export"))
+    assert (tmp_path / "export" / "index.md").read_text(encoding="utf-8") == "# 结果"
+    assert folder == str(tmp_path / "export")
+    assert store.export_folder(extraction_id + 1) is None
+
+def test_store_output_records_one_extraction(store, make_pdf):
+    path = make_pdf(pages=[[(72, 100, "Stored")]])
+    text, image_name, extraction_id = text_extractor.extract_text_from_region(
+        path, 0, fitz.Rect(60, 85, 300, 105), output=StoreOutput(store))
+    assert text == "Stored"
+    record = store.get(extraction_id)
+    assert record["text"] == "Stored"
+    assert image_name in record["files"]
+    assert "index.md" in record["files"]
+
+def test_store_output_writes_nothing_on_failure(store, make_pdf, monkeypatch):
+    path = make_pdf()
+
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(text_extractor, "get_page_text", fail)
+    output = StoreOutput(store)
+    assert text_extractor.extract_text_from_region(path, 0, fitz.Rect(60, 85, 300, 105), output=output)[0] is None
+    assert output.files == {}
+    assert store.list() == []
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import threading
+
+import fitz
+import pytest
+
+import text_extractor
+from text_extractor import DocumentCache, PageText
+
+def test_document_cache_reuses_open_documents(make_pdf):
+    path = make_pdf()
+    cache = DocumentCache(max_size=2)
+    doc = cache.get(path)
+    assert cache.get(path) is doc
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_document_cache_reopens_modified_files(make_pdf):
+    path = make_pdf()
+    cache = DocumentCache()
+    doc = cache.get(path)
+    make_pdf(pages=[[(72, 100, "Changed")]])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    reopened = cache.get(path)
+    assert reopened is not doc
+    assert doc.is_closed
+    assert cache.stats()["invalidations"] == 1
+
+def test_document_cache_evicts_least_recently_used(make_pdf):
+    paths = [make_pdf(f"d{i}.pdf") for i in range(3)]
+    cache = DocumentCache(max_size=2)
+    first = cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+    assert cache.stats()["evictions"] == 1
+    assert not first.is_closed
+    assert cache.get(paths[0]) is first
+
+def test_page_text_clips_by_character_centre(make_pdf):
+    path = make_pdf(pages=[[(72, 100, "First line"), (72, 120, "Second line"), (72, 400, "Far away")]])
+    with fitz.open(path) as doc:
+        page_text = PageText(doc[0])
+        assert page_text.text_in_rect(fitz.Rect(60, 85, 300, 125)) == "First line\nSecond line"
+        assert page_text.text_in_rect(fitz.Rect(60, 385, 300, 405)) == "Far away"
+        assert page_text.text_in_rect(fitz.Rect(300, 300, 400, 350)) == ""
+        assert page_text.text_in_rect(fitz.Rect()) == ""
+
+def test_page_text_grid_matches_a_full_scan(make_pdf):
+    lines = [(x, y, f"w{x}-{y}") for x in range(40, 560, 90) for y in range(60, 760, 35)]
+    path = make_pdf(pages=[lines])
+    with fitz.open(path) as doc:
+        page = doc[0]
+        coarse = PageText(page, cell_size=10000)  # 单个网格单元，相当于逐个检查所有字符
+        for cell_size in (8, 32, 100):
+            fine = PageText(page, cell_size=cell_size)
+            for rect in (fitz.Rect(0, 0, 612, 792), fitz.Rect(100, 100, 300, 400),
+                         fitz.Rect(35, 50, 140, 90), fitz.Rect(500, 700, 612, 792)):
+                assert fine.text_in_rect(rect) == coarse.text_in_rect(rect)
+
+def test_page_text_oversized_rect_is_clipped_to_the_text(make_pdf):
+    path = make_pdf(pages=[[(72, 100, "First line"), (72, 400, "Far away")]])
+    with fitz.open(path) as doc:
+        page_text = PageText(doc[0], cell_size=8)
+        start = time.perf_counter()
+        assert page_text.text_in_rect(fitz.Rect(-1e6, -1e6, 1e6, 1e6)) == "First line\nFar away"
+        assert page_text.text_in_rect(fitz.Rect(1e5, 1e5, 1e6, 1e6)) == ""
+        # 未裁剪时需要遍历约 6e10 个网格单元
+        assert time.perf_counter() - start < 1
+
+def test_query_region_text_reuses_the_page_index(make_pdf):
+    path = make_pdf(pages=[[(72, 100, "Indexed")]])
+    first = text_extractor.get_page_text(path, 0)
+    assert text_extractor.get_page_text(path, 0) is first
+    assert text_extractor.query_region_text(path, 0, fitz.Rect(60, 85, 300, 105)) == "Indexed"
+
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270])
+@pytest.mark.parametrize("zoom", [1.0, 2.0])
+def test_resolve_selection_rect_finds_text_on_rotated_pages(make_pdf, rotation, zoom):
+    path = make_pdf(pages=[[(72, 100, "Rotated text")]], rotation=rotation)
+    with fitz.open(path) as doc:
+        page = doc[0]
+        # 文字在渲染结果（已旋转）中的位置，按查看器缩放比例换算为像素坐标
+        shown = page.search_for("Rotated text")[0] * page.rotation_matrix
+        shown.normalize()
+        view_rect = (shown + (-2, -2, 2, 2)) * fitz.Matrix(zoom, zoom)
+
+        page_rect, text_rect = text_extractor.resolve_selection_rect(page, view_rect, zoom)
+        assert page_rect.contains(shown)
+        assert PageText(page).text_in_rect(text_rect) == "Rotated text"
+
+def test_resolve_selection_rect_clamps_to_the_page(make_pdf):
+    path = make_pdf(rotation=90)
+    with fitz.open(path) as doc:
+        page = doc[0]
+        page_rect, _ = text_extractor.resolve_selection_rect(page, fitz.Rect(-50, -50, 5000, 5000))
+        assert page_rect == page.rect
+
+def test_extract_text_from_region_writes_one_result(make_pdf, tmp_path):
+    path = make_pdf(pages=[[(72, 100, "Result text")]])
+    folder = tmp_path / "out"
+    folder.mkdir()
+    text, image_path, output_folder = text_extractor.extract_text_from_region(
+        path, 0, fitz.Rect(60, 85, 300, 105), output=text_extractor.FolderOutput(str(folder)))
+    assert text == "Result text"
+    assert output_folder == str(folder)
+    assert os.path.exists(image_path)
+
+def test_extract_text_from_region_discards_output_on_failure(make_pdf, tmp_path, monkeypatch):
+    path = make_pdf()
+    folder = tmp_path / "out"
+    folder.mkdir()
+
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    # 区域图像写入之后才失败，输出文件夹中已有文件
+    monkeypatch.setattr(text_extractor, "get_page_text", fail)
+    result = text_extractor.extract_text_from_region(
+        path, 0, fitz.Rect(60, 85, 300, 105), output=text_extractor.FolderOutput(str(folder)))
+    assert result == (None, None, None)
+    assert not folder.exists()
+
+def test_extract_text_from_region_discards_output_on_early_return(make_pdf, tmp_path):
+    path = make_pdf()
+    folder = tmp_path / "out"
+    folder.mkdir()
+    result = text_extractor.extract_text_from_region(
+        path, 5, fitz.Rect(60, 85, 300, 105), output=text_extractor.FolderOutput(str(folder)))
+    assert result == (None, None, None)
+    assert not folder.exists()
+
+def test_extract_text_from_region_discards_output_on_cancel(make_pdf, tmp_path):
+    path = make_pdf()
+    folder = tmp_path / "out"
+    folder.mkdir()
+    cancel = threading.Event()
+
+    def progress(percent, message):
+        if percent >= 10:
+            cancel.set()
+
+    with pytest.raises(text_extractor.ExtractionCancelled):
+        text_extractor.extract_text_from_region(
+            path, 0, fitz.Rect(60, 85, 300, 105), progress=progress, cancel_event=cancel,
+            output=text_extractor.FolderOutput(str(folder)))
+    assert not folder.exists()
+
+def test_preview_cache_is_bounded_by_bytes():
+    cache = text_extractor.PreviewCache(max_bytes=10)
+    doc = object()
+    cache.put("a", doc, b"12345")
+    cache.put("b", doc, b"12345")
+    cache.put("c", doc, b"12345")
+    assert cache.get("a", doc) is None
+    assert cache.get("c", doc) == b"12345"
+    assert cache.stats()["evictions"] == 1
+    # 文档被重新打开后旧的预览图不再命中
+    assert cache.get("c", object()) is None
+
+@pytest.mark.parametrize("rotation", [0, 90, 270])
+def test_diagnostic_previews_use_rotated_page_coordinates(make_pdf, tmp_path, rotation):
+    path = make_pdf(pages=[[(72, 100, "Preview me")]], rotation=rotation)
+    with fitz.open(path) as doc:
+        page = doc[0]
+        shown = page.search_for("Preview me")[0] * page.rotation_matrix
+        shown.normalize()
+        page_bounds = fitz.Rect(page.rect)
+    folder = tmp_path / "out"
+    folder.mkdir()
+    text_extractor.extract_text_from_region(path, 0, shown + (-2, -2, 2, 2), diagnostic=True,
+                                            output=text_extractor.FolderOutput(str(folder)))
+    debug_path = next(folder.glob("*_transforms.json"))
+    transforms = json.loads(debug_path.read_text(encoding="utf-8"))["transforms"]
+
+    for transform in transforms:
+        preview = fitz.Rect(*transform["preview_rect"].values())
+        if preview.is_empty:
+            continue
+        assert page_bounds.contains(preview)
+        # 提取到目标文本的变换，其预览区域必须覆盖显示页面上的这段文字
+        if transform["text"] == "Preview me":
+            assert preview.intersects(shown)
+            assert text_extractor.get_region_preview(path, 0, preview) is not None
+
+def test_stage_profiler_summarises_stages():
+    seen = []
+    profiler = text_extractor.StageProfiler(callback=seen.append, trace_memory=True)
+    for size in (10, 30):
+        with profiler.stage("write") as record:
+            record["bytes"] = size
+            data = bytearray(100_000)
+    del data
+    profiler.close()
+
+    summary = profiler.summary()
+    write = summary["stages"]["write"]
+    assert [record["stage"] for record in seen] == ["write", "write"]
+    assert write["calls"] == 2
+    assert write["bytes"] == 40
+    assert write["peak_bytes"] >= 100_000
+    assert summary["trace_memory"] is True
+
+def test_extraction_profile_is_written_with_the_result(make_pdf, tmp_path):
+    path = make_pdf()
+    folder = tmp_path / "out"
+    folder.mkdir()
+    text_extractor.extract_text_from_region(path, 0, fitz.Rect(60, 85, 300, 105),
+                                            output=text_extractor.FolderOutput(str(folder)))
+    profile = json.loads(next(folder.glob("*_transforms.json")).read_text(encoding="utf-8"))["profile"]
+    assert {"open", "load_page", "get_pixmap", "png_encode", "get_text", "text_in_rect", "write"} <= set(profile["stages"])
@@ -4,6 +4,147 @@
 import fitz
 import os
 import datetime
+import json
+import time
+import shutil
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from collections import OrderedDict
+
+# 文档缓存最多保留的打开文档数量
+DOCUMENT_CACHE_SIZE = 8
+
+# 页面文本索引缓存最多保留的页面数量
+PAGE_TEXT_CACHE_SIZE = 64
+
+# 页面文本空间索引的网格单元大小（PDF点）
+GRID_CELL_SIZE = 32.0
+
+# 区域预览图内存缓存的容量上限（字节）
+PREVIEW_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# MuPDF 不支持多个线程同时调用（即使使用不同的文档），
+# 在界面线程之外使用 fitz 时，所有线程都需持有此锁
+mupdf_lock = threading.RLock()
+
+class DocumentCache:
+    """
+    已打开 fitz.Document 的 LRU 缓存
+
+    以文件绝对路径为键，命中时校验文件的修改时间和大小，文件变化后自动重新打开。
+    超出容量时关闭最久未使用的文档。
+    """
+
+    def __init__(self, max_size=DOCUMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._docs = OrderedDict()  # 路径 -> (文件签名, 文档)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, pdf_path):
+        """
+        获取已打开的文档，未缓存或文件已变化时重新打开
+
+        Args:
+            pdf_path (str): PDF文件路径
+
+        Returns:
+            fitz.Document: 打开的文档（由缓存负责关闭，调用方不要关闭）
+        """
+        key = os.path.abspath(pdf_path)
+        signature = self._signature(key)
+
+        with self._lock:
+            entry = self._docs.get(key)
+            if entry is not None:
+                cached_signature, doc = entry
+                if cached_signature == signature and not doc.is_closed:
+                    self._docs.move_to_end(key)
+                    self.hits += 1
+                    return doc
+                # 文件已被修改，丢弃旧文档
+                del self._docs[key]
+                doc.close()
+                self.invalidations += 1
+
+            self.misses += 1
+            doc = fitz.open(key)
+            self._docs[key] = (signature, doc)
+
+            while len(self._docs) > self.max_size:
+                _, (_, old_doc) = self._docs.popitem(last=False)
+                old_doc.close()
+                self.evictions += 1
+            return doc
+
+    def invalidate(self, pdf_path=None):
+        """
+        移除指定文档的缓存，未指定路径时清空全部缓存
+
+        Args:
+            pdf_path (str): PDF文件路径
+        """
+        with self._lock:
+            if pdf_path is None:
+                keys = list(self._docs)
+            else:
+                keys = [os.path.abspath(pdf_path)]
+            for key in keys:
+                entry = self._docs.pop(key, None)
+                if entry is not None:
+                    entry[1].close()
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        Returns:
+            dict: 命中、未命中、淘汰、失效次数及当前大小
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._docs),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+# 模块共享的文档缓存
+document_cache = DocumentCache()
+
+def open_document(pdf_path):
+    """
+    从共享缓存中获取打开的PDF文档
+
+    Args:
+        pdf_path (str): PDF文件路径
+
+    Returns:
+        fitz.Document: 打开的文档（不要关闭）
+    """
+    return document_cache.get(pdf_path)
+
+def get_document_cache_stats():
+    """
+    获取共享文档缓存的统计信息
+
+    Returns:
+        dict: 缓存统计信息
+    """
+    return document_cache.stats()
 
 def create_timestamp_folder():
     """
@@ -16,231 +157,692 @@ def create_timestamp_folder():
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     folder_name = f"pdf_extract_{timestamp}"
     
-    # 确保文件夹存在
-    if not os.path.exists(folder_name):
-        os.makedirs(folder_name)
+    # 同一秒内多次提取时追加序号，避免结果互相覆盖
+    suffix = 1
+    while True:
+        try:
+            os.makedirs(folder_name)
+            return folder_name
+        except FileExistsError:
+            folder_name = f"pdf_extract_{timestamp}_{suffix}"
+            suffix += 1
+
+class FolderOutput:
+    """
+    按时间戳文件夹保存提取结果（默认的输出方式）
+
+    result_store.StoreOutput 提供相同接口，可将结果写入单个 SQLite 数据库。
+    """
+    
+    def __init__(self, folder=None):
+        self.folder = folder or create_timestamp_folder()
+    
+    def write(self, filename, data):
+        """
+        写入一个结果文件
+        
+        Args:
+            filename (str): 文件名
+            data (bytes/str): 文件内容
+            
+        Returns:
+            str: 文件路径
+        """
+        path = os.path.join(self.folder, filename)
+        if isinstance(data, str):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(data)
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+        return path
+    
+    def finish(self, pdf_path, page_num, text, meta=None):
+        """完成提取，返回输出文件夹路径"""
+        return self.folder
+    
+    def discard(self):
+        """删除未完成的输出"""
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+class PageText:
+    """
+    页面文本布局（整页只构建一次 TextPage）
+
+    构建时一次性提取整页的字符及其边界框，之后的区域查询全部在内存中裁剪，
+    不再为每个矩形重新构建 MuPDF 文本布局。字符中心点落在矩形内即视为属于该区域。
+    字符按中心点登记到均匀网格中，查询时只检查与矩形相交的网格单元。
+    """
+
+    def __init__(self, page, cell_size=GRID_CELL_SIZE):
+        self.page_number = page.number
+        self.rect = fitz.Rect(page.rect)
+        self.chars = []  # (x0, y0, x1, y1, 字符, 行号)
+        self.line_count = 0
+        self.cell_size = cell_size
+        self._grid = {}  # (列, 行) -> 字符下标列表
+        self._extent = None  # 所有字符中心点的范围 (x0, y0, x1, y1)
+
+        flags = fitz.TEXTFLAGS_RAWDICT & ~fitz.TEXT_PRESERVE_IMAGES
+        text_dict = page.get_text("rawdict", flags=flags)
+        for block in text_dict["blocks"]:
+            if block["type"] != 0:  # 只处理文本块
+                continue
+            for line in block["lines"]:
+                line_index = self.line_count
+                self.line_count += 1
+                for span in line["spans"]:
+                    for char in span["chars"]:
+                        x0, y0, x1, y1 = char["bbox"]
+                        self.chars.append((x0, y0, x1, y1, char["c"], line_index))
+
+        # 按字符中心点建立网格索引
+        for index, char in enumerate(self.chars):
+            cx, cy = (char[0] + char[2]) / 2, (char[1] + char[3]) / 2
+            self._grid.setdefault(self._cell(cx, cy), []).append(index)
+            if self._extent is None:
+                self._extent = (cx, cy, cx, cy)
+            else:
+                ex0, ey0, ex1, ey1 = self._extent
+                self._extent = (min(ex0, cx), min(ey0, cy), max(ex1, cx), max(ey1, cy))
+
+    def _cell(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def _chars_in_rect(self, rect):
+        if rect.is_empty or not self.chars:
+            return
+        # 先裁剪到字符所在范围，超大矩形（例如模板中“整页”的宽松坐标）不会遍历大量空网格单元
+        ex0, ey0, ex1, ey1 = self._extent
+        x0, y0 = max(rect.x0, ex0), max(rect.y0, ey0)
+        x1, y1 = min(rect.x1, ex1), min(rect.y1, ey1)
+        if x0 > x1 or y0 > y1:
+            return
+        col0, row0 = self._cell(x0, y0)
+        col1, row1 = self._cell(x1, y1)
+
+        indices = []
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                indices.extend(self._grid.get((col, row), ()))
+
+        # 保持原始阅读顺序
+        indices.sort()
+        for index in indices:
+            char = self.chars[index]
+            cx = (char[0] + char[2]) / 2
+            cy = (char[1] + char[3]) / 2
+            if rect.x0 <= cx <= rect.x1 and rect.y0 <= cy <= rect.y1:
+                yield char
+
+    def text_in_rect(self, rect):
+        """
+        获取矩形区域内的文本
+
+        Args:
+            rect (fitz.Rect): 矩形区域（页面文本坐标）
+
+        Returns:
+            str: 按行拼接的文本
+        """
+        rect = fitz.Rect(rect)
+        lines = {}
+        for char in self._chars_in_rect(rect):
+            lines.setdefault(char[5], []).append(char[4])
+
+        line_texts = []
+        for line_index in sorted(lines):
+            line_text = "".join(lines[line_index]).strip()
+            if line_text:
+                line_texts.append(line_text)
+        return "\n".join(line_texts)
+
+# 页面文本索引缓存：(文件路径, 页码) -> (文档, PageText)
+_page_text_cache = OrderedDict()
+_page_text_lock = threading.Lock()
+
+def get_page_text(pdf_path, page_num):
+    """
+    获取页面的文本索引，同一页面只构建一次
+
+    文档经共享文档缓存打开；文档被重新打开（例如文件已修改）时自动重建索引。
+
+    Args:
+        pdf_path (str): PDF文件路径
+        page_num (int): 页码（从0开始）
+
+    Returns:
+        PageText: 页面文本索引
+    """
+    doc = open_document(pdf_path)
+    key = (os.path.abspath(pdf_path), page_num)
+
+    with _page_text_lock:
+        entry = _page_text_cache.get(key)
+        if entry is not None and entry[0] is doc:
+            _page_text_cache.move_to_end(key)
+            return entry[1]
+
+    page_text = PageText(doc.load_page(page_num))
+
+    with _page_text_lock:
+        _page_text_cache[key] = (doc, page_text)
+        _page_text_cache.move_to_end(key)
+        while len(_page_text_cache) > PAGE_TEXT_CACHE_SIZE:
+            _page_text_cache.popitem(last=False)
+    return page_text
+
+def query_region_text(pdf_path, page_num, rect):
+    """
+    通过页面空间索引查询矩形区域内的文本（不写任何文件）
+
+    同一页面的多次查询共用一个索引，首次查询之后不再调用 MuPDF 文本提取。
+
+    Args:
+        pdf_path (str): PDF文件路径
+        page_num (int): 页码（从0开始）
+        rect (fitz.Rect): 矩形区域（页面文本坐标）
+
+    Returns:
+        str: 提取的文本内容
+    """
+    return get_page_text(pdf_path, page_num).text_in_rect(rect)
+
+class StageProfiler:
+    """
+    记录提取流程各阶段（打开文档、加载页面、提取文本、渲染、PNG编码、写文件、JSON序列化）的耗时和内存分配
+
+    耗时始终记录；trace_memory=True 时通过 tracemalloc 记录每个阶段的 Python 内存分配
+    （MuPDF 内部的 C 内存不在统计范围内，渲染阶段另外记录像素图的字节数）。
+
+    Args:
+        callback (callable): 每个阶段结束时调用 callback(记录字典)
+        trace_memory (bool): 是否统计内存分配（开销较大，默认关闭）
+    """
+
+    def __init__(self, callback=None, trace_memory=False):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.records = []
+        self._started_tracing = False
+        self._start = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextmanager
+    def stage(self, name):
+        """
+        统计一个阶段，产出的记录字典可由调用方补充字段（例如 bytes）
+        """
+        record = {"stage": name}
+        if self.trace_memory:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["ms"] = (time.perf_counter() - start) * 1000
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record["alloc_bytes"] = current - before
+                record["peak_bytes"] = peak - before
+            self.records.append(record)
+            if self.callback:
+                self.callback(record)
+
+    def summary(self):
+        """
+        按阶段汇总
+
+        Returns:
+            dict: {"total_ms", "trace_memory", "stages": {阶段名: {"calls", "total_ms", "max_ms", ...}}}
+        """
+        stages = {}
+        for record in self.records:
+            entry = stages.setdefault(record["stage"], {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["calls"] += 1
+            entry["total_ms"] += record["ms"]
+            entry["max_ms"] = max(entry["max_ms"], record["ms"])
+            for field in ("bytes", "alloc_bytes"):
+                if field in record:
+                    entry[field] = entry.get(field, 0) + record[field]
+            if "peak_bytes" in record:
+                entry["peak_bytes"] = max(entry.get("peak_bytes", 0), record["peak_bytes"])
+        return {
+            "total_ms": (time.perf_counter() - self._start) * 1000,
+            "trace_memory": self.trace_memory,
+            "stages": stages
+        }
+
+    def close(self):
+        """停止由本对象启动的 tracemalloc"""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+def _write_output(output, profiler, filename, data):
+    # 写入结果文件并计入 write 阶段
+    with profiler.stage("write") as record:
+        record["bytes"] = len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+        return output.write(filename, data)
+
+class PreviewCache:
+    """
+    区域预览图（PNG字节）的内存 LRU 缓存，按总字节数限制容量
+    """
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # 键 -> (文档, PNG字节)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, doc):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[0] is doc:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, doc, data):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old[1])
+            if len(data) > self.max_bytes:
+                return
+            self._items[key] = (doc, data)
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+# 模块共享的预览图缓存
+preview_cache = PreviewCache()
+
+def _preview_key(pdf_path, page_num, irect, scale):
+    return (os.path.abspath(pdf_path), page_num, tuple(irect), scale)
+
+def get_region_preview(pdf_path, page_num, rect, scale=1.0, profiler=None):
+    """
+    按需渲染区域预览图，结果缓存在内存中
+
+    Args:
+        pdf_path (str): PDF文件路径
+        page_num (int): 页码（从0开始）
+        rect (fitz.Rect): 预览区域（页面坐标，即 get_pixmap 的裁剪坐标）
+        scale (float): 渲染缩放比例
+        profiler (StageProfiler): 阶段计时器（可选）
+
+    Returns:
+        bytes: PNG图像数据，区域为空时返回 None
+    """
+    irect = fitz.IRect(rect)
+    if irect.is_empty:
+        return None
+    if profiler is None:
+        profiler = StageProfiler()
+
+    # 界面线程调用，需与后台提取/渲染线程互斥
+    with mupdf_lock:
+        with profiler.stage("open"):
+            doc = open_document(pdf_path)
+        key = _preview_key(pdf_path, page_num, irect, scale)
+        data = preview_cache.get(key, doc)
+        if data is None:
+            with profiler.stage("load_page"):
+                page = doc.load_page(page_num)
+            with profiler.stage("get_pixmap") as record:
+                pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=irect)
+                record["bytes"] = pix.size
+            with profiler.stage("png_encode") as record:
+                data = pix.tobytes("png")
+                record["bytes"] = len(data)
+            preview_cache.put(key, doc, data)
+    return data
+
+def get_preview_cache_stats():
+    """
+    获取预览图缓存的统计信息
+
+    Returns:
+        dict: 缓存统计信息
+    """
+    return preview_cache.stats()
+
+def resolve_selection_rect(page, view_rect, zoom=1.0):
+    """
+    将查看器中的选区确定性地映射为页面坐标和文本坐标
+
+    查看器按 zoom 渲染整页（渲染结果已包含页面旋转，原点为裁剪框左上角），
+    因此选区除以 zoom 即得到旋转后的页面坐标，可直接用于 get_pixmap(clip=...)；
+    再乘以 page.derotation_matrix 得到未旋转的文本坐标，用于文本提取。
+    文本坐标与渲染结果都以裁剪框（cropbox）左上角为原点，无需额外平移。
+
+    Args:
+        page (fitz.Page): 已加载的页面
+        view_rect (fitz.Rect): 查看器渲染图像上的选区（像素坐标）
+        zoom (float): 查看器的缩放比例
+
+    Returns:
+        tuple: (页面坐标矩形, 文本坐标矩形)，均已规范化并限制在页面范围内
+    """
+    zoom = zoom or 1.0
+    page_rect = fitz.Rect(view_rect) * fitz.Matrix(1.0 / zoom, 1.0 / zoom)
+    page_rect.normalize()
+    page_rect = page_rect.intersect(page.rect)
+
+    text_rect = page_rect * page.derotation_matrix
+    text_rect.normalize()
+    return page_rect, text_rect
+
+def _rect_to_dict(rect):
+    return {
+        "x0": float(rect.x0),
+        "y0": float(rect.y0),
+        "x1": float(rect.x1),
+        "y1": float(rect.y1)
+    }
+
+def _legacy_transforms(rect, page_width, page_height):
+    """
+    旧版的猜测式坐标变换，仅在诊断模式下使用
+
+    Args:
+        rect (fitz.Rect): 页面坐标中的选区
+        page_width (float): 页面宽度
+        page_height (float): 页面高度
+
+    Returns:
+        list: 变换列表
+    """
+    transforms = []
+    
+    # 1. 原始坐标
+    transforms.append({
+        "name": "原始坐标",
+        "rect": fitz.Rect(rect),
+        "description": "直接使用UI选择的坐标（适用于大多数纵向PDF）"
+    })
+    
+    # 2. 水平翻转
+    transforms.append({
+        "name": "水平翻转",
+        "rect": fitz.Rect(
+            page_width - rect.x1,
+            rect.y0,
+            page_width - rect.x0,
+            rect.y1
+        ),
+        "description": "X轴从右到左（适用于某些布局）"
+    })
     
-    return folder_name
+    # 3. 90度顺时针旋转
+    transforms.append({
+        "name": "90度顺时针",
+        "rect": fitz.Rect(
+            rect.y0,
+            page_width - rect.x1,
+            rect.y1,
+            page_width - rect.x0
+        ),
+        "description": "90度顺时针旋转(x,y) → (y, width-x)（适用于许多横向PDF）"
+    })
+    
+    # 4. 90度逆时针旋转
+    transforms.append({
+        "name": "90度逆时针",
+        "rect": fitz.Rect(
+            page_height - rect.y1,
+            rect.x0,
+            page_height - rect.y0,
+            rect.x1
+        ),
+        "description": "90度逆时针旋转(x,y) → (height-y, x)"
+    })
+    return transforms
+
+class ExtractionCancelled(Exception):
+    """提取任务被取消"""
 
-def extract_text_from_region(pdf_path, page_num, rect):
+def extract_text_from_region(pdf_path, page_num, rect, zoom=1.0, diagnostic=False,
+                             progress=None, cancel_event=None, output=None, profiler=None):
     """
     从PDF文件指定页面的特定区域提取文本
     
+    选区通过 resolve_selection_rect 确定性地映射到文本坐标，只提取一次文本、只渲染一次图像。
+    诊断模式下额外尝试旧版的四种猜测式坐标变换，并为每种变换保存文本（预览图按需生成）。
+    
     Args:
         pdf_path (str): PDF文件路径
         page_num (int): 页码（从0开始）
-        rect (fitz.Rect): 矩形区域
+        rect (fitz.Rect): 查看器渲染图像上的选区（像素坐标）
+        zoom (float): 查看器的缩放比例
+        diagnostic (bool): 是否启用多变换诊断模式
+        progress (callable): 进度回调 progress(百分比, 阶段说明)
+        cancel_event (threading.Event): 取消标志，被设置后在下一个阶段边界停止并删除输出文件夹
+        output: 结果输出方式，默认 FolderOutput（时间戳文件夹）；
+            传入 result_store.StoreOutput 时写入结果数据库
+        profiler (StageProfiler): 阶段计时器，可设置回调或启用内存统计；
+            各阶段汇总写入 _transforms.json 的 profile 字段（不含该文件自身的序列化和写入）
         
     Returns:
-        tuple: (提取的文本内容, 保存图像的路径, 输出文件夹)
-    """
-    if not os.path.exists(pdf_path):
-        print(f"文件不存在: {pdf_path}")
-        return None, None, None
+        tuple: (提取的文本内容, 保存图像的路径, 输出文件夹)；
+            使用 StoreOutput 时为 (提取的文本内容, 图像文件名, 记录ID)
         
-    if rect is None:
-        print("未指定区域")
-        return None, None, None
+    Raises:
+        ExtractionCancelled: 通过 cancel_event 取消时抛出
+    """
+    def report(percent, message):
+        # 在阶段边界检查取消标志并报告进度
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExtractionCancelled()
+        if progress:
+            progress(percent, message)
+    
+    if profiler is None:
+        profiler = StageProfiler()
     
+    completed = False
     try:
-        # 创建时间戳文件夹
-        output_folder = create_timestamp_folder()
-        
-        doc = fitz.open(pdf_path)
-        if page_num < 0 or page_num >= len(doc):
-            print(f"页面范围错误: {page_num}, 总页数: {len(doc)}")
-            doc.close()
+        if not os.path.exists(pdf_path):
+            print(f"文件不存在: {pdf_path}")
+            return None, None, None
+            
+        if rect is None:
+            print("未指定区域")
             return None, None, None
         
-        page = doc.load_page(page_num)
-        page_width = page.rect.width
-        page_height = page.rect.height
+        report(0, "打开文档")
+        # 只在调用 MuPDF 时持有全局锁，文件写入等耗时操作不阻塞界面线程的预览渲染
+        with mupdf_lock:
+            with profiler.stage("open"):
+                doc = open_document(pdf_path)
+            if page_num < 0 or page_num >= len(doc):
+                print(f"页面范围错误: {page_num}, 总页数: {len(doc)}")
+                return None, None, None
+            
+            with profiler.stage("load_page"):
+                page = doc.load_page(page_num)
+            page_width = page.rect.width
+            page_height = page.rect.height
+            rotation = page.rotation
+            rotation_matrix = page.rotation_matrix
+            cropbox = page.cropbox
+            mediabox = page.mediabox
+            # 未旋转的页面范围（文本坐标）
+            text_bounds = page.rect * page.derotation_matrix
+            
+            # 确定性坐标映射
+            page_rect, text_rect = resolve_selection_rect(page, rect, zoom)
+            if page_rect.is_empty:
+                print("选择区域不在页面范围内")
+                return None, None, None
+            
+            report(10, "渲染区域图像")
+            # 提取图像 - 使用页面坐标
+            img_irect = fitz.IRect(page_rect)
+            mat = fitz.Matrix(1, 1)  # 缩放比例，可根据需要调整
+            with profiler.stage("get_pixmap") as record:
+                pix = page.get_pixmap(matrix=mat, clip=img_irect)
+                record["bytes"] = pix.size
+            with profiler.stage("png_encode") as record:
+                image_data = pix.tobytes("png")
+                record["bytes"] = len(image_data)
+            # 页面和 Pixmap 的释放同样调用 MuPDF，在持锁时完成
+            pix = page = None
         
         # 检测PDF方向
         is_landscape = page_width > page_height
         orientation = "横向" if is_landscape else "纵向"
-        print(f"检测到PDF方向: {orientation} (宽={page_width}, 高={page_height})")
         
         # 记录原始UI矩形
         orig_rect = fitz.Rect(rect)
         
-        # 转换为整数矩形用于图像裁剪（使用原始坐标，图像提取是正确的）
-        img_irect = fitz.IRect(rect)
-        
-        # 提取图像 - 使用原始坐标
-        mat = fitz.Matrix(1, 1)  # 缩放比例，可根据需要调整
-        pix = page.get_pixmap(matrix=mat, clip=img_irect)
+        # 创建输出（默认为时间戳文件夹）
+        if output is None:
+            output = FolderOutput()
         
-        # 保存图像
+        # 保存图像，同时放入预览图缓存供结果表格使用
         pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
         image_filename = f"{pdf_name}_page_{page_num + 1}_area.png"
-        image_path = os.path.join(output_folder, image_filename)
-        pix.save(image_path)
+        image_path = _write_output(output, profiler, image_filename, image_data)
+        preview_cache.put(_preview_key(pdf_path, page_num, img_irect, 1.0), doc, image_data)
         print(f"区域图像已保存: {image_path}")
         
-        # 创建各种坐标变换选项
-        transforms = []
-        
-        # 1. 原始坐标
-        transforms.append({
-            "name": "原始坐标",
-            "rect": fitz.Rect(rect),
-            "description": "直接使用UI选择的坐标（适用于大多数纵向PDF）"
-        })
-        
-        # 2. 水平翻转
-        transforms.append({
-            "name": "水平翻转",
-            "rect": fitz.Rect(
-                page_width - rect.x1,
-                rect.y0,
-                page_width - rect.x0,
-                rect.y1
-            ),
-            "description": "X轴从右到左（适用于某些布局）"
-        })
-        
-        # 3. 90度顺时针旋转
-        transforms.append({
-            "name": "90度顺时针",
-            "rect": fitz.Rect(
-                rect.y0,
-                page_width - rect.x1,
-                rect.y1,
-                page_width - rect.x0
-            ),
-            "description": "90度顺时针旋转(x,y) → (y, width-x)（适用于许多横向PDF）"
-        })
-        
-        # 4. 90度逆时针旋转
-        transforms.append({
-            "name": "90度逆时针",
-            "rect": fitz.Rect(
-                page_height - rect.y1,
-                rect.x0,
-                page_height - rect.y0,
-                rect.x1
-            ),
-            "description": "90度逆时针旋转(x,y) → (height-y, x)"
-        })
+        # 确定性映射始终是第一个（也是推荐的）结果
+        transforms = [{
+            "name": "确定性映射",
+            "rect": text_rect,
+            "preview_rect": page_rect,
+            "image_path": image_path,
+            "description": f"根据页面旋转({rotation}°)和缩放比例({zoom:.2f})计算的文本坐标"
+        }]
+        if diagnostic:
+            transforms.extend(_legacy_transforms(page_rect, page_width, page_height))
         
         # 创建索引文件内容
         index_content = "# PDF区域提取结果\n\n"
         index_content += f"- **文件名**: {pdf_path}\n"
         index_content += f"- **页码**: {page_num + 1}\n"
         index_content += f"- **PDF方向**: {orientation}\n"
+        index_content += f"- **页面旋转**: {rotation}°\n"
         index_content += f"- **页面尺寸**: 宽={page_width}, 高={page_height}\n"
-        index_content += f"- **选择区域**: x0={rect.x0}, y0={rect.y0}, x1={rect.x1}, y1={rect.y1}\n\n"
+        index_content += f"- **选择区域**: x0={rect.x0}, y0={rect.y0}, x1={rect.x1}, y1={rect.y1} (缩放 {zoom:.2f})\n\n"
         index_content += "## 提取结果\n\n"
         index_content += "| 坐标转换 | 预览图 | 提取文本 | 适用场景 |\n"
         index_content += "|---------|--------|----------|----------|\n"
         
+        # 整页文本布局只构建一次，所有变换共用
+        report(30, "分析页面文本")
+        with mupdf_lock:
+            with profiler.stage("get_text"):
+                page_text = get_page_text(pdf_path, page_num)
+        
         # 尝试所有变换并记录结果
         transform_results = []
         transform_texts = []
-        best_transform_index = 0
+        longest_transform_index = 0
         max_text_length = 0
         
         for i, transform in enumerate(transforms):
+            report(40 + 40 * i // len(transforms), f"提取文本: {transform['name']}")
+            
+            # 获取并规范化矩形，确保在页面范围内
+            transform_rect = fitz.Rect(transform["rect"])
+            transform_rect.normalize()
+            transform_rect = transform_rect.intersect(text_bounds)
+            preview_path = transform.get("image_path")
+            
             try:
-                # 获取并规范化矩形
-                text_rect = transform["rect"]
-                if text_rect.x0 > text_rect.x1:
-                    text_rect.x0, text_rect.x1 = text_rect.x1, text_rect.x0
-                if text_rect.y0 > text_rect.y1:
-                    text_rect.y0, text_rect.y1 = text_rect.y1, text_rect.y0
+                # 提取文本
+                with profiler.stage("text_in_rect"):
+                    extracted_text = page_text.text_in_rect(transform_rect)
+                transform_texts.append(extracted_text)
                 
-                # 确保在页面范围内
-                text_rect = text_rect.intersect(page.rect)
+                # 保存文本
+                text_filename = f"{pdf_name}_page_{page_num + 1}_{transform['name']}.txt"
+                text_path = _write_output(output, profiler, text_filename, extracted_text)
                 
-                # 提取文本
-                try:
-                    text_dict = page.get_text("dict", clip=text_rect)
-                    extracted_text = ""
-                    for block in text_dict["blocks"]:
-                        if block["type"] == 0:  # 文本块
-                            for line in block["lines"]:
-                                line_text = ""
-                                for span in line["spans"]:
-                                    line_text += span["text"]
-                                extracted_text += line_text + "\n"
-                    
-                    # 去除尾部多余的换行符
-                    extracted_text = extracted_text.rstrip()
-                    transform_texts.append(extracted_text)
-                    
-                    # 保存文本
-                    text_filename = f"{pdf_name}_page_{page_num + 1}_{transform['name']}.txt"
-                    text_path = os.path.join(output_folder, text_filename)
-                    with open(text_path, 'w', encoding='utf-8') as f:
-                        f.write(extracted_text)
-                    
-                    # 同时提取该区域的图像
-                    preview_pix = page.get_pixmap(matrix=mat, clip=fitz.IRect(text_rect))
-                    preview_path = os.path.join(output_folder, f"{pdf_name}_page_{page_num + 1}_{transform['name']}.png")
-                    preview_pix.save(preview_path)
-                    
-                    # 记录结果
-                    transform_results.append({
-                        "name": transform["name"],
-                        "description": transform["description"],
-                        "rect": {
-                            "x0": float(text_rect.x0),
-                            "y0": float(text_rect.y0),
-                            "x1": float(text_rect.x1),
-                            "y1": float(text_rect.y1)
-                        },
-                        "text": extracted_text,
-                        "text_length": len(extracted_text),
-                        "has_text": len(extracted_text) > 0,
-                        "image_path": preview_path,
-                        "text_path": text_path
-                    })
-                    
-                    # 更新索引内容
-                    index_content += f"| {transform['name']} | [预览图]({os.path.basename(preview_path)}) | [文本]({os.path.basename(text_path)}) | {transform['description']} |\n"
-                    
-                    # 检查是否是最长文本（可能是最好的转换）
-                    if len(extracted_text) > max_text_length:
-                        max_text_length = len(extracted_text)
-                        best_transform_index = i
-                        
-                except Exception as e:
-                    print(f"提取文本失败 ({transform['name']}): {e}")
-                    transform_results.append({
-                        "name": transform["name"],
-                        "description": transform["description"],
-                        "rect": {
-                            "x0": float(text_rect.x0),
-                            "y0": float(text_rect.y0),
-                            "x1": float(text_rect.x1),
-                            "y1": float(text_rect.y1)
-                        },
-                        "error": str(e)
-                    })
-                    index_content += f"| {transform['name']} | [预览图]({os.path.basename(preview_path)}) | 提取失败 | {transform['description']} |\n"
+                # 诊断变换的预览图不在此处渲染，界面或调用方通过 get_region_preview 按需获取；
+                # 预览使用旋转后的页面坐标，需将文本坐标乘以 page.rotation_matrix（与页面不相交时为空矩形）
+                preview_rect = transform.get("preview_rect")
+                if preview_rect is None:
+                    if transform_rect.is_empty:
+                        preview_rect = fitz.Rect()
+                    else:
+                        preview_rect = transform_rect * rotation_matrix
+                        preview_rect.normalize()
+                
+                # 记录结果
+                transform_results.append({
+                    "name": transform["name"],
+                    "description": transform["description"],
+                    "rect": _rect_to_dict(transform_rect),
+                    "preview_rect": _rect_to_dict(preview_rect),
+                    "text": extracted_text,
+                    "text_length": len(extracted_text),
+                    "has_text": len(extracted_text) > 0,
+                    "image_path": preview_path,
+                    "text_path": text_path
+                })
+                
+                # 更新索引内容
+                preview_link = f"[预览图]({os.path.basename(preview_path)})" if preview_path else "按需生成"
+                index_content += f"| {transform['name']} | {preview_link} | [文本]({os.path.basename(text_path)}) | {transform['description']} |\n"
+                
+                # 记录提取最多文本的变换
+                if len(extracted_text) > max_text_length:
+                    max_text_length = len(extracted_text)
+                    longest_transform_index = i
                     
             except Exception as e:
-                print(f"处理变换失败 ({transform['name']}): {e}")
+                print(f"提取文本失败 ({transform['name']}): {e}")
+                transform_texts.append("")
+                transform_results.append({
+                    "name": transform["name"],
+                    "description": transform["description"],
+                    "rect": _rect_to_dict(transform_rect),
+                    "error": str(e)
+                })
+                index_content += f"| {transform['name']} | 无 | 提取失败 | {transform['description']} |\n"
         
-        # 添加建议的最佳转换
-        if transform_results:
-            best_transform = transform_results[best_transform_index]
-            recommended = "90度顺时针" if is_landscape else "原始坐标"
-            
-            index_content += "\n## 推荐使用\n\n"
-            index_content += f"基于PDF方向（{orientation}）和文本长度，推荐使用 **{recommended}** 坐标转换。\n\n"
-            index_content += f"实际提取最多文本的是: **{best_transform['name']}** (包含 {best_transform['text_length']} 个字符)\n"
+        # 推荐使用确定性映射
+        best_transform_index = 0
+        recommended = transforms[best_transform_index]["name"]
+        index_content += "\n## 推荐使用\n\n"
+        index_content += f"推荐使用 **{recommended}** 坐标转换。\n\n"
+        if diagnostic:
+            longest = transform_results[longest_transform_index]
+            index_content += f"诊断模式下提取最多文本的是: **{longest['name']}** (包含 {longest.get('text_length', 0)} 个字符)\n"
         
         # 保存索引文件
-        index_path = os.path.join(output_folder, "index.md")
-        with open(index_path, 'w', encoding='utf-8') as f:
-            f.write(index_content)
+        report(90, "保存结果")
+        index_path = _write_output(output, profiler, "index.md", index_content)
         
         # 保存调试信息JSON
         debug_filename = f"{pdf_name}_page_{page_num + 1}_transforms.json"
-        debug_path = os.path.join(output_folder, debug_filename)
-        import json
         debug_info = {
             "pdf_info": {
                 "path": pdf_path,
@@ -248,14 +850,15 @@ def extract_text_from_region(pdf_path, page_num, rect):
                 "width": page_width,
                 "height": page_height,
                 "orientation": orientation,
-                "is_landscape": is_landscape
-            },
-            "original_rect": {
-                "x0": float(orig_rect.x0),
-                "y0": float(orig_rect.y0),
-                "x1": float(orig_rect.x1),
-                "y1": float(orig_rect.y1)
+                "is_landscape": is_landscape,
+                "rotation": rotation,
+                "cropbox": _rect_to_dict(cropbox),
+                "mediabox": _rect_to_dict(mediabox)
             },
+            "zoom": zoom,
+            "diagnostic": diagnostic,
+            "original_rect": _rect_to_dict(orig_rect),
+            "page_rect": _rect_to_dict(page_rect),
             "image_rect": {
                 "x0": img_irect.x0,
                 "y0": img_irect.y0,
@@ -264,28 +867,40 @@ def extract_text_from_region(pdf_path, page_num, rect):
             },
             "transforms": transform_results,
             "recommended": recommended,
-            "best_match": best_transform_index
+            "best_match": best_transform_index,
+            "longest_match": longest_transform_index,
+            "profile": profiler.summary()
         }
-        with open(debug_path, 'w', encoding='utf-8') as f:
-            json.dump(debug_info, f, ensure_ascii=False, indent=2)
+        with profiler.stage("json_dump") as record:
+            debug_json = json.dumps(debug_info, ensure_ascii=False, indent=2)
+            record["bytes"] = len(debug_json)
+        _write_output(output, profiler, debug_filename, debug_json)
+        
+        best_text = transform_texts[best_transform_index]
+        output_folder = output.finish(pdf_path, page_num, best_text, debug_info)
         
         print(f"提取结果已保存到: {output_folder}")
         print(f"图像文件: {image_path}")
         print(f"结果索引: {index_path}")
         
-        doc.close()
-        
-        # 返回最佳转换的文本（或第一个转换的文本，如果没有找到最佳转换）
-        best_text = transform_texts[best_transform_index] if transform_texts else ""
+        completed = True
+        if progress:
+            progress(100, "完成")
         return best_text, image_path, output_folder
         
+    except ExtractionCancelled:
+        raise
     except Exception as e:
         print(f"提取文本时出错: {e}")
         import traceback
         traceback.print_exc()
         return None, None, None
+    finally:
+        # 失败、取消或提前返回时删除未完成的输出（时间戳文件夹或尚未写入数据库的记录）
+        if not completed and output is not None:
+            output.discard()
 
-def extract_text_with_formatting(pdf_path, page_num, rect):
+def extract_text_with_formatting(pdf_path, page_num, rect, zoom=1.0, output=None, profiler=None):
     """
     从PDF文件指定页面的特定区域提取文本并保留格式
     （此功能可以根据需求进一步扩展）
@@ -293,38 +908,33 @@ def extract_text_with_formatting(pdf_path, page_num, rect):
     Args:
         pdf_path (str): PDF文件路径
         page_num (int): 页码（从0开始）
-        rect (fitz.Rect): 矩形区域
+        rect (fitz.Rect): 查看器渲染图像上的选区（像素坐标）
+        zoom (float): 查看器的缩放比例
+        output: 结果输出方式，默认 FolderOutput（时间戳文件夹）
+        profiler (StageProfiler): 阶段计时器，各阶段汇总写入格式化JSON文件的 profile 字段
         
     Returns:
-        tuple: (包含文本内容及格式信息的字典, 输出文件夹路径)
+        tuple: (包含文本内容及格式信息的字典, 输出文件夹路径或记录ID)
     """
+    if profiler is None:
+        profiler = StageProfiler()
+    
     try:
-        # 创建时间戳文件夹
-        output_folder = create_timestamp_folder()
+        # 创建输出（默认为时间戳文件夹）
+        if output is None:
+            output = FolderOutput()
         
-        doc = fitz.open(pdf_path)
-        page = doc.load_page(page_num)
+        with profiler.stage("open"):
+            doc = open_document(pdf_path)
+        with profiler.stage("load_page"):
+            page = doc.load_page(page_num)
         
-        # 转换坐标系 - 使用90度顺时针旋转
-        page_width = page.rect.width
-        text_rect = fitz.Rect(
-            rect.y0,                # 原x变为y
-            page_width - rect.x1,   # 原width-x变为y
-            rect.y1,                # 原x变为y
-            page_width - rect.x0    # 原width-x变为y
-        )
-        
-        # 确保矩形有效
-        if text_rect.x0 > text_rect.x1:
-            text_rect.x0, text_rect.x1 = text_rect.x1, text_rect.x0
-        if text_rect.y0 > text_rect.y1:
-            text_rect.y0, text_rect.y1 = text_rect.y1, text_rect.y0
-            
-        # 确保矩形有效且在页面范围内
-        text_rect = text_rect.intersect(page.rect)
+        # 转换坐标系 - 根据页面旋转和缩放比例确定性映射
+        _, text_rect = resolve_selection_rect(page, rect, zoom)
         
         # 获取区域内的文本块
-        blocks = page.get_text("dict", clip=text_rect)["blocks"]
+        with profiler.stage("get_text"):
+            blocks = page.get_text("dict", clip=text_rect)["blocks"]
         
         result = {
             "text": "",
@@ -364,17 +974,19 @@ def extract_text_with_formatting(pdf_path, page_num, rect):
         # 保存格式化文本
         pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
         formatted_filename = f"{pdf_name}_page_{page_num + 1}_formatted.json"
-        formatted_path = os.path.join(output_folder, formatted_filename)
         
-        import json
-        with open(formatted_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        with profiler.stage("json_dump") as record:
+            formatted_json = json.dumps(dict(result, profile=profiler.summary()), ensure_ascii=False, indent=2)
+            record["bytes"] = len(formatted_json)
+        formatted_path = _write_output(output, profiler, formatted_filename, formatted_json)
         print(f"格式化文本已保存: {formatted_path}")
         
-        doc.close()
-        return result, output_folder
+        return result, output.finish(pdf_path, page_num, result["text"])
     except Exception as e:
         print(f"提取格式化文本时出错: {e}")
+        # 删除未完成的输出
+        if output is not None:
+            output.discard()
         return None, None
 
 def get_page_count(pdf_path):
@@ -388,10 +1000,8 @@ def get_page_count(pdf_path):
         int: 页数
     """
     try:
-        doc = fitz.open(pdf_path)
-        count = len(doc)
-        doc.close()
-        return count
+        doc = open_document(pdf_path)
+        return len(doc)
     except Exception as e:
         print(f"获取页数时出错: {e}")
         return 0 
\ No newline at end of file